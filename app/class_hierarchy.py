@@ -0,0 +1,97 @@
+"""
+The transitive closure of a schema's class hierarchy, is_a and mixins, computed once per schema.
+
+Classes are numbered in name order, and each class has a bitset, a Python int, of its ancestors and one of its descendants,
+where bit i stands for the i-th class. An is-a check tests one bit, and a class's descendants are read off its bitset
+already sorted by name, instead of walking the hierarchy per class with SchemaView.class_ancestors().
+"""
+
+import weakref
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from linkml_runtime import SchemaView  # type: ignore
+
+
+def bit_positions(bits: int) -> List[int]:
+    """The positions of the set bits, lowest first."""
+    positions = []
+    while bits:
+        lowest = bits & -bits
+        positions.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return positions
+
+
+class ClassHierarchy:
+    """Ancestors, descendants and is-a checks for every class, from each class's class_ancestors()."""
+
+    def __init__(self, ancestors: Mapping[str, Sequence[str]]):
+        self.names: List[str] = sorted(ancestors)
+        self.positions: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        # class position -> ancestor positions, in class_ancestors() order, starting with the class itself
+        self.ancestor_positions: List[List[int]] = []
+        self.ancestor_bits: List[int] = []
+        self.descendant_bits: List[int] = [0] * len(self.names)
+        for i, name in enumerate(self.names):
+            positions = [self.positions[str(a)] for a in ancestors[name]]
+            if i not in positions:
+                positions.insert(0, i)
+            self.ancestor_positions.append(positions)
+            bits = 0
+            for position in positions:
+                bits |= 1 << position
+                self.descendant_bits[position] |= 1 << i
+            self.ancestor_bits.append(bits)
+
+    def position(self, class_name: str) -> int:
+        """ValueError if there is no such class."""
+        try:
+            return self.positions[class_name]
+        except KeyError:
+            raise ValueError(f"No such class {class_name}")
+
+    def __contains__(self, class_name: object) -> bool:
+        return class_name in self.positions
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def ancestors(self, class_name: str, reflexive: bool = True) -> List[str]:
+        """Like class_ancestors(): nearest first, starting with the class itself if reflexive."""
+        positions = self.ancestor_positions[self.position(class_name)]
+        return [self.names[i] for i in (positions if reflexive else positions[1:])]
+
+    def descendants(self, class_name: str, reflexive: bool = True) -> List[str]:
+        """Sorted by name, including the class itself if reflexive."""
+        i = self.position(class_name)
+        bits = self.descendant_bits[i]
+        if not reflexive:
+            bits &= ~(1 << i)
+        return [self.names[j] for j in bit_positions(bits)]
+
+    def is_a(self, class_name: str, ancestor: str) -> bool:
+        """True if ancestor is the class or one of its ancestors, through is_a or mixins."""
+        return bool(
+            (self.ancestor_bits[self.position(class_name)] >> self.position(ancestor))
+            & 1
+        )
+
+
+# id(view) -> (view.modifications, hierarchy). an entry is dropped when its view is garbage collected,
+# so views evicted from a ViewCache aren't kept alive here
+view_hierarchies: Dict[int, Tuple[int, ClassHierarchy]] = {}
+
+
+def hierarchy_of_view(view: SchemaView) -> ClassHierarchy:
+    """The view's ClassHierarchy. Computed again once the view is modified."""
+    cached = view_hierarchies.get(id(view))
+    if cached is not None and cached[0] == view.modifications:
+        return cached[1]
+    modifications = view.modifications
+    hierarchy = ClassHierarchy(
+        {str(c): view.class_ancestors(c) for c in view.all_classes()}
+    )
+    if cached is None:
+        weakref.finalize(view, view_hierarchies.pop, id(view), None)
+    view_hierarchies[id(view)] = (modifications, hierarchy)
+    return hierarchy
@@ -0,0 +1,82 @@
+"""
+One connection-pooled requests.Session for everything app/ fetches over HTTP, like TSVs and schemas on raw.githubusercontent.com,
+and an httpx.AsyncClient with the same limits for async endpoints.
+
+Connections are kept alive and reused between requests, and every request gets a timeout.
+"""
+
+import asyncio
+import os
+import weakref
+from typing import Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT_ENV = "NMDC_UTILS_HTTP_CONNECT_TIMEOUT"
+HTTP_READ_TIMEOUT_ENV = "NMDC_UTILS_HTTP_READ_TIMEOUT"
+HTTP_POOL_SIZE_ENV = "NMDC_UTILS_HTTP_POOL_SIZE"
+
+# seconds to connect, and seconds to wait between bytes
+DEFAULT_TIMEOUT: Tuple[float, float] = (
+    float(os.environ.get(HTTP_CONNECT_TIMEOUT_ENV, "5")),
+    float(os.environ.get(HTTP_READ_TIMEOUT_ENV, "60")),
+)
+
+# connections kept open per host
+POOL_SIZE = int(os.environ.get(HTTP_POOL_SIZE_ENV, "10"))
+
+
+def make_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """A Session that keeps up to pool_size connections per host, and retries idempotent requests on 502/503/504."""
+    retry = Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "HEAD"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+shared_session = make_session()
+
+
+# an AsyncClient's connections belong to the event loop that opened them, so each loop gets its own client
+async_clients: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+) = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The AsyncClient for the running event loop. Call from async code."""
+    loop = asyncio.get_running_loop()
+    client = async_clients.get(loop)
+    if client is None or client.is_closed:
+        connect_timeout, read_timeout = DEFAULT_TIMEOUT
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            # like the requests pool, more connections can open, but only POOL_SIZE are kept
+            limits=httpx.Limits(
+                max_connections=None, max_keepalive_connections=POOL_SIZE
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=2),
+            # like requests, e.g. for GitHub URLs of renamed repositories
+            follow_redirects=True,
+        )
+        async_clients[loop] = client
+    return client
+
+
+async def close_async_client() -> None:
+    client = async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,126 @@
+"""
+Encodes LinkML runtime objects (SlotDefinition, ClassDefinition, PatternExpression...) straight to JSON.
+
+linkml_to_jsonable() gives the same result as json.loads(json_dumper.dumps(obj)) in one walk over the object,
+without building and re-parsing an indented JSON string.
+dumps() writes JSON bytes with orjson.
+"""
+
+import hashlib
+import json
+from collections.abc import Set
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Tuple
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from jsonasobj2 import JsonObj  # type: ignore
+from linkml_runtime.utils.yamlutils import YAMLRoot  # type: ignore
+
+# keys jsonasobj2 never serializes
+HIDDEN_KEYS = {"_if_missing", "_root"}
+
+
+def is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, (dict, list)) and not value)
+
+
+def decimal_to_number(value: Decimal) -> Any:
+    as_str = str(value)
+    if "." in as_str and not as_str.endswith(".0"):
+        return float(value)
+    return int(value)
+
+
+def walk_dict(pairs: Iterable[Tuple[Any, Any]]) -> Any:
+    """A dict of the walked values, or its one value if linkml_runtime would unwrap it."""
+    obj_dict: Dict[str, Any] = {}
+    for key, value in pairs:
+        if key in HIDDEN_KEYS:
+            continue
+        value = walk(value)
+        if not is_empty(value):
+            obj_dict[str(key)] = value
+    if len(obj_dict) == 1:
+        # same unwrapping as linkml_runtime's remove_empty_items(hide_protected_keys=True)
+        only_key, only_value = next(iter(obj_dict.items()))
+        if (
+            only_key == "_code"
+            and isinstance(only_value, dict)
+            and only_value.get("text") is not None
+        ):
+            return only_value["text"]
+        if str(only_key).startswith("_") and isinstance(only_value, dict):
+            return only_value
+    return obj_dict
+
+
+def walk(obj: Any) -> Any:
+    """Converts obj to plain JSON types, dropping None values and empty lists and dicts."""
+    # most values are str subclasses like extended_str or SlotDefinitionName
+    if isinstance(obj, str):
+        return str(obj)
+    if obj is None or isinstance(obj, bool):
+        return obj
+    if isinstance(obj, int):
+        return int(obj)
+    if isinstance(obj, float):
+        return obj
+    if isinstance(obj, list):
+        return [e for e in (walk(e) for e in obj if e != "_root") if not is_empty(e)]
+    if isinstance(obj, dict):
+        return walk_dict(obj.items())
+    if isinstance(obj, JsonObj):
+        hidden = obj._hide_list()
+        if isinstance(hidden, list):
+            return walk(hidden)
+        return walk_dict(hidden.__dict__.items())
+    if isinstance(obj, Decimal):
+        return decimal_to_number(obj)
+    if isinstance(obj, (Set, tuple)):
+        return [walk(e) for e in obj]
+    return obj
+
+
+def linkml_to_jsonable(obj: Any, inject_type: bool = True) -> Any:
+    """The JSON-compatible equivalent of json.loads(json_dumper.dumps(obj))."""
+    jsonable = walk(obj)
+    if inject_type and isinstance(obj, YAMLRoot):
+        if not isinstance(jsonable, dict):
+            jsonable = {}
+        jsonable["@type"] = obj.__class__.__name__
+    return jsonable
+
+
+def fingerprint(value: Any) -> str:
+    """sha256 of value's canonical JSON. value must already be JSON-compatible."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def default(obj: Any) -> Any:
+    """Fallback for values orjson can't encode natively."""
+    if isinstance(obj, (JsonObj, Decimal)):
+        return linkml_to_jsonable(obj, inject_type=False)
+    # includes the ordered sets and types in DeepDiff results
+    if isinstance(obj, Set):
+        return list(obj)
+    if isinstance(obj, type):
+        return obj.__name__
+    return jsonable_encoder(obj)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact JSON bytes for content, which may be or contain LinkML objects."""
+    if isinstance(content, YAMLRoot):
+        content = linkml_to_jsonable(content)
+    # keys are often str subclasses like SlotDefinitionName, which orjson only takes with OPT_NON_STR_KEYS
+    return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class LinkMLJSONResponse(JSONResponse):
+    """A JSONResponse that can be handed LinkML objects directly, e.g. return LinkMLJSONResponse(slot_obj)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -4,33 +4,139 @@ https://github.com/turbomam/fastapi_docker
 
 # todo mypy --strict app
 
+import asyncio
 import csv
-import json
-from typing import Dict, List, Union, Tuple, Any
-
-import requests
-
-from deepdiff import DeepDiff  # type: ignore
+import hmac
+import io
+import itertools
+import logging
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import httpx
 
 # import linkml
-# import nmdc_schema
-# import pkgutil
-from fastapi import FastAPI, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Form, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from linkml_runtime import SchemaView  # type: ignore
 
-from linkml_runtime.dumpers import json_dumper  # type: ignore
 from pydantic import BaseModel, Field, AnyUrl
 
+import app.utilities as au
+from app.http_session import close_async_client, get_async_client
+from app.linkml_json import LinkMLJSONResponse, dumps
+from app.response_cache import ResponseCache
+from app.schema_compare import SchemaFingerprints, compare_schemas, fingerprint_schema
+from app.schema_documents import load_view_async
+from app.schema_index import induced_slot_to_dict
+from app.schema_state import SchemaHolder, SchemaState, load_schema_state
+from app.schema_versions import SchemaVersions
+from app.schema_workers import (
+    PROCESS_POOL_SIZE,
+    SchemaLoadError,
+    call_in_worker,
+    class_slot_names,
+    compare_schema_urls,
+    derive,
+    derived_key,
+    run_in_worker,
+    shutdown_process_pool,
+)
+from app.slot_diff import diff_slot_dicts, iter_diff_changes, iter_global_usage_diffs
+from app.tsv_columns import TSVColumnCache
+
 # names_ages_file = "names_ages.tsv"
 # names_ages_data: List[Dict[str, Union[str, int]]] = []
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN_ENV = "NMDC_UTILS_ADMIN_TOKEN"
+
+app = FastAPI(default_response_class=LinkMLJSONResponse)
+
+
+def build_off_request_path(func: Callable[..., Any], *args: Any) -> Any:
+    """func(*args) in a schema worker process if there is a pool, otherwise in the calling thread."""
+    if PROCESS_POOL_SIZE:
+        return call_in_worker(func, *args)
+    return func(*args)
+
+
+# the schema version being served. precompiled in the Docker image (NMDC_SCHEMA_INDEX), or built at startup.
+# endpoints take schema_holder.current() once, so a reload never changes the version under a request
+schema_holder = SchemaHolder(load_schema_state(), builder=build_off_request_path)
+
+schema_refresher: Optional["asyncio.Task[None]"] = None
+
+# other versions, requested with ?version=. see app/schema_versions.py
+schema_versions = SchemaVersions(builder=build_off_request_path)
+
+
+def get_schema_view() -> SchemaView:
+    """The current version's full SchemaView, for lookups the index doesn't cover. Loaded on first use.
+
+    bundled or baked-in schema first, remote URL only when NMDC_SCHEMA_ALLOW_REMOTE is set. see app/schema_source.py
+    """
+    return schema_holder.current().view()
+
+
+# encoded bodies of the schema lookups, keyed by endpoint, path parameters and the index's digest
+response_cache = ResponseCache()
+
+# schemas from user-supplied URLs
+view_cache = au.ViewCache()
+
+# column value sets of the MIxS TSVs
+tsv_column_cache = TSVColumnCache()
+
+
+@app.on_event("shutdown")
+async def close_http_clients() -> None:
+    await close_async_client()
+
+
+@app.on_event("shutdown")
+async def stop_schema_workers() -> None:
+    await run_in_threadpool(shutdown_process_pool)
 
-# decoded_schema = io.BytesIO(pkgutil.get_data("nmdc_schema.nmdc_data", "nmdc.yaml")).getvalue().decode("utf-8")
-schema_url = "https://raw.githubusercontent.com/microbiomedata/nmdc-schema/main/src/schema/nmdc.yaml"
-schema_view = SchemaView(schema_url)
+
+async def refresh_schema_periodically() -> None:
+    while True:
+        await asyncio.sleep(schema_holder.refresh_interval)
+        try:
+            await run_in_threadpool(schema_holder.reload)
+        except Exception as e:
+            logger.error(f"Couldn't reload the NMDC schema: {e}")
+
+
+@app.on_event("startup")
+async def start_schema_refresher() -> None:
+    global schema_refresher
+    if schema_holder.refresh_interval > 0:
+        schema_refresher = asyncio.ensure_future(refresh_schema_periodically())
+
+
+@app.on_event("shutdown")
+async def stop_schema_refresher() -> None:
+    if schema_refresher is not None:
+        schema_refresher.cancel()
 
 
 # # just showing how to return TSV
@@ -53,50 +159,171 @@ def read_root() -> str:
     return "see /docs for API documentation"
 
 
+def get_schema_state(version: Optional[str]) -> SchemaState:
+    """The schema being served, or another version of it listed in NMDC_SCHEMA_VERSIONS. 404 for other versions."""
+    state = schema_holder.current()
+    if version is None or version == state.index.version:
+        return state
+    try:
+        versioned = schema_versions.get(version)
+    except Exception as e:
+        raise HTTPException(
+            status_code=502, detail=f"Couldn't load schema version {version}: {e}"
+        )
+    if versioned is None:
+        available = [state.index.version, *schema_versions.available()]
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown schema version {version}, try one of {', '.join(available)}",
+        )
+    return versioned
+
+
+@app.get("/schema_versions/")
+# async
+def get_schema_versions() -> Dict[str, Any]:
+    """The version served by default, and the others that can be requested with ?version="""
+    return {
+        "current": schema_holder.current().index.version,
+        "available": schema_versions.available(),
+    }
+
+
 @app.get("/get_global_slot/{slot_name}")
 # async
-def get_global_slot(slot_name: str) -> Any:
-    slot_obj = schema_view.get_slot(slot_name)
-    slot_json = json_dumper.dumps(slot_obj)
-    # fastapi custom json serializer?
-    # generate pydantic classes for tight integration with fastapi
-    slot_dict = json.loads(slot_json)
-    return slot_dict
+def get_global_slot(
+    slot_name: str, request: Request, version: Optional[str] = None
+) -> Any:
+    """The slot's global definition, in the schema being served or the requested version of it"""
+    index = get_schema_state(version).index
+    return response_cache.respond(
+        request,
+        ("get_global_slot", slot_name, index.digest),
+        lambda: index.global_slots.get(slot_name),
+    )
+
+
+def get_induced_slot_dict(state: SchemaState, slot_name: str, class_name: str) -> dict:
+    """Looks up the slot's induced definition in the class in the index.
+
+    Only the slots a class actually uses are materialized, so other pairs fall back to the SchemaView.
+    Unknown classes and slots are 404s straight from the index, without loading the SchemaView.
+    """
+    index = state.index
+    usage_slot_dict = index.get_induced_slot(slot_name, class_name)
+    if usage_slot_dict is not None:
+        return usage_slot_dict
+    if class_name not in index.class_slots:
+        raise HTTPException(status_code=404, detail=f"No such class {class_name}")
+    if slot_name not in index.global_slots:
+        raise HTTPException(status_code=404, detail=f"No such slot {slot_name}")
+    try:
+        return induced_slot_to_dict(state.view(), slot_name, class_name)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 
 @app.get("/get_slot_class_usage/{slot_name}/{class_name}")
 # async
-def get_slot_class_usage(slot_name: str, class_name: str) -> Any:
-    usage_slot_obj = schema_view.induced_slot(slot_name, class_name)
-    usage_slot_json = json_dumper.dumps(usage_slot_obj)
-    usage_slot_dict = json.loads(usage_slot_json)
-    return usage_slot_dict
+def get_slot_class_usage(
+    slot_name: str, class_name: str, request: Request, version: Optional[str] = None
+) -> Any:
+    """The slot's induced definition in the class, in the schema being served or the requested version of it"""
+    state = get_schema_state(version)
+    return response_cache.respond(
+        request,
+        ("get_slot_class_usage", slot_name, class_name, state.index.digest),
+        lambda: get_induced_slot_dict(state, slot_name, class_name),
+    )
 
 
 # @app.get("/slot_class_usage/{global_schema_url}/{slot_name}/{class_name}/{usage_schema_url}")
 @app.get("/get_global_usage_diff/{slot_name}/{class_name}")
 # def get_global_usage_diff(global_schema_url: str, slot_name: str, class_name: str, usage_view: str):
 # async
-def get_global_usage_diff(slot_name: str, class_name: str) -> Any:
+def get_global_usage_diff(slot_name: str, class_name: str, request: Request) -> Any:
     """
     Provide the name of a slot in the NMDC schema, and the name of a class that uses that slot.
-    A DeepDiff difference between the slot's global definition and it's usage within the class will be returned.
+    A DeepDiff-style difference between the slot's global definition and it's usage within the class will be returned.
     """
     # global_view = SchemaView(global_schema_url)
     # usage_view = SchemaView(usage_schema_url)
-    # class_obj = schema_view.induced_class(class_name)
+    state = schema_holder.current()
+
+    def global_vs_usage() -> Any:
+        global_slot_dict = state.index.global_slots.get(slot_name)
+        usage_slot_dict = get_induced_slot_dict(state, slot_name, class_name)
+        return diff_slot_dicts(global_slot_dict, usage_slot_dict)
 
-    global_slot_obj = schema_view.get_slot(slot_name)
-    global_slot_json = json_dumper.dumps(global_slot_obj)
-    global_slot_dict = json.loads(global_slot_json)
+    return response_cache.respond(
+        request,
+        ("get_global_usage_diff", slot_name, class_name, state.index.digest),
+        global_vs_usage,
+    )
+
+
+@app.get("/get_global_usage_diff_report/")
+# async
+def get_global_usage_diff_report(
+    output_format: str = Query(
+        default="ndjson", alias="format", regex="^(ndjson|tsv)$"
+    ),
+    overrides_only: bool = True,
+) -> StreamingResponse:
+    """
+    The global vs. usage difference for every slot of every class in the NMDC schema, streamed as it is computed.
+    ndjson has one {"class", "slot", "diff"} object per line. tsv has one row per change.
+    By default, only slots that the class or one of its ancestors refine with slot_usage or attributes are reported.
+    """
+    diffs = iter_global_usage_diffs(
+        schema_holder.current().index, overrides_only=overrides_only
+    )
 
-    usage_slot_obj = schema_view.induced_slot(slot_name, class_name)
-    usage_slot_json = json_dumper.dumps(usage_slot_obj)
-    usage_slot_dict = json.loads(usage_slot_json)
+    if output_format == "tsv":
+        return StreamingResponse(
+            global_usage_diff_tsv_lines(diffs), media_type="text/tab-separated-values"
+        )
+    return StreamingResponse(
+        global_usage_diff_ndjson_lines(diffs), media_type="application/x-ndjson"
+    )
 
-    global_vs_usage = DeepDiff(global_slot_dict, usage_slot_dict, ignore_order=True)
 
-    return global_vs_usage
+def global_usage_diff_ndjson_lines(
+    diffs: Iterator[Tuple[str, str, dict]],
+) -> Iterator[bytes]:
+    for class_name, slot_name, diff in diffs:
+        yield dumps({"class": class_name, "slot": slot_name, "diff": diff}) + b"\n"
+
+
+def global_usage_diff_tsv_lines(
+    diffs: Iterator[Tuple[str, str, dict]],
+) -> Iterator[str]:
+    def tsv_value(value: Any) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, str):
+            return value
+        return dumps(value).decode("utf-8")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter="\t", lineterminator="\n")
+    writer.writerow(["class", "slot", "category", "path", "old_value", "new_value"])
+    for class_name, slot_name, diff in diffs:
+        for category, path, old_value, new_value in iter_diff_changes(diff):
+            writer.writerow(
+                [
+                    class_name,
+                    slot_name,
+                    category,
+                    path,
+                    tsv_value(old_value),
+                    tsv_value(new_value),
+                ]
+            )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
 
 
 # @app.get("/names_ages_tsv")
@@ -160,57 +387,231 @@ def get_class_typecode(class_name: str) -> Union[tuple[str, int], Any]:
     if not isinstance(class_name, str) or not class_name:
         return "Null or non-string class_name", 400
 
-    # todo: when entering an undefined class name
-    #  unhelpful 500 error
-    #  AttributeError: 'NoneType' object has no attribute 'name'
-    try:
-        class_obj = schema_view.induced_class(class_name)
-    except KeyError:
+    index = schema_holder.current().index
+    if class_name not in index.class_slots:
         return (
             f"The schema couldn't be loaded or it does not include class {class_name}",
             404,
         )
 
-    try:
-        class_id_struct_patt = class_obj["attributes"]["id"]["structured_pattern"]
-    except KeyError:
+    if "id" not in index.class_slots[class_name]:
         return (
             f"Class {class_name} does not include a ['attributes']['id']['structured_pattern'] path",
             404,
         )
 
-    struct_patt_json = json_dumper.dumps(class_id_struct_patt)
-    # fastapi custom json serializer?
-    # generate pydantic classes for tight integration with fastapi
-    struct_patt_dict = json.loads(struct_patt_json)
+    typecode = index.typecodes[class_name]
+    if not typecode:
+        return "Typecode not found", 404
+
+    return typecode
+
+
+@app.get("/get_typecode_classes/{typecode}")
+# async
+def get_typecode_classes(typecode: str, request: Request) -> Any:
+    """The classes whose ids use typecode, e.g. sty"""
+    index = schema_holder.current().index
 
+    def build() -> List[str]:
+        if typecode not in index.typecode_classes:
+            raise HTTPException(status_code=404, detail=f"Unknown typecode {typecode}")
+        return index.typecode_classes[typecode]
+
+    return response_cache.respond(
+        request, ("get_typecode_classes", typecode, index.digest), build
+    )
+
+
+def class_hierarchy_lookup(lookup: Callable[[], Any]) -> Any:
+    """lookup(), with 404 for classes the schema doesn't have."""
     try:
-        struct_patt_syntax = struct_patt_dict["syntax"]
-    except KeyError:
-        return (
-            f"Class {class_name}'s ['attributes']['id']['structured_pattern'] does not include a ['syntax']",
-            404,
+        return lookup()
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/class_ancestors/{class_name}")
+# async
+def get_class_ancestors(
+    class_name: str,
+    request: Request,
+    reflexive: bool = True,
+    version: Optional[str] = None,
+) -> Any:
+    """The class's is_a and mixin ancestors, nearest first, starting with the class itself if reflexive"""
+    state = get_schema_state(version)
+    return response_cache.respond(
+        request,
+        ("get_class_ancestors", class_name, reflexive, state.index.digest),
+        lambda: class_hierarchy_lookup(
+            lambda: state.hierarchy().ancestors(class_name, reflexive)
+        ),
+    )
+
+
+@app.get("/class_descendants/{class_name}")
+# async
+def get_class_descendants(
+    class_name: str,
+    request: Request,
+    reflexive: bool = True,
+    version: Optional[str] = None,
+) -> Any:
+    """The classes that have the class as an is_a or mixin ancestor, sorted, including the class itself if reflexive"""
+    state = get_schema_state(version)
+    return response_cache.respond(
+        request,
+        ("get_class_descendants", class_name, reflexive, state.index.digest),
+        lambda: class_hierarchy_lookup(
+            lambda: state.hierarchy().descendants(class_name, reflexive)
+        ),
+    )
+
+
+@app.get("/is_a/{class_name}/{ancestor}")
+# async
+def get_is_a(
+    class_name: str, ancestor: str, version: Optional[str] = None
+) -> Dict[str, Any]:
+    """Whether ancestor is the class or one of its is_a or mixin ancestors"""
+    hierarchy = get_schema_state(version).hierarchy()
+    is_a = class_hierarchy_lookup(lambda: hierarchy.is_a(class_name, ancestor))
+    return {"class_name": class_name, "ancestor": ancestor, "is_a": is_a}
+
+
+class IsAPair(BaseModel):
+    class_name: str
+    ancestor: str
+
+
+class IsARequest(BaseModel):
+    pairs: List[IsAPair] = Field(min_items=1)
+
+
+@app.post("/is_a/")
+# async
+def post_is_a(
+    is_a_request: IsARequest, version: Optional[str] = None
+) -> Dict[str, Any]:
+    """/is_a/ for many (class_name, ancestor) pairs at once. 400 if any of the classes are unknown."""
+    hierarchy = get_schema_state(version).hierarchy()
+    unknown = {
+        name
+        for pair in is_a_request.pairs
+        for name in (pair.class_name, pair.ancestor)
+        if name not in hierarchy
+    }
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown classes {', '.join(sorted(unknown))}"
         )
+    return {
+        "results": [
+            {
+                "class_name": pair.class_name,
+                "ancestor": pair.ancestor,
+                "is_a": hierarchy.is_a(pair.class_name, pair.ancestor),
+            }
+            for pair in is_a_request.pairs
+        ]
+    }
 
-    try:
-        # could probably do this parse in one or a smaller number os steps
-        local_portion = struct_patt_syntax.split(":")[1]
-        chunks_by_hyphen = local_portion.split("-")
-        typecode_chunk = chunks_by_hyphen[0]
-        # remove first and final characters (curly brackets)
-        bare_typecode = typecode_chunk[1:-1]
-    except Exception:
-        return "Error parsing class ID structured pattern", 500
 
-    try:
-        all_settings = schema_view.schema.settings
-    except KeyError:
-        return "Schema does not include a settings block", 404
+@app.post("/resolve_ids/")
+async def resolve_ids(request: Request) -> Response:
+    """
+    The classes that each id in the request body can belong to, based on its typecode.
 
+    A JSON array of ids gets a JSON array of {id, typecode, classes}.
+    Any other body is read as one id per line, as it is uploaded,
+    and gets TSV rows of id, typecode and |-separated classes, streamed back as the ids arrive.
+    Ids with unknown typecodes get no classes.
+    """
+    index = schema_holder.current().index
+    if "application/json" in request.headers.get("content-type", ""):
+        try:
+            ids = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Expected a JSON array of ids")
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of ids")
+
+        def resolve_all() -> bytes:
+            resolve = index.id_resolver()
+            resolved = []
+            for identifier in ids:
+                typecode, classes = resolve(identifier)
+                resolved.append(
+                    {"id": identifier, "typecode": typecode, "classes": classes}
+                )
+            return dumps(resolved)
+
+        # a big batch would hold up every other request on the event loop
+        content = await run_in_threadpool(resolve_all)
+        return Response(content=content, media_type="application/json")
+
+    resolve = index.id_resolver()
+    lines = iter_body_lines(request)
+    # a body that isn't UTF-8 from the start is a 400. after the first row is sent, the response can only be cut off
     try:
-        return all_settings[bare_typecode]["setting_value"]
-    except KeyError:
-        return "Typecode not found", 404
+        first_line: Optional[str] = await lines.__anext__()
+    except StopAsyncIteration:
+        first_line = None
+
+    def row(identifier: str) -> str:
+        typecode, classes = resolve(identifier)
+        return f"{identifier}\t{typecode}\t{'|'.join(classes)}\n"
+
+    async def rows() -> AsyncIterator[str]:
+        yield "id\ttypecode\tclasses\n"
+        if first_line is None:
+            return
+        yield row(first_line)
+        async for identifier in lines:
+            yield row(identifier)
+
+    return BodyStreamingResponse(rows(), media_type="text/tab-separated-values")
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that can be sent while the request body is still being read.
+    StreamingResponse listens for the client disconnecting, and that would consume the body's messages.
+    """
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        await self.stream_response(send)
+
+
+async def iter_body_lines(request: Request) -> AsyncIterator[str]:
+    """
+    The non-blank lines of the request body, without waiting for all of it to arrive.
+    Raises HTTPException(400) for a line that isn't UTF-8.
+    """
+    pending = b""
+    line_number = 0
+
+    def decode(line: bytes) -> str:
+        try:
+            return line.decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400, detail=f"Line {line_number} of the body isn't UTF-8"
+            )
+
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            line = line.strip()
+            if line:
+                yield decode(line)
+    pending = pending.strip()
+    if pending:
+        line_number += 1
+        yield decode(pending)
 
 
 # todo the next four methods are really the same,
@@ -218,8 +619,7 @@ def get_class_typecode(class_name: str) -> Union[tuple[str, int], Any]:
 
 
 @app.post("/undefined_mixs_assigned_terms/")
-# async
-def undefined_mixs_assigned_terms(
+async def undefined_mixs_assigned_terms(
     def_file_url: str = Form(
         default="https://raw.githubusercontent.com/GenomicsStandardsConsortium/mixs/issue-511-tested-schemasheets/schemasheets/tsv_in/MIxS_6_term_updates_global_partial_slotdefs.tsv"
     ),
@@ -233,7 +633,7 @@ def undefined_mixs_assigned_terms(
     Return a list of all terms in the def_file that are not assigned in the assignment_file
     """
 
-    undefined_terms = term_diffs_from_tsvs(
+    undefined_terms = await term_diffs_from_tsvs(
         tsv_url_1=assignment_file_url,
         col_name_1=assignment_file_term_col,
         tsv_url_2=def_file_url,
@@ -245,8 +645,7 @@ def undefined_mixs_assigned_terms(
 
 
 @app.post("/unassigned_mixs_defined_terms/")
-# async ?
-def unassigned_mixs_defined_terms(
+async def unassigned_mixs_defined_terms(
     def_file_url: str = Form(
         default="https://raw.githubusercontent.com/GenomicsStandardsConsortium/mixs/issue-511-tested-schemasheets/schemasheets/tsv_in/MIxS_6_term_updates_global_partial_slotdefs.tsv"
     ),
@@ -260,7 +659,7 @@ def unassigned_mixs_defined_terms(
     Return a list of all terms in the def_file that are not assigned in the assignment_file
     """
 
-    unassigned_terms = term_diffs_from_tsvs(
+    unassigned_terms = await term_diffs_from_tsvs(
         tsv_url_1=def_file_url,
         col_name_1=def_file_term_col,
         tsv_url_2=assignment_file_url,
@@ -272,8 +671,7 @@ def unassigned_mixs_defined_terms(
 
 
 @app.post("/undefined_mixs_assigned_packages/")
-# async
-def undefined_mixs_assigned_packages(
+async def undefined_mixs_assigned_packages(
     def_file_url: str = Form(
         default="https://raw.githubusercontent.com/GenomicsStandardsConsortium/mixs/issue-511-tested-schemasheets/schemasheets/tsv_in/MIxS_6_term_updates_classdefs.tsv"
     ),
@@ -287,7 +685,7 @@ def undefined_mixs_assigned_packages(
     Return a list of all terms in the def_file that are not assigned in the assignment_file. Has this been updated?
     """
 
-    undefined_packages = term_diffs_from_tsvs(
+    undefined_packages = await term_diffs_from_tsvs(
         tsv_url_1=assignment_file_url,
         col_name_1=assignment_file_term_col,
         tsv_url_2=def_file_url,
@@ -299,8 +697,7 @@ def undefined_mixs_assigned_packages(
 
 
 @app.post("/unassigned_mixs_defined_packages/")
-# async ?
-def unassigned_mixs_defined_packages(
+async def unassigned_mixs_defined_packages(
     def_file_url: str = Form(
         default="https://raw.githubusercontent.com/GenomicsStandardsConsortium/mixs/issue-511-tested-schemasheets/schemasheets/tsv_in/MIxS_6_term_updates_classdefs.tsv"
     ),
@@ -314,7 +711,7 @@ def unassigned_mixs_defined_packages(
     Return a list of all terms in the def_file that are not assigned in the assignment_file. Has this been updated?
     """
 
-    unassigned_packages = term_diffs_from_tsvs(
+    unassigned_packages = await term_diffs_from_tsvs(
         tsv_url_1=def_file_url,
         col_name_1=def_file_term_col,
         tsv_url_2=assignment_file_url,
@@ -325,53 +722,184 @@ def unassigned_mixs_defined_packages(
     return unassigned_packages
 
 
-# async
-def tsv_url_to_term_list(
-    tsv_url: str, term_column_name: str, discard_first_n: int = 2
-) -> List[str]:
-    # Download the TSV file from the URL
-    response = requests.get(tsv_url)
-    # print(f"response type: {type(response).class_name}")
+class TermSource(BaseModel):
+    name: str = Field(description="What set operations call this source")
+    url: str = Field(description="The URL of a TSV file")
+    column: str = Field(
+        description="The column whose distinct values are the source's terms"
+    )
+    discard_first_n: int = Field(
+        default=2,
+        description="How many rows after the header to skip, e.g. schemasheets directives",
+    )
+
 
-    # Decode the contents of the response
-    text = response.text
+class TermSetOperation(BaseModel):
+    operation: Literal["difference", "intersection", "union"]
+    sources: List[str] = Field(
+        min_items=1,
+        description="Source names. A difference is the first source's terms minus all the others'",
+    )
+
+
+class TermSetRequest(BaseModel):
+    sources: List[TermSource] = Field(min_items=1)
+    operations: List[TermSetOperation] = Field(
+        default_factory=list,
+        description="Every ordered pairwise difference if none are given",
+    )
 
-    # Create a DictReader object to parse the TSV file
-    reader = csv.DictReader(text.splitlines(), delimiter="\t")
 
-    term_list = []
-    for row in reader:
-        # Each row is a dictionary that maps the column names to the values
-        term_list.append(row[term_column_name])
+def apply_term_set_operation(
+    operation: TermSetOperation, term_sets: Dict[str, FrozenSet[str]]
+) -> FrozenSet[str]:
+    operands = [term_sets[name] for name in operation.sources]
+    if operation.operation == "difference":
+        return operands[0].difference(*operands[1:])
+    if operation.operation == "intersection":
+        return operands[0].intersection(*operands[1:])
+    return operands[0].union(*operands[1:])
 
-    remaining_items = term_list[discard_first_n:]
 
-    return remaining_items
+@app.post("/term_set_operations/")
+async def term_set_operations(term_set_request: TermSetRequest) -> Dict[str, Any]:
+    """
+    Differences, intersections and unions of the terms in N (TSV URL, column) sources, in one call.
+    Each distinct URL is fetched once, in parallel, for all of its columns. see /undefined_mixs_assigned_terms/ etc.
+    """
+    names = [source.name for source in term_set_request.sources]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Source names must be unique")
+    operations = term_set_request.operations or [
+        TermSetOperation(operation="difference", sources=[name_1, name_2])
+        for name_1, name_2 in itertools.permutations(names, 2)
+    ]
+    unknown = {n for o in operations for n in o.sources} - set(names)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown sources {', '.join(sorted(unknown))}"
+        )
 
+    columns_by_url: Dict[str, List[Tuple[str, int]]] = {}
+    for source in term_set_request.sources:
+        columns_by_url.setdefault(source.url, []).append(
+            (source.column, source.discard_first_n)
+        )
+    fetched = await asyncio.gather(
+        *(
+            get_tsv_columns_async(url, columns)
+            for url, columns in columns_by_url.items()
+        )
+    )
+    columns_by_url_values = dict(zip(columns_by_url, fetched))
+    term_sets = {
+        source.name: columns_by_url_values[source.url][
+            (source.column, source.discard_first_n)
+        ]
+        for source in term_set_request.sources
+    }
 
-def term_diffs_from_tsvs(
+    return {
+        "sources": {
+            source.name: {
+                "url": source.url,
+                "column": source.column,
+                "term_count": len(term_sets[source.name]),
+            }
+            for source in term_set_request.sources
+        },
+        "results": [
+            {
+                "operation": operation.operation,
+                "sources": operation.sources,
+                "terms": sorted(apply_term_set_operation(operation, term_sets)),
+            }
+            for operation in operations
+        ],
+    }
+
+
+async def get_tsv_columns_async(
+    tsv_url: str, columns: Sequence[Tuple[str, int]]
+) -> Dict[Tuple[str, int], FrozenSet[str]]:
+    """
+    The distinct values in each (column name, discard_first_n) column of a TSV, from one request.
+    Cached, and only downloaded again if the TSV changed. Parsing runs in the threadpool.
+    """
+    try:
+        return await tsv_column_cache.get_columns_async(
+            tsv_url, columns, get_async_client()
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{tsv_url} has {e}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Couldn't fetch {tsv_url}: {e}")
+
+
+async def term_diffs_from_tsvs(
     tsv_url_1: str, col_name_1: str, tsv_url_2: str, col_name_2: str
 ) -> List[str]:
-    terms_1 = unique_vals_from_tsv_by_url_and_colname(
-        tsv_url=tsv_url_1, col_name=col_name_1
-    )
-    terms_2 = unique_vals_from_tsv_by_url_and_colname(
-        tsv_url=tsv_url_2, col_name=col_name_2
+    column_1 = (col_name_1, 2)
+    column_2 = (col_name_2, 2)
+    columns_1, columns_2 = await asyncio.gather(
+        get_tsv_columns_async(tsv_url_1, [column_1]),
+        get_tsv_columns_async(tsv_url_2, [column_2]),
     )
+    terms_1 = columns_1[column_1]
+    terms_2 = columns_2[column_2]
 
-    terms_1_minus_terms_2 = list(set(terms_1) - set(terms_2))
+    terms_1_minus_terms_2 = list(terms_1 - terms_2)
     return terms_1_minus_terms_2
 
 
-def unique_vals_from_tsv_by_url_and_colname(tsv_url: str, col_name: str):
-    terms = list(set(tsv_url_to_term_list(tsv_url=tsv_url, term_column_name=col_name)))
+async def run_schema_task(func: Callable[..., Any], *args: Any) -> Any:
+    """func(*args) in a schema worker process. 502 if a schema can't be loaded, 503 if the worker died."""
+    try:
+        return await run_in_worker(func, *args)
+    except SchemaLoadError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except BrokenProcessPool:
+        raise HTTPException(
+            status_code=503, detail="A schema worker process died, try again"
+        )
+
+
+async def get_view_derived(
+    schema_url: str, build: Callable[..., Any], *args: Hashable
+) -> Any:
+    """
+    build(view, *args) for the schema at schema_url, memoized per cached view. 502 if the schema can't be loaded.
+    With NMDC_UTILS_PROCESS_POOL_SIZE set, the schema is loaded and build() runs in a worker process.
+    Otherwise the schema is fetched without blocking the event loop, and build() runs in the threadpool.
+    """
+    if PROCESS_POOL_SIZE:
+        return await run_schema_task(derive, schema_url, build, *args)
+    view = await view_cache.trust_cache_async(schema_url, load_view_async)
+    if view is None:
+        raise HTTPException(
+            status_code=502, detail=f"Couldn't load a schema from {schema_url}"
+        )
+    return await run_in_threadpool(
+        view_cache.get_derived,
+        schema_url,
+        derived_key(build, args),
+        lambda v: build(v, *args),
+        view,
+    )
+
 
-    return terms
+async def get_class_slot_names(
+    schema_url: str, class_name: str
+) -> Tuple[str, FrozenSet[str]]:
+    """The schema's name, and the names of the class's induced slots."""
+    try:
+        return await get_view_derived(schema_url, class_slot_names, class_name)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 
 @app.post("/compare_slots_in_two_classes/")
-# async?
-def compare_slots_in_two_classes(
+async def compare_slots_in_two_classes(
     schema_1_url: str = Form(
         default="https://raw.githubusercontent.com/GenomicsStandardsConsortium/mixs/main/model/schema/mixs.yaml"
     ),
@@ -381,30 +909,21 @@ def compare_slots_in_two_classes(
     ),
     class_2_name: str = Form(default="water"),
 ) -> Dict[str, List[str]]:
-    # which source for mixs schema?
-    """
-    SLOW! Should cache returned views, at least. Compare the slots in two schemas and return the set differences
     """
-    # todo refactor
-    view_1 = SchemaView(schema_1_url)
-    class_1_slots_obj_list = view_1.class_induced_slots(class_1_name)
-    class_1_slots_names = [slot_obj["name"] for slot_obj in class_1_slots_obj_list]
-    class_1_slots_names = list(set(class_1_slots_names))
-    class_1_slots_names.sort()
-    schema_1_name = view_1.schema.name
-
-    view_2 = SchemaView(schema_2_url)
-    class_2_slots_obj_list = view_2.class_induced_slots(class_2_name)
-    class_2_slots_names = [slot_obj["name"] for slot_obj in class_2_slots_obj_list]
-    class_2_slots_names = list(set(class_2_slots_names))
-    class_2_slots_names.sort()
-    schema_2_name = view_2.schema.name
+    Compare the slots in two schemas' classes and return the set differences.
 
-    class_1_only = list(set(class_1_slots_names) - set(class_2_slots_names))
-    class_1_only.sort()
+    Both schemas are loaded at the same time, through the process-wide view cache,
+    and each class's slot names are computed once per cached view.
+    """
+    class_1, class_2 = await asyncio.gather(
+        get_class_slot_names(schema_1_url, class_1_name),
+        get_class_slot_names(schema_2_url, class_2_name),
+    )
+    schema_1_name, class_1_slots_names = class_1
+    schema_2_name, class_2_slots_names = class_2
 
-    class_2_only = list(set(class_2_slots_names) - set(class_1_slots_names))
-    class_2_only.sort()
+    class_1_only = sorted(class_1_slots_names - class_2_slots_names)
+    class_2_only = sorted(class_2_slots_names - class_1_slots_names)
 
     return {
         f"Slots only found in {schema_1_name}'s {class_1_name}": class_1_only,
@@ -412,74 +931,146 @@ def compare_slots_in_two_classes(
     }
 
 
+async def get_schema_fingerprints(schema_url: str) -> SchemaFingerprints:
+    """Fingerprints of every element in the schema, computed once per cached view."""
+    return await get_view_derived(schema_url, fingerprint_schema)
+
+
+@app.post("/compare_schemas/")
+async def compare_two_schemas(
+    schema_1_url: str = Form(
+        default="https://raw.githubusercontent.com/GenomicsStandardsConsortium/mixs/main/model/schema/mixs.yaml"
+    ),
+    schema_2_url: str = Form(
+        default="https://raw.githubusercontent.com/microbiomedata/sheets_and_friends/main/artifacts/nmdc_submission_schema.yaml"
+    ),
+) -> Dict[str, Any]:
+    """
+    The classes, slots, enums, types and subsets added, removed or changed between two schemas,
+    with a diff of each changed element and a summary count for each kind.
+    Elements whose fingerprints match aren't diffed.
+    """
+    if PROCESS_POOL_SIZE:
+        report = await run_schema_task(compare_schema_urls, schema_1_url, schema_2_url)
+    else:
+        fingerprints_1, fingerprints_2 = await asyncio.gather(
+            get_schema_fingerprints(schema_1_url),
+            get_schema_fingerprints(schema_2_url),
+        )
+        report = await run_in_threadpool(
+            compare_schemas, fingerprints_1, fingerprints_2
+        )
+    report["schema_1"]["url"] = schema_1_url
+    report["schema_2"]["url"] = schema_2_url
+    return report
+
+
 @app.get("/get_class_typecode_table/")
 # async?
-# what's the return type?
-# tsv file download?
-def get_class_typecode_table():
-    try:
-        all_settings = schema_view.schema.settings
-    except KeyError:
-        return "Schema does not include a settings block", 404
-
-    all_classes = schema_view.all_classes()
-    all_class_names = [v["name"] for k, v in all_classes.items()]
-    all_class_names.sort()
-
-    all_class_attributes = []
-    for class_name in all_class_names:
-        this_class_attributes = {}
-        this_class_induced = schema_view.induced_class(class_name)
-        this_class_attributes["class"] = class_name
-
-        this_class_induced_slots = schema_view.class_induced_slots(class_name)
-        this_class_induced_slots_names = [i["name"] for i in this_class_induced_slots]
-        this_class_induced_slots_names.sort()
-        # this_class_attributes["slots"] = this_class_induced_slots_names
-
-        this_class_attributes["uses_id"] = "false"
-        this_class_attributes["typecode"] = ""
-        class_id_struct_patt = ""
-
-        if "id" in this_class_induced_slots_names:
-            this_class_attributes["uses_id"] = "true"
-            try:
-                class_id_struct_patt = this_class_induced["attributes"]["id"][
-                    "structured_pattern"
-                ]
-            except KeyError:
-                class_id_struct_patt = ""
+def get_class_typecode_table(request: Request) -> Response:
+    """
+    A TSV table of each class's typecode, or JSON rows if the Accept header prefers application/json.
+    Built once per schema version and served from memory.
+    """
+    accept = request.headers.get("accept", "")
+    headers = {"Vary": "Accept"}
+    index = schema_holder.current().index
+
+    if "application/json" in accept:
+        return response_cache.respond(
+            request,
+            ("get_class_typecode_table", "json", index.digest),
+            index.typecode_rows,
+            headers=headers,
+        )
+    return response_cache.respond(
+        request,
+        ("get_class_typecode_table", "tsv", index.digest),
+        index.typecode_rows,
+        encode=rows_to_tsv,
+        media_type="text/tab-separated-values",
+        headers=headers,
+    )
 
-        if class_id_struct_patt:
-            try:
 
-                local_portion = class_id_struct_patt["syntax"].split(":")[1]
-                chunks_by_hyphen = local_portion.split("-")
-                typecode_chunk = chunks_by_hyphen[0]
-                # remove first and final characters (curly brackets)
-                bare_typecode = typecode_chunk[1:-1]
+@app.get("/get_typecodes_by_ancestor/")
+async def get_typecodes_by_ancestor(
+    request: Request,
+    schema_url: str = Query(
+        default="https://raw.githubusercontent.com/microbiomedata/nmdc-schema/main/src/schema/nmdc.yaml"
+    ),
+    slot_name: str = "id",
+) -> Response:
+    """
+    The rows of nmdc_class_typecodes.tsv, class, uses_<slot_name>, from_ancestor and typecode, for any schema.
+    Resolved in one pass over the class hierarchy, once per cached view.
+    TSV, or JSON rows if the Accept header prefers application/json.
+    """
+    rows = await get_view_derived(
+        schema_url, au.get_typecodes_by_ancestor_single_pass, slot_name
+    )
+    if rows is None:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Couldn't order the classes of {schema_url} by inheritance",
+        )
+    headers = {"Vary": "Accept"}
+    if "application/json" in request.headers.get("accept", ""):
+        return Response(
+            content=dumps(rows), media_type="application/json", headers=headers
+        )
+    return Response(
+        content=rows_to_tsv(rows),
+        media_type="text/tab-separated-values",
+        headers=headers,
+    )
 
-                try:
-                    this_class_attributes["typecode"] = all_settings[bare_typecode][
-                        "setting_value"
-                    ]
-                except KeyError:
-                    this_class_attributes["typecode"] = ""
 
-            except KeyError:
-                this_class_attributes["typecode"] = ""
+def rows_to_tsv(rows: List[Dict[str, Any]]) -> bytes:
+    if not rows:
+        return b""
+    buffer = io.StringIO()
+    dict_writer = csv.DictWriter(buffer, fieldnames=rows[0].keys(), delimiter="\t")
+    dict_writer.writeheader()
+    dict_writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
 
-        all_class_attributes.append(this_class_attributes)
 
-    # return all_class_attributes
+def require_admin(authorization: Optional[str]) -> None:
+    """403 unless the Authorization header is Bearer NMDC_UTILS_ADMIN_TOKEN. Without that token the admin endpoints are off."""
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    if not token:
+        raise HTTPException(
+            status_code=403, detail=f"Set {ADMIN_TOKEN_ENV} to use the admin endpoints"
+        )
+    if not hmac.compare_digest(
+        (authorization or "").encode("utf-8"), f"Bearer {token}".encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
-    keys = all_class_attributes[0].keys()
 
-    class_types_file_name = "class_typecodes.tsv"
+@app.post("/admin/reload_schema/")
+async def reload_schema(
+    force: bool = False, authorization: Optional[str] = Header(default=None)
+) -> Dict[str, Any]:
+    """
+    Checks the schema source for a new version now, instead of waiting NMDC_SCHEMA_REFRESH_INTERVAL seconds,
+    and serves it once it is indexed. force rebuilds the index even if the source hasn't changed.
+    Requests that are already running finish with the old version.
+    """
+    require_admin(authorization)
+    try:
+        reloaded = await run_in_threadpool(schema_holder.reload, force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Couldn't reload the schema: {e}")
+    return {"reloaded": reloaded, **schema_holder.status()}
 
-    with open(class_types_file_name, "w") as output_file:
-        dict_writer = csv.DictWriter(output_file, fieldnames=keys, delimiter="\t")
-        dict_writer.writeheader()
-        dict_writer.writerows(all_class_attributes)
 
-    return FileResponse(class_types_file_name, media_type="text/tab-separated-values")
+@app.get("/admin/schema_status/")
+# async
+def schema_status(
+    authorization: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """The schema version being served, and how the last reload check went."""
+    require_admin(authorization)
+    return schema_holder.status()
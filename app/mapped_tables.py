@@ -0,0 +1,161 @@
+"""
+Read-only string-keyed tables of JSON values in one file, looked up through a memory map instead of being loaded.
+
+Every process that maps the same file shares the operating system's page cache for it, so uvicorn workers
+serving one precompiled schema index don't each hold a private copy.
+Each table is a sorted array of fixed-size entries pointing at UTF-8 keys and JSON values. Lookups are binary searches,
+and only the values that are read get decoded.
+
+Nested tables, like class name -> slot name -> dict, are stored as one flat table of "outer\\0inner" keys,
+plus an outer table of each outer key's range of entries.
+"""
+
+import mmap
+import struct
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Tuple
+
+import orjson
+
+# key offset, key length, value offset, value length
+ENTRY = struct.Struct("<QIQI")
+
+NESTED_SEPARATOR = b"\0"
+
+
+def encode_value(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+
+def decode_value(data: bytes) -> Any:
+    return orjson.loads(data)
+
+
+class TableWriter:
+    """Builds the tables of one file in memory. Offsets are from the start of the file, after a preamble of preamble_size bytes."""
+
+    def __init__(self, preamble_size: int):
+        self.blob = bytearray(preamble_size)
+
+    def add(self, items: List[Tuple[bytes, Any]]) -> List[int]:
+        """Writes a table and returns [entries offset, entry count]."""
+        entries = []
+        for key, value in sorted(items, key=lambda item: item[0]):
+            encoded = encode_value(value)
+            key_offset = len(self.blob)
+            self.blob += key
+            value_offset = len(self.blob)
+            self.blob += encoded
+            entries.append(ENTRY.pack(key_offset, len(key), value_offset, len(encoded)))
+        entries_offset = len(self.blob)
+        self.blob += b"".join(entries)
+        return [entries_offset, len(entries)]
+
+    def add_table(self, table: Dict[str, Any]) -> List[int]:
+        return self.add([(key.encode("utf-8"), value) for key, value in table.items()])
+
+    def add_nested_table(self, table: Dict[str, Dict[str, Any]]) -> List[int]:
+        """Writes a table of tables and returns [outer entries offset, outer count, inner entries offset, inner count]."""
+        inner_items: List[Tuple[bytes, Any]] = []
+        ranges = {}
+        for outer_key in sorted(table):
+            start = len(inner_items)
+            prefix = outer_key.encode("utf-8") + NESTED_SEPARATOR
+            for inner_key, value in sorted(table[outer_key].items()):
+                inner_items.append((prefix + inner_key.encode("utf-8"), value))
+            ranges[outer_key] = [start, len(inner_items)]
+        return self.add_table(ranges) + self.add(inner_items)
+
+
+class MappedTable(Mapping):
+    """The entries start <= i < stop of a table in a memory map. Their keys all begin with prefix, which is left out."""
+
+    def __init__(
+        self,
+        buffer: mmap.mmap,
+        entries_offset: int,
+        start: int,
+        stop: int,
+        prefix: bytes = b"",
+    ):
+        self.buffer = buffer
+        self.entries_offset = entries_offset
+        self.start = start
+        self.stop = stop
+        self.prefix = prefix
+
+    @classmethod
+    def from_location(cls, buffer: mmap.mmap, location: List[int]) -> "MappedTable":
+        entries_offset, count = location
+        return cls(buffer, entries_offset, 0, count)
+
+    def entry(self, i: int) -> Tuple[int, int, int, int]:
+        return ENTRY.unpack_from(self.buffer, self.entries_offset + i * ENTRY.size)
+
+    def entry_key(self, i: int) -> bytes:
+        key_offset, key_length, _, _ = self.entry(i)
+        return self.buffer[key_offset : key_offset + key_length]
+
+    def find(self, key: str) -> int:
+        """The entry for key, or -1."""
+        encoded = self.prefix + key.encode("utf-8")
+        keys = EntryKeys(self)
+        i = bisect_left(keys, encoded, self.start, self.stop)
+        return i if i < self.stop and keys[i] == encoded else -1
+
+    def __getitem__(self, key: str) -> Any:
+        i = self.find(key) if isinstance(key, str) else -1
+        if i < 0:
+            raise KeyError(key)
+        _, _, value_offset, value_length = self.entry(i)
+        return decode_value(self.buffer[value_offset : value_offset + value_length])
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.find(key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.start, self.stop):
+            yield self.entry_key(i)[len(self.prefix) :].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} of {len(self)} entries>"
+
+
+class EntryKeys:
+    """The keys of a MappedTable's entries by index, for bisect."""
+
+    def __init__(self, table: MappedTable):
+        self.table = table
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.table.entry_key(i)
+
+
+class MappedNestedTable(Mapping):
+    """A table of MappedTables, written by TableWriter.add_nested_table()."""
+
+    def __init__(self, buffer: mmap.mmap, location: List[int]):
+        outer_offset, outer_count, self.inner_offset, _ = location
+        self.buffer = buffer
+        self.ranges = MappedTable(buffer, outer_offset, 0, outer_count)
+
+    def __getitem__(self, key: str) -> MappedTable:
+        start, stop = self.ranges[key]
+        prefix = key.encode("utf-8") + NESTED_SEPARATOR
+        return MappedTable(self.buffer, self.inner_offset, start, stop, prefix)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.ranges
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ranges)
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} of {len(self)} tables>"
@@ -0,0 +1,94 @@
+"""
+Caches the encoded JSON bodies of schema-derived GET endpoints.
+
+Bodies are keyed by endpoint, path parameters and schema digest, so they are encoded once per schema version.
+Each body gets a strong ETag, and requests whose If-None-Match matches it get a 304 Not Modified.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.linkml_json import dumps
+
+RESPONSE_CACHE_SIZE_ENV = "NMDC_UTILS_RESPONSE_CACHE_SIZE"
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    body: bytes
+    etag: str
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@dataclass
+class ResponseCache:
+    """A bounded, least-recently-used cache of encoded response bodies."""
+
+    max_entries: int = int(os.environ.get(RESPONSE_CACHE_SIZE_ENV, "10000"))
+    entries: "OrderedDict[Hashable, CachedBody]" = field(default_factory=OrderedDict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    hits: int = 0
+    misses: int = 0
+
+    def get_or_build(
+        self,
+        key: Hashable,
+        build: Callable[[], Any],
+        encode: Callable[[Any], bytes] = dumps,
+    ) -> CachedBody:
+        """Returns the cached body for key, or encodes build() and caches that. JSON unless another encode is given.
+
+        Exceptions from build(), like a 404 HTTPException, propagate and nothing is cached.
+        """
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        body = encode(build())
+        cached = CachedBody(body=body, etag=make_etag(body))
+
+        with self.lock:
+            self.entries[key] = cached
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return cached
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def respond(
+        self,
+        request: Request,
+        key: Tuple[Hashable, ...],
+        build: Callable[[], Any],
+        encode: Callable[[Any], bytes] = dumps,
+        media_type: str = "application/json",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """A response for key, or a 304 if the client already has this body."""
+        cached = self.get_or_build(key, build, encode)
+        headers = {**(headers or {}), "ETag": cached.etag}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, cached.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached.body, media_type=media_type, headers=headers)
@@ -0,0 +1,94 @@
+"""
+Structural comparison of two whole schemas: which classes, slots, enums, types and subsets were added, removed or changed.
+
+Every element definition is fingerprinted with a hash of its canonical JSON,
+so only the elements whose fingerprints differ are diffed.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from linkml_runtime import SchemaView  # type: ignore
+
+from app.linkml_json import fingerprint, linkml_to_jsonable
+from app.slot_diff import diff_element_dicts
+
+# element kind -> the SchemaView method that lists them, imports included
+ELEMENT_KINDS = {
+    "classes": "all_classes",
+    "slots": "all_slots",
+    "enums": "all_enums",
+    "types": "all_types",
+    "subsets": "all_subsets",
+}
+
+# metaslots that say where an element came from, rather than what it is
+IGNORED_METASLOTS = {"from_schema", "source_file", "imported_from"}
+
+
+@dataclass
+class SchemaFingerprints:
+    name: str
+    version: str
+    # element kind -> element name -> hash of the element's canonical JSON
+    hashes: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    # element kind -> element name -> the element as JSON-compatible values, without IGNORED_METASLOTS
+    elements: Dict[str, Dict[str, dict]] = field(default_factory=dict)
+
+
+def element_to_dict(element: Any) -> dict:
+    element_dict = linkml_to_jsonable(element)
+    for metaslot in IGNORED_METASLOTS:
+        element_dict.pop(metaslot, None)
+    return element_dict
+
+
+def fingerprint_schema(view: SchemaView) -> SchemaFingerprints:
+    fingerprints = SchemaFingerprints(
+        name=str(view.schema.name), version=str(view.schema.version or "")
+    )
+    for kind, method_name in ELEMENT_KINDS.items():
+        elements = {
+            str(name): element_to_dict(element)
+            for name, element in getattr(view, method_name)().items()
+        }
+        fingerprints.elements[kind] = elements
+        fingerprints.hashes[kind] = {
+            name: fingerprint(element) for name, element in elements.items()
+        }
+    return fingerprints
+
+
+def compare_kind(
+    old: SchemaFingerprints, new: SchemaFingerprints, kind: str
+) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """The added, removed and changed elements of one kind, and how many of each there are."""
+    old_hashes = old.hashes[kind]
+    new_hashes = new.hashes[kind]
+    added: List[str] = sorted(name for name in new_hashes if name not in old_hashes)
+    removed: List[str] = sorted(name for name in old_hashes if name not in new_hashes)
+    changed = {
+        name: diff_element_dicts(old.elements[kind][name], new.elements[kind][name])
+        for name in sorted(old_hashes)
+        if name in new_hashes and old_hashes[name] != new_hashes[name]
+    }
+    unchanged = len(old_hashes) - len(removed) - len(changed)
+    counts = {
+        "added": len(added),
+        "removed": len(removed),
+        "changed": len(changed),
+        "unchanged": unchanged,
+    }
+    return {"added": added, "removed": removed, "changed": changed}, counts
+
+
+def compare_schemas(old: SchemaFingerprints, new: SchemaFingerprints) -> Dict[str, Any]:
+    """A report of every difference between two fingerprinted schemas, by element kind."""
+    report: Dict[str, Any] = {
+        "schema_1": {"name": old.name, "version": old.version},
+        "schema_2": {"name": new.name, "version": new.version},
+        "summary": {},
+    }
+    for kind in ELEMENT_KINDS:
+        report[kind], report["summary"][kind] = compare_kind(old, new, kind)
+    return report
@@ -0,0 +1,375 @@
+"""
+A disk cache of schema documents fetched over HTTP, shared by every process that points at the same directory.
+
+Each URL's last response is remembered with its ETag and Last-Modified headers,
+so fetching it again is a conditional request, and an unchanged schema costs a 304 instead of a download.
+Documents are stored by content hash, along with the parsed SchemaDefinition as JSON,
+which loads several times faster than the YAML, so an unchanged schema isn't parsed from YAML again, even after a restart.
+Remote imports of a schema loaded with load_view() or load_view_async() go through the same cache.
+
+The cache directory is created private to this user, and isn't used if anyone else owns it or can write to it,
+since whatever is in it is served as the schema.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urljoin
+
+import httpx
+import requests
+from linkml_runtime import SCHEMA_DIRECTORY, SchemaView  # type: ignore
+from linkml_runtime.linkml_model import SchemaDefinition  # type: ignore
+from linkml_runtime.utils.schemaview import (  # type: ignore
+    is_absolute_path,
+    load_schema_wrap,
+    map_import,
+)
+from starlette.concurrency import run_in_threadpool
+
+from app.http_session import DEFAULT_TIMEOUT, get_async_client, shared_session
+from app.linkml_json import dumps, linkml_to_jsonable
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_CACHE_DIR_ENV = "NMDC_UTILS_DOCUMENT_CACHE_DIR"
+# this app's directory in the user's cache directory
+CACHE_HOME = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "nmdc_utils",
+)
+DEFAULT_DOCUMENT_CACHE_DIR = os.path.join(CACHE_HOME, "documents")
+
+# bump when the parsed SchemaDefinitions can no longer be read, e.g. after a linkml-runtime upgrade
+PARSED_FORMAT = 2
+
+# asks caches between here and the origin for the document itself, instead of a 304
+UNCONDITIONAL_HEADERS = {"Cache-Control": "no-cache"}
+
+
+def is_remote(location: str) -> bool:
+    return location.startswith(("http://", "https://"))
+
+
+def check_private_directory(directory: str) -> None:
+    """Creates directory readable only by this user, or raises PermissionError if someone else could change it."""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    status = os.stat(directory)
+    if hasattr(os, "getuid") and status.st_uid != os.getuid():
+        raise PermissionError(f"{directory} belongs to another user")
+    if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{directory} can be written by other users")
+
+
+def write_atomically(path: str, content: bytes) -> None:
+    """Writes to a temporary file and renames it, so other processes never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as temp_file:
+            temp_file.write(content)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+@dataclass
+class DocumentCache:
+    directory: str = os.environ.get(DOCUMENT_CACHE_DIR_ENV, DEFAULT_DOCUMENT_CACHE_DIR)
+    session: requests.Session = field(default=shared_session, repr=False)
+    # seconds, or (connect, read) seconds
+    timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    downloads: int = 0
+    # 304 Not Modified responses
+    revalidations: int = 0
+    # cached copies served because the server couldn't be reached
+    stale: int = 0
+    checked: bool = field(default=False, repr=False)
+
+    def root(self) -> str:
+        """The cache directory, checked the first time it's used."""
+        if not self.checked:
+            check_private_directory(self.directory)
+            self.checked = True
+        return self.directory
+
+    def url_path(self, url: str) -> str:
+        return os.path.join(
+            self.root(),
+            "urls",
+            hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json",
+        )
+
+    def document_path(self, digest: str) -> str:
+        return os.path.join(self.root(), "documents", digest + ".yaml")
+
+    def parsed_path(self, digest: str) -> str:
+        return os.path.join(self.root(), "parsed", f"{digest}.{PARSED_FORMAT}.json")
+
+    def read_url_record(self, url: str) -> Optional[dict]:
+        """What was last fetched from url, if its document is still cached."""
+        try:
+            with open(self.url_path(url)) as record_file:
+                record = json.load(record_file)
+        except (OSError, ValueError):
+            return None
+        if record.get("url") != url or not os.path.isfile(
+            self.document_path(record["digest"])
+        ):
+            return None
+        return record
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def conditional_headers(self, record: Optional[dict]) -> Dict[str, str]:
+        headers = {}
+        if record and record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record and record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def cached_answer(
+        self, url: str, status_code: int, record: Optional[dict]
+    ) -> Optional[str]:
+        """The content hash of the cached copy to use for a response with status_code, if there is one."""
+        if record is None:
+            return None
+        if status_code == 304:
+            self.count("revalidations")
+            return str(record["digest"])
+        if status_code >= 500:
+            logger.warning(f"{url} answered {status_code}, using the cached copy")
+            self.count("stale")
+            return str(record["digest"])
+        return None
+
+    def store_document(
+        self,
+        url: str,
+        content: bytes,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> str:
+        """Caches a downloaded document and its validators, and returns its content hash."""
+        digest = hashlib.sha256(content).hexdigest()
+        if not os.path.isfile(self.document_path(digest)):
+            write_atomically(self.document_path(digest), content)
+        record = {
+            "url": url,
+            "digest": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        write_atomically(self.url_path(url), json.dumps(record).encode("utf-8"))
+        self.count("downloads")
+        return digest
+
+    def fetch(self, url: str) -> str:
+        """Makes sure the current document at url is cached and returns its content hash."""
+        record = self.read_url_record(url)
+        try:
+            response = self.session.get(
+                url, headers=self.conditional_headers(record), timeout=self.timeout
+            )
+            if response.status_code == 304 and record is None:
+                # e.g. from a proxy. there is no cached copy, so ask again for the document itself
+                response = self.session.get(
+                    url, headers=UNCONDITIONAL_HEADERS, timeout=self.timeout
+                )
+        except requests.RequestException as e:
+            if record is None:
+                raise
+            logger.warning(f"Couldn't revalidate {url}, using the cached copy: {e}")
+            self.count("stale")
+            return str(record["digest"])
+
+        digest = self.cached_answer(url, response.status_code, record)
+        if digest is not None:
+            return digest
+        response.raise_for_status()
+        if response.status_code == 304:
+            raise requests.HTTPError(
+                f"{url} answered 304 Not Modified, but it isn't cached",
+                response=response,
+            )
+        return self.store_document(
+            url,
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    async def fetch_async(self, url: str, client: httpx.AsyncClient) -> str:
+        """fetch() for async code. Raises httpx.HTTPError instead of requests' exceptions. Files are read and written in the threadpool."""
+        record = await run_in_threadpool(self.read_url_record, url)
+        try:
+            response = await client.get(url, headers=self.conditional_headers(record))
+            if response.status_code == 304 and record is None:
+                response = await client.get(url, headers=UNCONDITIONAL_HEADERS)
+        except httpx.TransportError as e:
+            if record is None:
+                raise
+            logger.warning(f"Couldn't revalidate {url}, using the cached copy: {e}")
+            self.count("stale")
+            return str(record["digest"])
+
+        digest = self.cached_answer(url, response.status_code, record)
+        if digest is not None:
+            return digest
+        response.raise_for_status()
+        if response.status_code == 304:
+            raise httpx.HTTPStatusError(
+                f"{url} answered 304 Not Modified, but it isn't cached",
+                request=response.request,
+                response=response,
+            )
+        return await run_in_threadpool(
+            self.store_document,
+            url,
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    def get_text(self, url: str) -> str:
+        with open(
+            self.document_path(self.fetch(url)), encoding="utf-8"
+        ) as document_file:
+            return document_file.read()
+
+    def schema_from_digest(self, url: str, digest: str) -> SchemaDefinition:
+        """The cached document with this content hash as a SchemaDefinition, parsed only if it hasn't been before."""
+        parsed_path = self.parsed_path(digest)
+        schema = None
+        if os.path.isfile(parsed_path):
+            try:
+                with open(parsed_path, "rb") as parsed_file:
+                    schema = SchemaDefinition(**json.load(parsed_file))
+            except Exception as e:
+                logger.warning(f"Couldn't read {parsed_path}, parsing {url} again: {e}")
+        if schema is None:
+            with open(self.document_path(digest), encoding="utf-8") as document_file:
+                schema = load_schema_wrap(document_file.read())
+            write_atomically(
+                parsed_path, dumps(linkml_to_jsonable(schema, inject_type=False))
+            )
+        # relative imports are resolved against source_file
+        schema.source_file = url
+        return schema
+
+    def load_schema(self, url: str) -> SchemaDefinition:
+        """The SchemaDefinition at url, parsed only if this version of the document hasn't been parsed before."""
+        return self.schema_from_digest(url, self.fetch(url))
+
+
+class CachingSchemaView(SchemaView):
+    """A SchemaView that gets remote imports from a DocumentCache instead of downloading them every time."""
+
+    def __init__(
+        self,
+        schema: Union[str, SchemaDefinition],
+        document_cache: DocumentCache,
+        **kwargs: Any,
+    ) -> None:
+        self.document_cache = document_cache
+        # import url -> schema already fetched by load_view_async()
+        self.prefetched: Dict[str, SchemaDefinition] = {}
+        super().__init__(schema, **kwargs)
+
+    def import_url(self, imp: str, from_schema: SchemaDefinition) -> Optional[str]:
+        """The URL of a remote import's document, or None for local imports, including the metamodel."""
+        # same mapping as SchemaView.load_import(). the metamodel comes from linkml_runtime, not the network
+        importmap = {"linkml:": str(SCHEMA_DIRECTORY), **self.importmap}
+        sname = map_import(importmap, self.namespaces, imp)
+        if is_remote(sname):
+            return sname + ".yaml"
+        if (
+            from_schema.source_file
+            and is_remote(from_schema.source_file)
+            and not is_absolute_path(sname)
+        ):
+            return urljoin(from_schema.source_file, sname) + ".yaml"
+        return None
+
+    def load_import(
+        self, imp: str, from_schema: Optional[SchemaDefinition] = None
+    ) -> SchemaDefinition:
+        if from_schema is None:
+            from_schema = self.schema
+        url = self.import_url(imp, from_schema)
+        if url is None:
+            return super().load_import(imp, from_schema)
+        if url in self.prefetched:
+            return self.prefetched[url]
+        return self.document_cache.load_schema(url)
+
+
+default_document_cache = DocumentCache()
+
+
+def load_view(
+    location: str, document_cache: Optional[DocumentCache] = None
+) -> SchemaView:
+    """A SchemaView of the schema at location. Remote schemas and their imports come through the document cache."""
+    if not is_remote(location):
+        return SchemaView(location)
+    document_cache = document_cache or default_document_cache
+    return CachingSchemaView(
+        document_cache.load_schema(location), document_cache=document_cache
+    )
+
+
+async def load_view_async(
+    location: str,
+    document_cache: Optional[DocumentCache] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> SchemaView:
+    """
+    load_view() for async code. The schema and its remote imports, level by level, are fetched concurrently,
+    and parsed in the threadpool, so the view's imports are already loaded when it needs them.
+    """
+    if not is_remote(location):
+        return await run_in_threadpool(SchemaView, location)
+    document_cache = document_cache or default_document_cache
+    client = client or get_async_client()
+
+    digest = await document_cache.fetch_async(location, client)
+    schema = await run_in_threadpool(
+        document_cache.schema_from_digest, location, digest
+    )
+    view = CachingSchemaView(schema, document_cache=document_cache)
+
+    seen = {location}
+    level = [schema]
+    while level:
+        urls = []
+        for importing_schema in level:
+            for imp in importing_schema.imports:
+                url = view.import_url(imp, importing_schema)
+                if url is not None and url not in seen:
+                    seen.add(url)
+                    urls.append(url)
+        digests = await asyncio.gather(
+            *(document_cache.fetch_async(url, client) for url in urls)
+        )
+        level = await asyncio.gather(
+            *(
+                run_in_threadpool(document_cache.schema_from_digest, url, digest)
+                for url, digest in zip(urls, digests)
+            )
+        )
+        view.prefetched.update(zip(urls, level))
+    return view
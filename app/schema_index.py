@@ -0,0 +1,422 @@
+"""
+A precompiled index of the NMDC schema, so app.main can start without inducing anything.
+
+Build it once, e.g. while building the Docker image:
+    python -m app.schema_index nmdc_schema_index.bin
+
+and point NMDC_SCHEMA_INDEX at the output. Without that file, the index is built from the schema source at startup.
+The file is memory-mapped rather than loaded, see app/mapped_tables.py, so uvicorn workers share one copy of it.
+
+Given the index of an earlier version, build_schema_index() only induces again the slots whose inputs changed,
+found by comparing hashes of every class and slot definition. See reusable_slots().
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from linkml_runtime import SchemaView  # type: ignore
+
+import app.utilities as au
+from app.linkml_json import fingerprint, linkml_to_jsonable
+from app.mapped_tables import MappedNestedTable, MappedTable, TableWriter
+from app.schema_documents import write_atomically
+from app.schema_source import SchemaSource, find_schema_source
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_INDEX_ENV = "NMDC_SCHEMA_INDEX"
+
+# bump when the layout of SchemaIndex changes, so stale index files are rebuilt instead of misread
+INDEX_FORMAT = 8
+
+INDEX_MAGIC = b"NMDCIDX\0"
+# INDEX_MAGIC, then the format, offset and length of the JSON header
+PREAMBLE = struct.Struct("<8sIQQ")
+
+# stored in the header. every other field is a table
+HEADER_FIELDS = [
+    "name",
+    "version",
+    "digest",
+    "source_digest",
+    "schema_hash",
+    "settings",
+]
+# class name -> slot name -> ...
+NESTED_FIELDS = ["induced_slots"]
+
+
+@dataclass
+class SchemaIndex:
+    """Everything the schema endpoints need, as plain JSON-compatible Python values.
+
+    read_schema_index() fills the table fields with read-only Mappings over the index file instead of dicts.
+    """
+
+    name: str
+    version: str
+    # sha256 of the indexed content. identifies a schema version for caching
+    digest: str = ""
+    # SchemaSource.digest() of the schema document it was built from
+    source_digest: str = ""
+    # hash of the schema-level inputs of every induced slot, see element_hashes()
+    schema_hash: str = ""
+    settings: Dict[str, str] = field(default_factory=dict)
+    # slot name -> global slot definition
+    global_slots: Dict[str, dict] = field(default_factory=dict)
+    # class name -> sorted names of the class's induced slots
+    class_slots: Dict[str, List[str]] = field(default_factory=dict)
+    # class name -> slot name -> induced_slot(slot name, class name), for every slot the class uses
+    induced_slots: Dict[str, Dict[str, dict]] = field(default_factory=dict)
+    # class name -> class_ancestors(), starting with the class itself
+    ancestors: Dict[str, List[str]] = field(default_factory=dict)
+    # class name -> names of the slots the class itself refines, in slot_usage or attributes
+    local_overrides: Dict[str, List[str]] = field(default_factory=dict)
+    # class name -> typecode from the induced id slot's structured pattern, "" if there isn't one
+    typecodes: Dict[str, str] = field(default_factory=dict)
+    # typecode -> sorted names of the classes whose ids use it
+    typecode_classes: Dict[str, List[str]] = field(default_factory=dict)
+    # class name -> hash of its definition
+    class_hashes: Dict[str, str] = field(default_factory=dict)
+    # slot name -> hash of its definition and the classes that list it, i.e. its domain_of
+    slot_hashes: Dict[str, str] = field(default_factory=dict)
+
+    def class_names(self) -> List[str]:
+        return sorted(self.class_slots)
+
+    def get_induced_slot(self, slot_name: str, class_name: str) -> Optional[dict]:
+        return self.induced_slots.get(class_name, {}).get(slot_name)
+
+    def typecode_rows(self) -> List[Dict[str, str]]:
+        """One {class, uses_id, typecode} row per class, sorted by class name."""
+        return [
+            {
+                "class": class_name,
+                "uses_id": "true" if "id" in self.class_slots[class_name] else "false",
+                "typecode": self.typecodes[class_name],
+            }
+            for class_name in self.class_names()
+        ]
+
+    def resolve_id(self, identifier: str) -> Tuple[str, List[str]]:
+        """The typecode in an id like nmdc:sty-11-abc123, and the classes that use it. No classes if it is unknown."""
+        typecode = typecode_from_id(identifier)
+        return typecode, self.typecode_classes.get(typecode, [])
+
+    def id_resolver(self) -> Callable[[str], Tuple[str, List[str]]]:
+        """resolve_id(), looking up each distinct typecode in the mapped table only once. For one batch of ids."""
+        classes_by_typecode: Dict[str, List[str]] = {}
+
+        def resolve(identifier: str) -> Tuple[str, List[str]]:
+            typecode = typecode_from_id(identifier)
+            classes = classes_by_typecode.get(typecode)
+            if classes is None:
+                classes = self.typecode_classes.get(typecode, [])
+                classes_by_typecode[typecode] = classes
+            return typecode, classes
+
+        return resolve
+
+    def is_overridden(self, slot_name: str, class_name: str) -> bool:
+        """True if the class or one of its ancestors refines the slot with slot_usage or an attribute."""
+        return any(
+            slot_name in self.local_overrides.get(a, [])
+            for a in self.ancestors.get(class_name, [])
+        )
+
+
+def typecode_from_id(identifier: str) -> str:
+    """sty for nmdc:sty-11-abc123"""
+    local_portion = identifier.strip().split(":", 1)[-1]
+    return local_portion.split("-", 1)[0]
+
+
+def linkml_to_dict(obj: Any) -> dict:
+    return dict(linkml_to_jsonable(obj))
+
+
+def induced_slot_to_dict(view: SchemaView, slot_name: str, class_name: str) -> dict:
+    """induced_slot() as a dict, with the same result no matter what was induced before it.
+
+    induced_slot() sets inlined and required on the *source* slot rather than on its copy,
+    so its output changes once a slot has been induced in some other class. Apply those rules here instead.
+    """
+    induced_slot = linkml_to_dict(view.induced_slot(slot_name, class_name))
+    if induced_slot.get("inlined_as_list"):
+        induced_slot["inlined"] = True
+    if induced_slot.get("identifier") or induced_slot.get("key"):
+        induced_slot["required"] = True
+    return induced_slot
+
+
+def compute_digest(index: SchemaIndex) -> str:
+    content = [getattr(index, f.name) for f in fields(index) if f.name != "digest"]
+    # default=dict for mapped tables
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=dict).encode("utf-8")
+    ).hexdigest()
+
+
+def element_hashes(
+    view: SchemaView, settings: Dict[str, str]
+) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+    """
+    Hashes of everything induced slots are computed from: the schema-level inputs, each class and each slot.
+
+    induced_slot() adds every class that lists a slot in its slots or attributes to the slot's domain_of,
+    so those classes count as part of the slot.
+    """
+    schema_hash = fingerprint(
+        {
+            "default_range": view.schema.default_range,
+            "settings": settings,
+        }
+    )
+    class_hashes = {}
+    users: Dict[str, List[str]] = {}
+    for class_name, class_obj in view.all_classes().items():
+        class_hashes[str(class_name)] = fingerprint(linkml_to_jsonable(class_obj))
+        for slot_name in [*class_obj.slots, *class_obj.attributes]:
+            users.setdefault(str(slot_name), []).append(str(class_name))
+    slot_hashes = {
+        str(slot_name): fingerprint(
+            {
+                "definition": linkml_to_jsonable(slot_obj),
+                "domain_of": users.get(str(slot_name), []),
+            }
+        )
+        for slot_name, slot_obj in view.all_slots().items()
+    }
+    return schema_hash, class_hashes, slot_hashes
+
+
+def changed_keys(old: Mapping, new: Dict[str, str]) -> Set[str]:
+    """Keys added, removed or with a different value."""
+    return {key for key in new if old.get(key) != new[key]} | {
+        key for key in old if key not in new
+    }
+
+
+def reusable_slots(
+    view: SchemaView, index: SchemaIndex, previous: SchemaIndex
+) -> Callable[[str, List[str]], Set[str]]:
+    """
+    A function of a class name and its ancestors in the view, returning the names of its induced slots
+    that can be copied from previous, the index of an earlier version, instead of induced again.
+
+    induced_slot(slot, class) depends on the definitions of the class and its ancestors, including mixins,
+    for their attributes and slot_usage, on the slot and its ancestors, and on the classes that list the slot.
+    A class whose ancestors changed is induced again whole, since its class_slots may have changed too.
+    """
+    changed_classes = changed_keys(previous.class_hashes, index.class_hashes)
+    changed_slots = changed_keys(previous.slot_hashes, index.slot_hashes)
+    unchanged_slots: Dict[str, bool] = {}
+
+    def slot_is_unchanged(slot_name: str) -> bool:
+        if slot_name not in unchanged_slots:
+            try:
+                slot_ancestors = view.slot_ancestors(slot_name, reflexive=True)
+                unchanged_slots[slot_name] = not changed_slots.intersection(
+                    map(str, slot_ancestors)
+                )
+            except ValueError:
+                unchanged_slots[slot_name] = False
+        return unchanged_slots[slot_name]
+
+    def reusable(class_name: str, ancestors: List[str]) -> Set[str]:
+        if class_name not in previous.induced_slots:
+            return set()
+        previous_ancestors = previous.ancestors.get(class_name, [])
+        if changed_classes.intersection([*ancestors, *previous_ancestors]):
+            return set()
+        return {
+            slot_name
+            for slot_name in previous.class_slots[class_name]
+            if slot_is_unchanged(slot_name)
+        }
+
+    return reusable
+
+
+def build_schema_index(
+    view: SchemaView,
+    source_digest: str = "",
+    previous: Optional[SchemaIndex] = None,
+) -> SchemaIndex:
+    """Induces every slot of every class in the view once and records the results.
+
+    Induced slots that can't have changed since previous, an index of an earlier version, are copied from it instead.
+    """
+    settings = {}
+    for setting_name, setting in (view.schema.settings or {}).items():
+        settings[str(setting_name)] = str(setting["setting_value"])
+
+    schema_hash, class_hashes, slot_hashes = element_hashes(view, settings)
+    index = SchemaIndex(
+        name=str(view.schema.name),
+        version=str(view.schema.version or ""),
+        source_digest=source_digest,
+        schema_hash=schema_hash,
+        settings=settings,
+        class_hashes=class_hashes,
+        slot_hashes=slot_hashes,
+    )
+
+    reusable = None
+    if previous is not None and previous.schema_hash == schema_hash:
+        reusable = reusable_slots(view, index, previous)
+
+    for slot_name, slot_obj in view.all_slots().items():
+        index.global_slots[str(slot_name)] = linkml_to_dict(slot_obj)
+
+    induced_count = 0
+    for class_name in sorted(view.all_classes()):
+        class_name = str(class_name)
+        ancestors = [str(a) for a in view.class_ancestors(class_name)]
+        copied = reusable(class_name, ancestors) if reusable else set()
+        previous_slots = (
+            previous.induced_slots[class_name] if previous and copied else {}
+        )
+        induced_slots = {}
+        for slot_name in view.class_slots(class_name):
+            slot_name = str(slot_name)
+            if slot_name in copied:
+                induced_slots[slot_name] = previous_slots[slot_name]
+            else:
+                induced_slots[slot_name] = induced_slot_to_dict(
+                    view, slot_name, class_name
+                )
+                induced_count += 1
+
+        index.induced_slots[class_name] = induced_slots
+        index.class_slots[class_name] = sorted(induced_slots)
+        index.ancestors[class_name] = ancestors
+        class_obj = view.get_class(class_name)
+        index.local_overrides[class_name] = sorted(
+            {str(k) for k in class_obj.slot_usage}
+            | {str(k) for k in class_obj.attributes}
+        )
+
+        typecode = None
+        syntax = induced_slots.get("id", {}).get("structured_pattern", {}).get("syntax")
+        if syntax:
+            typecode = au.get_typecode_from_syntax(syntax, settings)
+        index.typecodes[class_name] = typecode or ""
+
+    for class_name, typecode in index.typecodes.items():
+        if typecode:
+            index.typecode_classes.setdefault(typecode, []).append(class_name)
+
+    if previous is not None:
+        total = sum(len(slots) for slots in index.class_slots.values())
+        logger.info(
+            f"Induced {induced_count} of {total} class slots, copied the rest from {previous.version}"
+        )
+    index.digest = compute_digest(index)
+    return index
+
+
+def build_index_from_source(
+    source: SchemaSource, previous: Optional[SchemaIndex] = None
+) -> SchemaIndex:
+    logger.info(f"Building a schema index from {source.origin} {source.location}")
+    return build_schema_index(source.view(), source.digest(), previous)
+
+
+def write_schema_index(index: SchemaIndex, path: str) -> None:
+    writer = TableWriter(PREAMBLE.size)
+    header: Dict[str, Any] = {name: getattr(index, name) for name in HEADER_FIELDS}
+    header["tables"] = {}
+    for f in fields(index):
+        if f.name in NESTED_FIELDS:
+            header["tables"][f.name] = writer.add_nested_table(getattr(index, f.name))
+        elif f.name not in HEADER_FIELDS:
+            header["tables"][f.name] = writer.add_table(getattr(index, f.name))
+
+    header_offset = len(writer.blob)
+    writer.blob += json.dumps(header).encode("utf-8")
+    writer.blob[: PREAMBLE.size] = PREAMBLE.pack(
+        INDEX_MAGIC, INDEX_FORMAT, header_offset, len(writer.blob) - header_offset
+    )
+    # readers may have the old file mapped
+    write_atomically(path, bytes(writer.blob))
+
+
+def read_schema_index(path: str) -> SchemaIndex:
+    """Maps an index written by write_schema_index. Its tables are read from the file as they are used."""
+    with open(path, "rb") as input_file:
+        buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < PREAMBLE.size:
+        raise ValueError(f"{path} is not a schema index")
+    magic, index_format, header_offset, header_length = PREAMBLE.unpack_from(buffer)
+    if magic != INDEX_MAGIC:
+        raise ValueError(f"{path} is not a schema index")
+    if index_format != INDEX_FORMAT:
+        raise ValueError(
+            f"{path} has index format {index_format}, expected {INDEX_FORMAT}"
+        )
+    header = json.loads(buffer[header_offset : header_offset + header_length])
+    # Mappings in place of the table fields' dicts, see SchemaIndex
+    tables: Dict[str, Any] = {
+        name: (
+            MappedNestedTable(buffer, location)
+            if name in NESTED_FIELDS
+            else MappedTable.from_location(buffer, location)
+        )
+        for name, location in header.pop("tables").items()
+    }
+    return SchemaIndex(**header, **tables)
+
+
+def read_precompiled_index(
+    path: Optional[str], source: SchemaSource
+) -> Optional[SchemaIndex]:
+    """The index at path, if there is one and it was built from the same schema document as source."""
+    if not path:
+        return None
+    if not os.path.isfile(path):
+        logger.warning(
+            f"Schema index {path} not found, building one from the schema source"
+        )
+        return None
+    try:
+        index = read_schema_index(path)
+    except Exception as e:
+        logger.error(f"Error reading schema index {path}, rebuilding it: {e}")
+        return None
+    # otherwise the index and the SchemaView fallback would answer from different schemas
+    if index.source_digest != source.digest():
+        logger.error(
+            f"Schema index {path} wasn't built from {source.origin} {source.location}, rebuilding it"
+        )
+        return None
+    logger.info(f"Loaded schema index {index.name} {index.version} from {path}")
+    return index
+
+
+def load_schema_index(
+    path: Optional[str] = None,
+    source_loader: Callable[[], SchemaSource] = find_schema_source,
+) -> SchemaIndex:
+    """Returns the precompiled index if there is a usable one for source_loader()'s schema. Otherwise builds it."""
+    source = source_loader()
+    index = read_precompiled_index(path or os.environ.get(SCHEMA_INDEX_ENV), source)
+    if index is None:
+        index = build_index_from_source(source)
+    return index
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m app.schema_index OUTPUT_FILE")
+    logging.basicConfig(level=logging.INFO)
+    built = build_index_from_source(find_schema_source())
+    write_schema_index(built, sys.argv[1])
+    logger.info(f"Wrote {built.name} {built.version} index to {sys.argv[1]}")
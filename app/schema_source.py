@@ -0,0 +1,121 @@
+"""
+Locates the NMDC schema that app.main serves.
+
+Lookup order:
+    1. a schema file named by the NMDC_SCHEMA_FILE environment variable (e.g. one baked into the image)
+    2. the schema bundled with the installed nmdc-schema package
+    3. the remote URL in NMDC_SCHEMA_URL, but only if NMDC_SCHEMA_ALLOW_REMOTE is set to a true value
+
+Nothing here touches the network unless step 3 has been opted into.
+"""
+
+import hashlib
+import logging
+import os
+import pkgutil
+from dataclasses import dataclass
+from typing import Optional
+
+from linkml_runtime import SchemaView  # type: ignore
+
+from app.schema_documents import default_document_cache, load_view
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILE_ENV = "NMDC_SCHEMA_FILE"
+SCHEMA_URL_ENV = "NMDC_SCHEMA_URL"
+ALLOW_REMOTE_ENV = "NMDC_SCHEMA_ALLOW_REMOTE"
+
+DEFAULT_SCHEMA_URL = "https://raw.githubusercontent.com/microbiomedata/nmdc-schema/main/src/schema/nmdc.yaml"
+
+# the merged schema has no imports, so it can be loaded from a string without resolving relative paths
+# older nmdc-schema releases only shipped nmdc.yaml
+PACKAGE_SCHEMA_RESOURCES = ["nmdc_schema_merged.yaml", "nmdc.yaml"]
+
+
+@dataclass
+class SchemaSource:
+    """A schema document, and a note about where it came from."""
+
+    origin: str
+    location: str
+    # anything SchemaView() accepts: a file path, a URL or the YAML text itself
+    schema: str
+
+    def view(self) -> SchemaView:
+        if self.origin == "url":
+            # the schema and its remote imports come through the document cache, like digest()
+            return load_view(self.location)
+        return SchemaView(self.schema)
+
+    def digest(self) -> str:
+        """sha256 of the schema document, to tell whether it has changed. Imports aren't included."""
+        if self.origin == "url":
+            # a conditional request, through the document cache
+            return default_document_cache.fetch(self.location)
+        if self.origin == "file":
+            with open(self.location, "rb") as schema_file:
+                content = schema_file.read()
+        else:
+            content = self.schema.encode("utf-8")
+        return hashlib.sha256(content).hexdigest()
+
+
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def source_from_file(path: str) -> SchemaSource:
+    if not os.path.isfile(path):
+        raise FileNotFoundError(
+            f"{SCHEMA_FILE_ENV} points to {path}, which is not a file"
+        )
+    return SchemaSource(origin="file", location=path, schema=path)
+
+
+def source_from_package() -> Optional[SchemaSource]:
+    """Returns the schema bundled with the nmdc-schema package, if it is installed."""
+    for resource in PACKAGE_SCHEMA_RESOURCES:
+        try:
+            # same lookup as pkgutil.get_data("nmdc_schema.nmdc_data", ...)
+            data = pkgutil.get_data("nmdc_schema", resource)
+        except (ImportError, OSError):
+            continue
+        if data:
+            return SchemaSource(
+                origin="package",
+                location=f"nmdc_schema/{resource}",
+                schema=data.decode("utf-8"),
+            )
+    return None
+
+
+def source_from_url(url: str) -> SchemaSource:
+    return SchemaSource(origin="url", location=url, schema=url)
+
+
+def find_schema_source() -> SchemaSource:
+    """Returns the first available schema source, following the lookup order in the module docstring."""
+    schema_file = os.environ.get(SCHEMA_FILE_ENV)
+    if schema_file:
+        return source_from_file(schema_file)
+
+    package_source = source_from_package()
+    if package_source is not None:
+        return package_source
+
+    if env_flag(ALLOW_REMOTE_ENV):
+        url = os.environ.get(SCHEMA_URL_ENV, DEFAULT_SCHEMA_URL)
+        logger.warning(f"No local NMDC schema found, falling back to {url}")
+        return source_from_url(url)
+
+    raise RuntimeError(
+        f"No local NMDC schema found. Install nmdc-schema, set {SCHEMA_FILE_ENV}, "
+        f"or set {ALLOW_REMOTE_ENV}=true to fetch {SCHEMA_URL_ENV} (default {DEFAULT_SCHEMA_URL})"
+    )
+
+
+def load_schema_view() -> SchemaView:
+    source = find_schema_source()
+    logger.info(f"Loading NMDC schema from {source.origin} {source.location}")
+    return source.view()
@@ -0,0 +1,330 @@
+"""
+The version of the NMDC schema that app.main serves, and replacing it with a new version without a restart.
+
+A SchemaState is one version's index, plus a SchemaView for the lookups the index doesn't cover
+and the ClassHierarchy of its classes, and it never changes.
+SchemaHolder.state points at the current one. A reload builds a complete index of the new version off the request path,
+writes it to NMDC_SCHEMA_INDEX_DIR and maps it, and only then replaces that one reference.
+The new index starts from the current one's file, so only the classes and slots that changed are induced again.
+Requests that started with the old state finish with it, and no request sees part of each version.
+
+A reload in one uvicorn worker reaches the others through the index directory: the reloading worker names its new file
+in NMDC_SCHEMA_INDEX_DIR/current, and every worker checks that file's modification time before it serves a request,
+and maps the index it names if it's new. Each state holds a shared lock on its index file while any request uses it,
+so superseded files are deleted once no worker has them mapped.
+One worker builds at a time, under a lock file in the directory, and the others map its result instead of building their own.
+The directory must be private to the app's user, as in app/schema_documents.py, since the workers serve whatever it names.
+
+NMDC_SCHEMA_REFRESH_INTERVAL is the number of seconds between checks for a changed schema source, 0 (the default) for never.
+A check only costs hashing the schema document, or a conditional request for a remote one, while it hasn't changed.
+"""
+
+import fcntl
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from linkml_runtime import SchemaView  # type: ignore
+
+from app.class_hierarchy import ClassHierarchy
+from app.schema_documents import CACHE_HOME, check_private_directory, write_atomically
+from app.schema_index import (
+    SCHEMA_INDEX_ENV,
+    SchemaIndex,
+    build_index_from_source,
+    read_precompiled_index,
+    read_schema_index,
+    write_schema_index,
+)
+from app.schema_source import SchemaSource, find_schema_source
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_REFRESH_INTERVAL_ENV = "NMDC_SCHEMA_REFRESH_INTERVAL"
+SCHEMA_INDEX_DIR_ENV = "NMDC_SCHEMA_INDEX_DIR"
+DEFAULT_SCHEMA_INDEX_DIR = os.path.join(CACHE_HOME, "indexes")
+# in the index directory, the name of the index file the workers should serve
+CURRENT_INDEX_FILE = "current"
+# held while a worker builds an index, so the others wait for it instead of building the same one
+BUILD_LOCK_FILE = "build.lock"
+INDEX_FILE_PREFIX = "nmdc_schema_index."
+INDEX_FILE_PATTERN = re.compile(re.escape(INDEX_FILE_PREFIX) + r"[0-9a-f]+\.bin")
+
+
+def hold_index_file(path: Optional[str]) -> Optional[IO[bytes]]:
+    """Opens path with a shared lock, which lasts until the file object is closed or collected."""
+    if path is None:
+        return None
+    try:
+        index_file = open(path, "rb")
+    except OSError:
+        return None
+    fcntl.flock(index_file, fcntl.LOCK_SH)
+    return index_file
+
+
+@contextmanager
+def exclusive_lock(path: str) -> Iterator[None]:
+    """Holds an exclusive flock on path, waiting for other processes to release theirs."""
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def remove_unused_index_files(directory: str, keep: str) -> List[str]:
+    """
+    Deletes the index files in directory that no process holds a lock on, except keep and files newer than it,
+    which another worker may be about to publish. Returns their paths.
+    """
+    try:
+        names = os.listdir(directory)
+        kept_at = os.stat(keep).st_mtime_ns
+    except OSError:
+        return []
+    removed = []
+    for name in names:
+        path = os.path.join(directory, name)
+        if not INDEX_FILE_PATTERN.fullmatch(name) or path == keep:
+            continue
+        try:
+            with open(path, "rb") as index_file:
+                if os.fstat(index_file.fileno()).st_mtime_ns > kept_at:
+                    continue
+                # fails while any SchemaState, in any process, has the file
+                fcntl.flock(index_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.unlink(path)
+        except OSError:
+            continue
+        removed.append(path)
+    return removed
+
+
+class SchemaState:
+    """One version of the schema: its index, and its SchemaView, loaded the first time it's needed."""
+
+    def __init__(
+        self, index: SchemaIndex, source: SchemaSource, index_path: Optional[str] = None
+    ):
+        self.index = index
+        self.source = source
+        # the file the index is mapped from, if it is
+        self.index_path = index_path
+        # keeps remove_unused_index_files() away from index_path while this state is in use
+        self._index_file = hold_index_file(index_path)
+        self.loaded_at = time.time()
+        self._view: Optional[SchemaView] = None
+        self._view_lock = threading.Lock()
+        self._hierarchy: Optional[ClassHierarchy] = None
+
+    def view(self) -> SchemaView:
+        """The full SchemaView, for lookups the index doesn't cover."""
+        with self._view_lock:
+            if self._view is None:
+                logger.info(
+                    f"Loading NMDC schema from {self.source.origin} {self.source.location}"
+                )
+                self._view = self.source.view()
+            return self._view
+
+    def hierarchy(self) -> ClassHierarchy:
+        """The closure of the index's class ancestors, computed the first time it's needed."""
+        if self._hierarchy is None:
+            # computing it twice at once is harmless
+            self._hierarchy = ClassHierarchy(self.index.ancestors)
+        return self._hierarchy
+
+
+def load_schema_state() -> SchemaState:
+    """The precompiled index (NMDC_SCHEMA_INDEX) if there is a usable one, otherwise one built from the schema source."""
+    source = find_schema_source()
+    path = os.environ.get(SCHEMA_INDEX_ENV)
+    index = read_precompiled_index(path, source)
+    if index is None:
+        return SchemaState(build_index_from_source(source), source)
+    return SchemaState(index, source, path)
+
+
+def read_previous_index(path: Optional[str]) -> Optional[SchemaIndex]:
+    if path is None:
+        return None
+    try:
+        return read_schema_index(path)
+    except Exception as e:
+        logger.warning(f"Couldn't read schema index {path}, indexing from scratch: {e}")
+        return None
+
+
+def build_index_file(
+    directory: str,
+    current_source_digest: str,
+    force: bool = False,
+    current_index_path: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Indexes the current schema source into directory, and returns the index file's path.
+    None if the source's digest is still current_source_digest, unless force is set.
+    Induced slots that haven't changed are copied from the index at current_index_path, if there is one.
+    Only takes and returns strings, so it can run in a schema worker process.
+    """
+    source = find_schema_source()
+    if source.digest() == current_source_digest and not force:
+        return None
+    index = build_index_from_source(source, read_previous_index(current_index_path))
+    path = os.path.join(directory, f"{INDEX_FILE_PREFIX}{index.digest}.bin")
+    write_schema_index(index, path)
+    return path
+
+
+def call_here(func: Callable[..., Any], *args: Any) -> Any:
+    return func(*args)
+
+
+@dataclass
+class SchemaHolder:
+    """The current SchemaState, which reload() replaces in one assignment."""
+
+    state: SchemaState
+    index_directory: str = os.environ.get(
+        SCHEMA_INDEX_DIR_ENV, DEFAULT_SCHEMA_INDEX_DIR
+    )
+    refresh_interval: float = float(os.environ.get(SCHEMA_REFRESH_INTERVAL_ENV, "0"))
+    # runs build_index_file(), e.g. in a schema worker process
+    builder: Callable[..., Any] = field(default=call_here, repr=False)
+    reload_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    reloads: int = 0
+    last_checked: Optional[float] = None
+    last_error: Optional[str] = None
+    # (inode, mtime) of the current file last acted on. set in __post_init__
+    published: Optional[Tuple[int, int]] = None
+    checked: bool = field(default=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # an index published before this process started is from an earlier run, not a reload of this one
+        self.published = self.published_version()
+
+    def directory(self) -> str:
+        """The index directory, checked the first time it's used, since the workers serve whatever index it names."""
+        if not self.checked:
+            check_private_directory(self.index_directory)
+            self.checked = True
+        return self.index_directory
+
+    def current_file(self) -> str:
+        return os.path.join(self.directory(), CURRENT_INDEX_FILE)
+
+    def published_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            status = os.stat(self.current_file())
+        except OSError:
+            return None
+        return status.st_ino, status.st_mtime_ns
+
+    def current(self) -> SchemaState:
+        """
+        The state to serve a request with. Maps the index another worker published first, if there is a new one.
+        Costs one stat() while there isn't.
+        """
+        published = self.published_version()
+        if published is not None and published != self.published:
+            # a request that finds another one mapping the new index serves the old one meanwhile
+            if self.reload_lock.acquire(blocking=False):
+                try:
+                    self.adopt_published()
+                finally:
+                    self.reload_lock.release()
+        return self.state
+
+    def adopt_published(self) -> None:
+        """Swaps in the index named by the current file, if it isn't the one being served. Call with reload_lock held."""
+        published = self.published_version()
+        if published is None or published == self.published:
+            return
+        self.published = published
+        try:
+            with open(self.current_file()) as current_file:
+                name = current_file.read().strip()
+            # only an index file in this directory, never a path to anywhere else
+            if not INDEX_FILE_PATTERN.fullmatch(name):
+                raise ValueError(f"{name!r} isn't an index file name")
+            path = os.path.join(self.directory(), name)
+            if path == self.state.index_path:
+                return
+            new_state = SchemaState(read_schema_index(path), find_schema_source(), path)
+        except Exception as e:
+            logger.warning(
+                f"Couldn't map the schema index another worker published: {e}"
+            )
+            return
+        self.swap(new_state)
+
+    def publish(self, path: str) -> None:
+        """Names path as the index every worker should serve. Call with reload_lock held."""
+        write_atomically(self.current_file(), os.path.basename(path).encode("utf-8"))
+        self.published = self.published_version()
+
+    def swap(self, new_state: SchemaState) -> None:
+        """Serves new_state from now on, and deletes the index files no worker uses any more."""
+        old_index = self.state.index
+        self.state = new_state
+        self.reloads += 1
+        logger.info(
+            f"Reloaded NMDC schema {old_index.name} {old_index.version} -> {new_state.index.name} {new_state.index.version}"
+        )
+        if new_state.index_path is not None:
+            removed = remove_unused_index_files(self.directory(), new_state.index_path)
+            if removed:
+                logger.info(f"Deleted unused schema indexes {', '.join(removed)}")
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Builds and swaps in an index of the schema source, if it has changed since the current one was built, or force is set.
+        Returns whether it did. Blocks while it builds, so call it off the request path. One reload runs at a time.
+        The new index is published to the other workers, and index files none of them use any more are deleted.
+        """
+        with self.reload_lock, exclusive_lock(
+            os.path.join(self.directory(), BUILD_LOCK_FILE)
+        ):
+            # another worker may have already indexed the change, e.g. while this one waited for the lock
+            self.adopt_published()
+            try:
+                path = self.builder(
+                    build_index_file,
+                    self.index_directory,
+                    self.state.index.source_digest,
+                    force,
+                    self.state.index_path,
+                )
+                if path is not None:
+                    new_state = SchemaState(
+                        read_schema_index(path), find_schema_source(), path
+                    )
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                self.last_checked = time.time()
+            self.last_error = None
+            if path is None:
+                return False
+            self.publish(path)
+            self.swap(new_state)
+            return True
+
+    def status(self) -> Dict[str, Any]:
+        state = self.current()
+        index = state.index
+        return {
+            "name": index.name,
+            "version": index.version,
+            "digest": index.digest,
+            "source": f"{state.source.origin} {state.source.location}",
+            "loaded_at": state.loaded_at,
+            "reloads": self.reloads,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+        }
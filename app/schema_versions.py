@@ -0,0 +1,148 @@
+"""
+Other versions of the NMDC schema, served next to the current one, e.g. /get_global_slot/id?version=7.7.2
+
+Consecutive releases define most classes and slots identically, so the indexes of all versions share one InternStore,
+which keeps one copy of each distinct definition, keyed by a hash of its canonical JSON.
+Ten similar versions take little more memory than one.
+For the same reason each version is indexed starting from the last one indexed, and only its changes are induced.
+
+NMDC_SCHEMA_VERSIONS lists the versions that can be requested, as comma-separated version=location pairs,
+where location is a schema file or URL. Each version is indexed the first time it is requested.
+"""
+
+import logging
+import os
+import sys
+import threading
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, List, Optional
+
+from app.linkml_json import fingerprint
+from app.schema_documents import is_remote
+from app.schema_index import (
+    HEADER_FIELDS,
+    NESTED_FIELDS,
+    SchemaIndex,
+    build_index_from_source,
+)
+from app.schema_source import SchemaSource, source_from_file, source_from_url
+from app.schema_state import SchemaState, call_here
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSIONS_ENV = "NMDC_SCHEMA_VERSIONS"
+
+
+def parse_versions(value: str) -> Dict[str, str]:
+    """{version: location} from version=location,version=location"""
+    versions = {}
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        version, separator, location = pair.partition("=")
+        if not separator or not version.strip() or not location.strip():
+            raise ValueError(
+                f"{SCHEMA_VERSIONS_ENV} entries look like version=location, not {pair}"
+            )
+        versions[version.strip()] = location.strip()
+    return versions
+
+
+def source_from_location(location: str) -> SchemaSource:
+    return (
+        source_from_url(location) if is_remote(location) else source_from_file(location)
+    )
+
+
+def index_location(
+    location: str, previous: Optional[SchemaIndex] = None
+) -> SchemaIndex:
+    """Builds an index of the schema at location, reusing what it can of previous. Can run in a schema worker process."""
+    return build_index_from_source(source_from_location(location), previous)
+
+
+@dataclass
+class InternStore:
+    """One shared copy of each distinct JSON-compatible value, keyed by a hash of its canonical JSON."""
+
+    values: Dict[str, Any] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # values that were already stored when they were interned
+    shared: int = 0
+
+    def intern(self, value: Any) -> Any:
+        key = fingerprint(value)
+        with self.lock:
+            stored = self.values.setdefault(key, value)
+            if stored is not value:
+                self.shared += 1
+            return stored
+
+    def intern_table(self, table: Dict[str, Any]) -> Dict[str, Any]:
+        return {sys.intern(key): self.intern(value) for key, value in table.items()}
+
+    def intern_index(self, index: SchemaIndex) -> SchemaIndex:
+        """A copy of index whose table values are this store's shared copies. Mapped tables are read into memory."""
+        values = {}
+        for f in fields(index):
+            value = getattr(index, f.name)
+            if f.name in HEADER_FIELDS:
+                values[f.name] = value
+            elif f.name in NESTED_FIELDS:
+                values[f.name] = {
+                    sys.intern(outer_key): self.intern_table(table)
+                    for outer_key, table in value.items()
+                }
+            else:
+                values[f.name] = self.intern_table(value)
+        return SchemaIndex(**values)
+
+
+@dataclass
+class SchemaVersions:
+    """The versions in NMDC_SCHEMA_VERSIONS, indexed on first request, and any others added with add()."""
+
+    locations: Dict[str, str] = field(
+        default_factory=lambda: parse_versions(os.environ.get(SCHEMA_VERSIONS_ENV, ""))
+    )
+    store: InternStore = field(default_factory=InternStore)
+    states: Dict[str, SchemaState] = field(default_factory=dict)
+    # runs index_location(), e.g. in a schema worker process
+    builder: Callable[..., Any] = field(default=call_here, repr=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # version -> lock held while it is indexed, so concurrent first requests index it once
+    loading: Dict[str, threading.Lock] = field(default_factory=dict, repr=False)
+    # the most recently added version's index, where the next one starts from
+    latest: Optional[SchemaIndex] = field(default=None, repr=False)
+
+    def available(self) -> List[str]:
+        return sorted(set(self.locations) | set(self.states))
+
+    def add(
+        self, version: str, index: SchemaIndex, source: SchemaSource
+    ) -> SchemaState:
+        state = SchemaState(self.store.intern_index(index), source)
+        with self.lock:
+            self.states[version] = state
+            self.latest = state.index
+        return state
+
+    def get(self, version: str) -> Optional[SchemaState]:
+        """The version's SchemaState, indexed now if it hasn't been. None for versions that aren't listed.
+
+        Blocks while a version is indexed, so call it off the event loop.
+        """
+        with self.lock:
+            state = self.states.get(version)
+            if state is not None or version not in self.locations:
+                return state
+            version_lock = self.loading.setdefault(version, threading.Lock())
+        with version_lock:
+            with self.lock:
+                state = self.states.get(version)
+            if state is None:
+                location = self.locations[version]
+                logger.info(f"Indexing NMDC schema version {version} from {location}")
+                index = self.builder(index_location, location, self.latest)
+                state = self.add(version, index, source_from_location(location))
+        return state
@@ -0,0 +1,129 @@
+"""
+A pool of worker processes for CPU-heavy work on user-supplied schemas: loading them, inducing their classes and slots,
+and whole-schema reports.
+
+SchemaView induction is pure Python and holds the GIL, so in a thread of the web process it stalls every other request.
+In a worker process it doesn't. Tasks are module-level functions that take and return plain, picklable values,
+like slot names or a report, never SchemaViews.
+Each worker keeps its own view cache, and shares schema documents with the web process through the DocumentCache directory.
+
+NMDC_UTILS_PROCESS_POOL_SIZE sets the number of worker processes. 0, the default, keeps this work in the web process.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, FrozenSet, Hashable, Optional, Sequence, Tuple
+
+from linkml_runtime import SchemaView  # type: ignore
+
+import app.utilities as au
+from app.schema_compare import compare_schemas, fingerprint_schema
+
+logger = logging.getLogger(__name__)
+
+PROCESS_POOL_SIZE_ENV = "NMDC_UTILS_PROCESS_POOL_SIZE"
+
+PROCESS_POOL_SIZE = int(os.environ.get(PROCESS_POOL_SIZE_ENV, "0"))
+
+
+class SchemaLoadError(Exception):
+    pass
+
+
+# schemas loaded by tasks in this process
+worker_view_cache = au.ViewCache()
+
+
+def class_slot_names(view: SchemaView, class_name: str) -> Tuple[str, FrozenSet[str]]:
+    """The schema's name, and the names of the class's induced slots. ValueError if there is no such class."""
+    # the same names as class_induced_slots(), without inducing each slot
+    return str(view.schema.name), frozenset(view.class_slots(class_name))
+
+
+def derived_key(build: Callable[..., Any], args: Sequence[Hashable]) -> Tuple:
+    return (build.__module__, build.__qualname__, *args)
+
+
+def derive(schema_url: str, build: Callable[..., Any], *args: Any) -> Any:
+    """build(view, *args) for the schema at schema_url, memoized per view in this process's view cache.
+
+    Raises SchemaLoadError if the schema can't be loaded.
+    """
+    view = worker_view_cache.trust_cache(schema_url)
+    if view is None:
+        raise SchemaLoadError(f"Couldn't load a schema from {schema_url}")
+    return worker_view_cache.get_derived(
+        schema_url, derived_key(build, args), lambda v: build(v, *args), view
+    )
+
+
+def compare_schema_urls(schema_1_url: str, schema_2_url: str) -> Dict[str, Any]:
+    """compare_schemas() for two schema URLs, loaded at the same time. Only the report leaves the worker."""
+    with ThreadPoolExecutor(max_workers=2) as loaders:
+        fingerprints_1, fingerprints_2 = loaders.map(
+            lambda url: derive(url, fingerprint_schema), [schema_1_url, schema_2_url]
+        )
+    return compare_schemas(fingerprints_1, fingerprints_2)
+
+
+process_pool: Optional[ProcessPoolExecutor] = None
+process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """The worker processes, started on first use."""
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            # spawned rather than forked, since the web process has threads and open connections
+            process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_SIZE,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return process_pool
+
+
+def discard_process_pool(broken: ProcessPoolExecutor) -> None:
+    global process_pool
+    with process_pool_lock:
+        if process_pool is broken:
+            process_pool = None
+    broken.shutdown(wait=False)
+
+
+async def run_in_worker(func: Callable[..., Any], *args: Any) -> Any:
+    """func(*args) in a worker process, without blocking the event loop.
+
+    A pool whose worker died, e.g. of running out of memory, is replaced for the next call, and BrokenProcessPool is raised.
+    """
+    pool = get_process_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        logger.error("A schema worker process died, starting new ones")
+        discard_process_pool(pool)
+        raise
+
+
+def call_in_worker(func: Callable[..., Any], *args: Any) -> Any:
+    """run_in_worker() for a thread that can wait, e.g. one in the threadpool."""
+    pool = get_process_pool()
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        logger.error("A schema worker process died, starting new ones")
+        discard_process_pool(pool)
+        raise
+
+
+def shutdown_process_pool() -> None:
+    global process_pool
+    with process_pool_lock:
+        pool, process_pool = process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,203 @@
+"""
+Differences between two LinkML slot definitions, e.g. a slot's global definition and its usage in a class.
+
+The slot definitions are JSON-compatible dicts, like the ones in the schema index.
+The result has the same categories and paths as DeepDiff(global_slot, usage_slot, ignore_order=True):
+    dictionary_item_added, dictionary_item_removed, values_changed, type_changes,
+    iterable_item_added and iterable_item_removed
+but compares metaslot by metaslot, and compares multivalued metaslots as sets, rather than hashing every nested value.
+
+diff_element_dicts() does the same for any other element, like a class or an enum, in key order.
+
+DeepDiff reports a list that both gains and loses items as changes between its closest-matching pairs of items.
+Those (rare) lists are still handed to DeepDiff, so the results match exactly.
+"""
+
+import json
+from dataclasses import fields
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from deepdiff import DeepDiff
+from linkml_runtime.linkml_model import SlotDefinition  # type: ignore
+
+from app.schema_index import SchemaIndex
+
+# metaslots in the order they appear in a SlotDefinition
+SLOT_METASLOTS: List[str] = [f.name for f in fields(SlotDefinition)]
+
+CATEGORIES = [
+    "type_changes",
+    "dictionary_item_added",
+    "dictionary_item_removed",
+    "values_changed",
+    "iterable_item_added",
+    "iterable_item_removed",
+]
+
+
+def item_path(path: str, key: Any) -> str:
+    return f"{path}[{key!r}]"
+
+
+def hashable(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+class SlotDiffer:
+    """Collects the differences found while walking two slot definitions."""
+
+    def __init__(self) -> None:
+        self.result: Dict[str, Any] = {}
+
+    def add_path(self, category: str, path: str) -> None:
+        self.result.setdefault(category, []).append(path)
+
+    def add_change(self, category: str, path: str, change: Any) -> None:
+        self.result.setdefault(category, {})[path] = change
+
+    def compare(self, old: Any, new: Any, path: str) -> None:
+        if type(old) is not type(new):
+            self.add_change(
+                "type_changes",
+                path,
+                {
+                    "old_type": type(old).__name__,
+                    "new_type": type(new).__name__,
+                    "old_value": old,
+                    "new_value": new,
+                },
+            )
+        elif isinstance(old, dict):
+            self.compare_dicts(old, new, path)
+        elif isinstance(old, list):
+            # multivalued metaslots, like aliases, examples or domain_of
+            self.compare_sets(old, new, path)
+        elif old != new:
+            self.add_change(
+                "values_changed", path, {"new_value": new, "old_value": old}
+            )
+
+    def compare_keys(self, old: dict, new: dict, path: str) -> None:
+        for key in new:
+            if key not in old:
+                self.add_path("dictionary_item_added", item_path(path, key))
+        for key in old:
+            if key not in new:
+                self.add_path("dictionary_item_removed", item_path(path, key))
+
+    def compare_dicts(self, old: dict, new: dict, path: str) -> None:
+        self.compare_keys(old, new, path)
+        for key in old:
+            if key in new:
+                self.compare(old[key], new[key], item_path(path, key))
+
+    def compare_sets(self, old: list, new: list, path: str) -> None:
+        # first index of each distinct item
+        old_hashes = {hashable(item): i for i, item in reversed(list(enumerate(old)))}
+        new_hashes = {hashable(item): i for i, item in reversed(list(enumerate(new)))}
+        added = [
+            i for item_hash, i in new_hashes.items() if item_hash not in old_hashes
+        ]
+        removed = [
+            i for item_hash, i in old_hashes.items() if item_hash not in new_hashes
+        ]
+        if added and removed:
+            self.merge_deepdiff(DeepDiff(old, new, ignore_order=True), path)
+            return
+        for i in added:
+            self.add_change("iterable_item_added", item_path(path, i), new[i])
+        for i in removed:
+            self.add_change("iterable_item_removed", item_path(path, i), old[i])
+
+    def merge_deepdiff(self, deep_diff: DeepDiff, path: str) -> None:
+        """Adds a DeepDiff of the values at path, rewriting its root to path."""
+
+        def reroot(deep_diff_path: str) -> str:
+            return path + deep_diff_path[len("root") :]
+
+        for category, changes in deep_diff.items():
+            if category not in CATEGORIES:
+                continue
+            if isinstance(changes, dict):
+                for change_path, change in changes.items():
+                    if category == "type_changes":
+                        change = {
+                            k: v.__name__ if isinstance(v, type) else v
+                            for k, v in change.items()
+                        }
+                    self.add_change(category, reroot(change_path), change)
+            else:
+                for change_path in changes:
+                    self.add_path(category, reroot(change_path))
+
+    def compare_slots(self, old: dict, new: dict) -> None:
+        """compare_dicts(), but visiting metaslots in SlotDefinition order."""
+        self.compare_keys(old, new, "root")
+        ordered = [m for m in SLOT_METASLOTS if m in old and m in new]
+        ordered += [k for k in old if k in new and k not in SLOT_METASLOTS]
+        for metaslot in ordered:
+            self.compare(old[metaslot], new[metaslot], item_path("root", metaslot))
+
+
+def diff_slot_dicts(
+    global_slot: Optional[dict], usage_slot: Optional[dict]
+) -> Dict[str, Any]:
+    """The differences between two slot definitions, keyed by DeepDiff's category names. Empty if they are equal."""
+    differ = SlotDiffer()
+    if isinstance(global_slot, dict) and isinstance(usage_slot, dict):
+        differ.compare_slots(global_slot, usage_slot)
+    else:
+        differ.compare(global_slot, usage_slot, "root")
+    return {
+        category: differ.result[category]
+        for category in CATEGORIES
+        if category in differ.result
+    }
+
+
+def diff_element_dicts(old: Any, new: Any) -> Dict[str, Any]:
+    """Like diff_slot_dicts(), for element definitions of any kind."""
+    differ = SlotDiffer()
+    differ.compare(old, new, "root")
+    return {
+        category: differ.result[category]
+        for category in CATEGORIES
+        if category in differ.result
+    }
+
+
+def iter_global_usage_diffs(
+    index: SchemaIndex, overrides_only: bool = True
+) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """Yields (class name, slot name, diff) for every slot each class uses, in one pass over the index.
+
+    With overrides_only, pairs that neither the class nor its ancestors refine are skipped,
+    since they only differ from the global slot by the alias, owner and domain_of that inducing adds.
+    """
+    for class_name in index.class_names():
+        for slot_name, usage_slot in index.induced_slots[class_name].items():
+            if overrides_only and not index.is_overridden(slot_name, class_name):
+                continue
+            yield class_name, slot_name, diff_slot_dicts(
+                index.global_slots.get(slot_name), usage_slot
+            )
+
+
+def iter_diff_changes(diff: Dict[str, Any]) -> Iterator[Tuple[str, str, Any, Any]]:
+    """Flattens a diff into (category, path, old value, new value) rows. Values are None where they don't apply."""
+    for category, changes in diff.items():
+        if isinstance(changes, dict):
+            for path, change in changes.items():
+                if category in {"values_changed", "type_changes"}:
+                    yield category, path, change.get("old_value"), change.get(
+                        "new_value"
+                    )
+                elif category == "iterable_item_removed":
+                    yield category, path, change, None
+                else:
+                    yield category, path, None, change
+        else:
+            for path in changes:
+                yield category, path, None, None
@@ -0,0 +1,223 @@
+"""
+Reads columns of a TSV at a URL, as the response streams in, and caches each column's distinct values.
+
+Cached value sets are revalidated with the ETag or Last-Modified header of the response they came from,
+so an unchanged TSV costs a 304 instead of a download and parse.
+get_columns_async() does the same for async endpoints, with an httpx.AsyncClient.
+"""
+
+import csv
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import (
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+import httpx
+import requests
+from starlette.concurrency import run_in_threadpool
+
+from app.http_session import DEFAULT_TIMEOUT, shared_session
+
+TSV_CACHE_SIZE_ENV = "NMDC_UTILS_TSV_CACHE_SIZE"
+
+# (url, column name, discard_first_n)
+ColumnKey = Tuple[str, str, int]
+
+
+def response_text_stream(response: requests.Response) -> TextIO:
+    """The body of a streamed response as text, decoded as it is read."""
+    # undo any gzip transfer encoding while streaming, like response.text would
+    response.raw.decode_content = True
+    # let TextIOWrapper see the end of the body, instead of a closed file
+    response.raw.auto_close = False
+    return io.TextIOWrapper(
+        response.raw, encoding=response.encoding or "utf-8", newline=""
+    )
+
+
+def column_sets(
+    text_stream: TextIO, columns: Sequence[Tuple[str, int]]
+) -> Dict[Tuple[str, int], FrozenSet[str]]:
+    """
+    The distinct values in several (column name, discard_first_n) columns of TSV text, read in one pass.
+    Blank lines are skipped, and so are the first discard_first_n rows after the header, e.g. schemasheets' directive rows.
+    Rows too short to reach a column have no value in it. Raises ValueError if there is no such column.
+    """
+    reader = csv.reader(text_stream, delimiter="\t")
+    header = next(reader, [])
+    missing = [column_name for column_name, _ in columns if column_name not in header]
+    if missing:
+        raise ValueError(f"no {', '.join(missing)} column")
+    indices = [header.index(column_name) for column_name, _ in columns]
+    values: List[Set[str]] = [set() for _ in columns]
+
+    data_rows = (row for row in reader if row)
+    for row_number, row in enumerate(data_rows):
+        for (_, discard_first_n), column_index, column_values in zip(
+            columns, indices, values
+        ):
+            if row_number >= discard_first_n and column_index < len(row):
+                column_values.add(row[column_index])
+    return {column: frozenset(v) for column, v in zip(columns, values)}
+
+
+@dataclass(frozen=True)
+class ColumnSet:
+    values: FrozenSet[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+@dataclass
+class TSVColumnCache:
+    """A bounded, least-recently-used cache of TSV column value sets, revalidated on every use."""
+
+    max_entries: int = int(os.environ.get(TSV_CACHE_SIZE_ENV, "256"))
+    session: requests.Session = field(default=shared_session, repr=False)
+    timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT
+    entries: "OrderedDict[ColumnKey, ColumnSet]" = field(default_factory=OrderedDict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    downloads: int = 0
+    # 304 Not Modified responses
+    revalidations: int = 0
+
+    def get(
+        self, url: str, column_name: str, discard_first_n: int = 2
+    ) -> FrozenSet[str]:
+        """
+        The distinct values in a column of the TSV at url.
+        Raises requests.RequestException if it can't be fetched, and ValueError if it has no such column.
+        """
+        return self.get_columns(url, [(column_name, discard_first_n)])[
+            (column_name, discard_first_n)
+        ]
+
+    def conditional_headers(self, cached: List[Optional[ColumnSet]]) -> Dict[str, str]:
+        """Validators for a conditional request, if every column was cached from the same response."""
+        headers: Dict[str, str] = {}
+        if None in cached:
+            return headers
+        validators = {(c.etag, c.last_modified) for c in cached if c is not None}
+        if len(validators) == 1:
+            etag, last_modified = validators.pop()
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def revalidated(self, keys: List[ColumnKey]) -> None:
+        with self.lock:
+            self.revalidations += 1
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+
+    def remember(
+        self,
+        url: str,
+        value_sets: Dict[Tuple[str, int], FrozenSet[str]],
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> None:
+        with self.lock:
+            self.downloads += 1
+            for (column_name, discard), values in value_sets.items():
+                key = (url, column_name, discard)
+                self.entries[key] = ColumnSet(values, etag, last_modified)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_columns(
+        self, url: str, columns: Sequence[Tuple[str, int]]
+    ) -> Dict[Tuple[str, int], FrozenSet[str]]:
+        """
+        The distinct values in several (column name, discard_first_n) columns of the TSV at url, with one request.
+        Revalidated if they were all cached from the same response, otherwise downloaded and parsed in one pass.
+        """
+        columns = list(dict.fromkeys(columns))
+        keys = [(url, column_name, discard) for column_name, discard in columns]
+        with self.lock:
+            cached = [self.entries.get(key) for key in keys]
+        headers = self.conditional_headers(cached)
+
+        with self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if response.status_code == 304 and headers:
+                self.revalidated(keys)
+                # conditional headers are only sent when every column is cached
+                return {
+                    column: c.values
+                    for column, c in zip(columns, cached)
+                    if c is not None
+                }
+            response.raise_for_status()
+            value_sets = column_sets(response_text_stream(response), columns)
+            self.remember(
+                url,
+                value_sets,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+        return value_sets
+
+    async def get_columns_async(
+        self, url: str, columns: Sequence[Tuple[str, int]], client: httpx.AsyncClient
+    ) -> Dict[Tuple[str, int], FrozenSet[str]]:
+        """
+        get_columns(), without blocking the event loop. Raises httpx.HTTPError instead of requests' exceptions.
+
+        The body is written to a temporary file while it downloads,
+        and then parsed in the threadpool.
+        """
+        columns = list(dict.fromkeys(columns))
+        keys = [(url, column_name, discard) for column_name, discard in columns]
+        with self.lock:
+            cached = [self.entries.get(key) for key in keys]
+        headers = self.conditional_headers(cached)
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and headers:
+                self.revalidated(keys)
+                # conditional headers are only sent when every column is cached
+                return {
+                    column: c.values
+                    for column, c in zip(columns, cached)
+                    if c is not None
+                }
+            response.raise_for_status()
+            # a real file, since TextIOWrapper can't wrap a SpooledTemporaryFile before Python 3.11
+            with tempfile.TemporaryFile() as body:
+                async for chunk in response.aiter_bytes():
+                    body.write(chunk)
+                body.seek(0)
+                text_stream = io.TextIOWrapper(
+                    body, encoding=response.encoding or "utf-8", newline=""
+                )
+                value_sets = await run_in_threadpool(column_sets, text_stream, columns)
+            self.remember(
+                url,
+                value_sets,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+        return value_sets
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
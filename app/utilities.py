@@ -1,7 +1,14 @@
+import asyncio
 import csv
+import os
 import pprint
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from dataclasses import dataclass, field
-from typing import Dict, Optional, List
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, List, Tuple
 
 # from linkml.utils.schema_builder import SchemaBuilder
 from linkml_runtime import SchemaView
@@ -17,6 +24,10 @@ import logging
 
 from linkml_runtime.linkml_model.meta import PatternExpression
 from linkml_runtime.utils.yamlutils import extended_str
+from starlette.concurrency import run_in_threadpool
+
+from app.class_hierarchy import hierarchy_of_view
+from app.schema_documents import load_view
 
 # configure logger
 logging.basicConfig(level=logging.INFO)
@@ -26,51 +37,292 @@ logger = logging.getLogger(__name__)
 # todo simplify by adding typecode annotations in addition to the structured patterns and settings?
 
 
-@dataclass
-class ViewCache:
-    """Caches multiple LinkML SchemaViews in a dict. The index is the URL of the schema."""
+VIEW_CACHE_SIZE_ENV = "NMDC_UTILS_VIEW_CACHE_SIZE"
+VIEW_CACHE_BYTES_ENV = "NMDC_UTILS_VIEW_CACHE_BYTES"
+VIEW_CACHE_TTL_ENV = "NMDC_UTILS_VIEW_CACHE_TTL"
+
+
+def approximate_size(obj: Any) -> int:
+    """Approximate bytes held by obj and everything it references, counting shared objects once."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, type):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(current.__dict__)
+    return total
 
-    # todo is logger getting initialized IN this class?
 
-    cache: Dict[str, SchemaView] = field(default_factory=dict)
+@dataclass
+class ViewCache:
+    """Caches multiple LinkML SchemaViews in a dict. The index is the URL of the schema.
+
+    Bounded by entry count and approximate size, least recently used first, and entries expire after ttl seconds.
+    Safe to share between threads. The size of a view is measured when it is cached,
+    so it doesn't include what the view induces and caches later.
+    Concurrent misses for the same url share one load, and its result or error.
+    """
+
+    cache: "OrderedDict[str, SchemaView]" = field(default_factory=OrderedDict)
+    max_entries: int = int(os.environ.get(VIEW_CACHE_SIZE_ENV, "8"))
+    max_bytes: int = int(os.environ.get(VIEW_CACHE_BYTES_ENV, str(512 * 1024 * 1024)))
+    # seconds. 0 means entries never expire
+    ttl: float = float(os.environ.get(VIEW_CACHE_TTL_ENV, "3600"))
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False)
+    sizes: Dict[str, int] = field(default_factory=dict, repr=False)
+    cached_at: Dict[str, float] = field(default_factory=dict, repr=False)
+    lock: threading.RLock = field(default_factory=threading.RLock, repr=False)
+    # url -> SchemaView. remote schemas come through the disk cache in app/schema_documents.py
+    loader: Callable[[str], SchemaView] = field(default=load_view, repr=False)
+    # url -> the load other callers are waiting on
+    in_flight: Dict[str, Future] = field(default_factory=dict, repr=False)
+    # url -> values computed from its current view, dropped along with the view
+    derived: Dict[str, Dict[Hashable, Any]] = field(default_factory=dict, repr=False)
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def total_bytes(self) -> int:
+        with self.lock:
+            return sum(self.sizes.values())
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.cache),
+                "bytes": sum(self.sizes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
-    def update_from_url(self, url: str):
+    def store(self, url: str, view: SchemaView) -> SchemaView:
+        """Caches view as the most recently used entry, then evicts down to the limits."""
+        # measured before taking the lock, so readers don't wait on it
+        size = approximate_size(view)
+        with self.lock:
+            self.cache[url] = view
+            self.cache.move_to_end(url)
+            self.derived.pop(url, None)
+            self.sizes[url] = size
+            self.cached_at[url] = self.clock()
+            self.evict()
+        return view
+
+    def discard(self, url: str) -> None:
+        with self.lock:
+            self.cache.pop(url, None)
+            self.derived.pop(url, None)
+            self.sizes.pop(url, None)
+            self.cached_at.pop(url, None)
+
+    def evict(self) -> None:
+        """Drops least recently used entries until the cache is within its limits. The newest entry always stays."""
+        with self.lock:
+            while len(self.cache) > 1 and (
+                len(self.cache) > self.max_entries
+                or sum(self.sizes.values()) > self.max_bytes
+            ):
+                url = next(iter(self.cache))
+                self.discard(url)
+                self.evictions += 1
+                logger.info(f"evicted {url} from the view cache")
+
+    def cached(self, url: str) -> Optional[SchemaView]:
+        """lookup() without measuring an unmeasured view. The caller holds the lock."""
+        if url not in self.cache:
+            return None
+        if url not in self.cached_at:
+            self.cached_at[url] = self.clock()
+        if self.ttl and self.clock() - self.cached_at[url] > self.ttl:
+            self.discard(url)
+            self.expirations += 1
+            logger.info(f"{url} expired from the view cache")
+            return None
+        self.cache.move_to_end(url)
+        return self.cache[url]
+
+    def measure(self, url: str, view: SchemaView) -> None:
+        """Records the size of a view that was assigned directly to self.cache.
+
+        Measured without the lock, since that takes a while for a big schema.
+        """
+        size = approximate_size(view)
+        with self.lock:
+            if self.cache.get(url) is view and url not in self.sizes:
+                self.sizes[url] = size
+
+    def lookup(self, url: str) -> Optional[SchemaView]:
+        """The cached view for url, if there is one and it hasn't expired. Marks it as recently used."""
+        with self.lock:
+            view = self.cached(url)
+            measured = url in self.sizes
+        if view is not None and not measured:
+            self.measure(url, view)
+        return view
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self.derived.clear()
+            self.sizes.clear()
+            self.cached_at.clear()
+
+    def update_from_url(self, url: str) -> Optional[SchemaView]:
         """Updates the cache with a new SchemaView, obtained from a url for the schema."""
         try:
-            self.cache[url] = SchemaView(url)
+            return self.store(url, self.loader(url))
         except Exception as e:
             logger.error(e)
+            return None
 
-    def update_from_schema(self, url: str, schema: SchemaDefinition):
+    def update_from_schema(self, url: str, schema: SchemaDefinition) -> Optional[SchemaView]:
         """Updates the cache with a new SchemaView, obtained from a schema."""
         # todo could check if the passed url matches the schema.id
         try:
-            self.cache[url] = SchemaView(schema)
+            return self.store(url, SchemaView(schema))
         except Exception as e:
             logger.error(e)
+            return None
 
     def get_view(self, url: str) -> Optional[SchemaView]:
         """Returns a SchemaView from the cache, if it exists."""
-        try:
-            return self.cache[url]
-        except KeyError as e:
-            logger.error(e)
-            return None
+        view = self.lookup(url)
+        if view is None:
+            logger.debug(f"{url} is not in the view cache")
+        return view
 
     def trust_cache(self, url: str) -> Optional[SchemaView]:
         """Returns a SchemaView from the cache if possible. Otherwise, populates the cache first."""
-        if url in self.cache:
-            logger.error("cache hit")
-            return self.cache[url]
-        else:
-            logger.error("cache miss")
+        view = self.lookup(url)
+        if view is not None:
+            with self.lock:
+                self.hits += 1
+            logger.debug(f"view cache hit for {url}")
+            return view
+
+        with self.lock:
+            self.misses += 1
+        logger.debug(f"view cache miss for {url}")
+        return self.load_once(url)
+
+    def get_derived(
+            self, url: str, key: Hashable, build: Callable[[SchemaView], Any], view: Optional[SchemaView] = None
+    ) -> Any:
+        """build(view) for the cached view of url, computed once per view. Loads the view first if it isn't given.
+
+        Raises ValueError if the schema can't be loaded. Exceptions from build() propagate and nothing is cached.
+        """
+        if view is None:
+            view = self.trust_cache(url)
+        if view is None:
+            raise ValueError(f"Couldn't load a schema from {url}")
+        with self.lock:
+            if self.cache.get(url) is view and key in self.derived.get(url, {}):
+                return self.derived[url][key]
+        value = build(view)
+        with self.lock:
+            # unless the view was replaced in the meantime
+            if self.cache.get(url) is view:
+                self.derived.setdefault(url, {})[key] = value
+        return value
+
+    def claim(self, url: str) -> Tuple[Optional[SchemaView], Optional[Future], bool]:
+        """(view, None, False) if url has been cached since the caller missed.
+        Otherwise the Future for its load, and whether the caller is the one who should load it.
+        """
+        with self.lock:
+            view = self.cached(url)
+            if view is None:
+                pending = self.in_flight.get(url)
+                if pending is not None:
+                    self.coalesced += 1
+                    return None, pending, False
+                pending = self.in_flight[url] = Future()
+                return None, pending, True
+            measured = url in self.sizes
+        if not measured:
+            self.measure(url, view)
+        return view, None, False
+
+    def release(self, url: str) -> None:
+        with self.lock:
+            del self.in_flight[url]
+
+    def load_once(self, url: str) -> Optional[SchemaView]:
+        """Loads and caches url, unless another thread is already loading it. Then waits for that load instead."""
+        view, pending, leader = self.claim(url)
+        if pending is None:
+            return view
+
+        if leader:
             try:
-                self.update_from_url(url)
-                logger.error("cache updated")
-                return self.cache[url]
+                pending.set_result(self.store(url, self.loader(url)))
             except Exception as e:
                 logger.error(e)
-                return None
+                pending.set_exception(e)
+            finally:
+                self.release(url)
+
+        try:
+            return pending.result()
+        except Exception:
+            return None
+
+    async def trust_cache_async(
+            self, url: str, loader: Callable[[str], Awaitable[SchemaView]]
+    ) -> Optional[SchemaView]:
+        """trust_cache() for async code, loading with an async loader.
+
+        Shares in-flight loads with trust_cache(), in either direction. Measuring the view runs in the threadpool.
+        """
+        view = self.lookup(url)
+        with self.lock:
+            if view is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if view is not None:
+            return view
+
+        view, pending, leader = self.claim(url)
+        if pending is None:
+            return view
+
+        if leader:
+            try:
+                loaded = await loader(url)
+                stored = await run_in_threadpool(self.store, url, loaded)
+                pending.set_result(stored)
+            except Exception as e:
+                logger.error(e)
+                pending.set_exception(e)
+            except BaseException:
+                # e.g. the leader's request was cancelled. waiters get an error instead of hanging
+                pending.set_exception(RuntimeError(f"Loading {url} was cancelled"))
+                raise
+            finally:
+                self.release(url)
+
+        try:
+            return await asyncio.wrap_future(pending)
+        except Exception:
+            return None
 
 
 def get_induced_from_view(
@@ -121,17 +373,27 @@ def get_syntax_from_structpat(structpat: PatternExpression) -> Optional[extended
         return None
 
 
-def extract_typecode_name_from_syntax(syntax: extended_str) -> Optional[str]:
+def get_typecode_from_syntax(syntax: Optional[str], settings: Optional[Dict]) -> Optional[str]:
+    """Returns the typecode in an id structured pattern's syntax.
+
+    The typecode is the first hyphen-delimited chunk of the local portion.
+    It is either written literally, like {id_nmdc_prefix}:sty-{id_shoulder}-...
+    or as a setting name in curly brackets, whose setting_value is the typecode.
+    Older versions only read the setting form, and found no typecode in schemas that write them literally.
+    """
+    if syntax is None:
+        return None
     try:
         local_portion = syntax.split(":")[1]
-        chunks_by_hyphen = local_portion.split("-")
-        typecode_chunk = chunks_by_hyphen[0]
-        # remove first and final characters (curly brackets)
-        bare_typecode = typecode_chunk[1:-1]
-        return bare_typecode
     except Exception as e:
         logger.error(e)
         return None
+    typecode_chunk = local_portion.split("-")[0]
+    if typecode_chunk.startswith("{") and typecode_chunk.endswith("}"):
+        if not settings:
+            return None
+        return get_typecode_from_settings_by_name(typecode_chunk[1:-1], settings)
+    return typecode_chunk or None
 
 
 def get_schema_settings(view: SchemaView) -> Optional[Dict]:
@@ -167,18 +429,17 @@ def get_typecode_wrapper(
 
     syntax = get_syntax_from_structpat(structpat)
 
-    typecode_name = extract_typecode_name_from_syntax(syntax)
-
     settings = get_schema_settings(view)
 
-    typecode_value = get_typecode_from_settings_by_name(typecode_name, settings)
+    typecode_value = get_typecode_from_syntax(syntax, settings)
 
     return typecode_value
 
 
 def get_ancestors(view: SchemaView, class_name: str) -> Optional[list]:
+    """class_ancestors(), from the view's precomputed ClassHierarchy."""
     try:
-        ancestors = view.class_ancestors(class_name)
+        ancestors = hierarchy_of_view(view).ancestors(class_name)
         return ancestors
     except Exception as e:
         logger.error(e)
@@ -246,6 +507,108 @@ def get_typcodes_by_ancestor_whole_schema(
     return rows
 
 
+def get_own_typecode(view: SchemaView, class_name: str, slot_name: str) -> Optional[str]:
+    """What get_typecode_wrapper() returns, but inducing only slot_name instead of the whole class."""
+    if slot_name not in view.class_slots(class_name):
+        return None
+    slotdef = view.induced_slot(slot_name, class_name)
+    if slotdef.structured_pattern is None or not slotdef.structured_pattern.syntax:
+        return None
+    return get_typecode_from_syntax(slotdef.structured_pattern.syntax, get_schema_settings(view))
+
+
+def get_classes_in_topological_order(view: SchemaView) -> Optional[List[str]]:
+    """All class names, each after its is_a parent and mixins. Ties are broken alphabetically.
+    None if the hierarchy has a cycle, since the classes in it have no such order."""
+    parents = {str(c): [str(p) for p in view.class_parents(c)] for c in view.all_classes()}
+    children: Dict[str, List[str]] = {c: [] for c in parents}
+    unresolved = {c: len(ps) for c, ps in parents.items()}
+    for class_name, class_parents in parents.items():
+        for parent in class_parents:
+            children[parent].append(class_name)
+
+    ordered = []
+    ready = sorted(c for c, count in unresolved.items() if count == 0)
+    while ready:
+        class_name = ready.pop(0)
+        ordered.append(class_name)
+        for child in sorted(children[class_name]):
+            unresolved[child] -= 1
+            if unresolved[child] == 0:
+                ready.append(child)
+    if len(ordered) != len(parents):
+        cyclic = sorted(c for c, count in unresolved.items() if count)
+        logger.error(f"Classes in an is_a or mixin cycle: {', '.join(cyclic)}")
+        return None
+    return ordered
+
+
+def get_typecodes_by_ancestor_single_pass(
+        view: SchemaView, slot_name: str
+) -> Optional[List[Dict[str, Any]]]:
+    """Same rows as get_typcodes_by_ancestor_whole_schema(), inducing each class's slot_name at most once.
+
+    Classes are visited parents first, so every ancestor's own typecode is already known when a class is reached.
+    A class with a single parent and no typecode of its own takes its parent's result.
+    Other classes check their ancestors in class_ancestors() order, like get_typecode_via_ancestors().
+    """
+    try:
+        ordered = get_classes_in_topological_order(view)
+        if ordered is None:
+            return None
+        hierarchy = hierarchy_of_view(view)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+    # class name -> typecode from the class's own induced slot_name
+    own_typecodes: Dict[str, Optional[str]] = {}
+    # class name -> {"ancestor", "typecode"} like get_typecode_via_ancestors(), or None
+    resolved: Dict[str, Optional[Dict[str, str]]] = {}
+    uses_key_slot: Dict[str, bool] = {}
+
+    for class_name in ordered:
+        uses_key_slot[class_name] = slot_name in view.class_slots(class_name)
+        own_typecode = get_own_typecode(view, class_name, slot_name)
+        own_typecodes[class_name] = own_typecode
+        class_parents = view.class_parents(class_name)
+        if own_typecode is not None:
+            resolved[class_name] = {"ancestor": class_name, "typecode": own_typecode}
+        elif len(class_parents) == 1:
+            resolved[class_name] = resolved[str(class_parents[0])]
+        else:
+            resolved[class_name] = None
+            for ancestor in hierarchy.ancestors(class_name):
+                ancestor_typecode = own_typecodes[ancestor]
+                if ancestor_typecode is not None:
+                    resolved[class_name] = {"ancestor": ancestor, "typecode": ancestor_typecode}
+                    break
+
+    rows: List[Dict[str, Any]] = []
+    for class_name in sorted(ordered):
+        from_ancestor: Optional[str]
+        typecode: Optional[str]
+        ancestry = resolved[class_name]
+        if not uses_key_slot[class_name]:
+            from_ancestor = None
+            typecode = None
+        elif ancestry:
+            from_ancestor = ancestry["ancestor"]
+            typecode = ancestry["typecode"]
+        else:
+            from_ancestor = class_name
+            typecode = None
+        rows.append(
+            {
+                "class": class_name,
+                f"uses_{slot_name}": uses_key_slot[class_name],
+                "from_ancestor": from_ancestor,
+                "typecode": typecode,
+            }
+        )
+    return rows
+
+
 def send_class_typecodes_to_tsv(data: List[Dict], output_file_name: str):
     """Sends a list of dictionaries to a CSV file."""
     keys = data[0].keys()
@@ -0,0 +1,554 @@
+"""
+Rough timings for the hot paths in app/, against the bundled NMDC schema.
+
+python benchmarks.py
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, List, Sequence
+
+import httpx
+from deepdiff import DeepDiff
+from linkml_runtime import SchemaView
+from linkml_runtime.dumpers import json_dumper
+
+import app.utilities as au
+from app.linkml_json import dumps, linkml_to_jsonable
+from app.schema_index import SchemaIndex, build_schema_index
+from app.schema_source import load_schema_view
+from app.slot_diff import diff_slot_dicts
+
+
+def best_of(func: Callable[[], object], repeat: int = 3) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = timer()
+        func()
+        durations.append(timer() - start)
+    return min(durations)
+
+
+def linkml_objects(view: SchemaView) -> List:
+    objs = list(view.all_slots().values())
+    objs += list(view.all_classes().values())
+    objs += list(view.all_enums().values())
+    return objs
+
+
+def bench_linkml_encoding(view: SchemaView, repeat: int = 3) -> Dict[str, float]:
+    """json_dumper.dumps() + json.loads() + json.dumps(), vs. linkml_to_jsonable() and dumps()."""
+    objs = linkml_objects(view)
+
+    def round_trip() -> None:
+        for obj in objs:
+            json.dumps(json.loads(json_dumper.dumps(obj)))
+
+    def direct_dict() -> None:
+        for obj in objs:
+            linkml_to_jsonable(obj)
+
+    def direct_bytes() -> None:
+        for obj in objs:
+            dumps(obj)
+
+    return {
+        "objects": len(objs),
+        "dumps/loads round trip": best_of(round_trip, repeat),
+        "linkml_to_jsonable": best_of(direct_dict, repeat),
+        "linkml_json.dumps": best_of(direct_bytes, repeat),
+    }
+
+
+def global_usage_pairs(index: SchemaIndex) -> List:
+    return [
+        (index.global_slots.get(slot_name), usage_slot)
+        for class_slots in index.induced_slots.values()
+        for slot_name, usage_slot in class_slots.items()
+    ]
+
+
+def bench_slot_diff(index: SchemaIndex, repeat: int = 3) -> Dict[str, float]:
+    """DeepDiff(ignore_order=True) vs. diff_slot_dicts() for every (class, slot) pair."""
+    pairs = global_usage_pairs(index)
+
+    def deep_diff() -> None:
+        for global_slot, usage_slot in pairs:
+            DeepDiff(global_slot, usage_slot, ignore_order=True)
+
+    def slot_diff() -> None:
+        for global_slot, usage_slot in pairs:
+            diff_slot_dicts(global_slot, usage_slot)
+
+    return {
+        "pairs": len(pairs),
+        "DeepDiff": best_of(deep_diff, repeat),
+        "diff_slot_dicts": best_of(slot_diff, repeat),
+    }
+
+
+def bench_typecode_resolution(repeat: int = 3) -> Dict[str, float]:
+    """get_typcodes_by_ancestor_whole_schema() vs. get_typecodes_by_ancestor_single_pass().
+
+    Each run gets a fresh view, loaded before the timer starts, since SchemaView caches what it induces.
+    """
+    fresh_views = [load_schema_view() for _ in range(2 * repeat)]
+
+    def whole_schema() -> None:
+        au.get_typcodes_by_ancestor_whole_schema(fresh_views.pop(), "id")
+
+    def single_pass() -> None:
+        au.get_typecodes_by_ancestor_single_pass(fresh_views.pop(), "id")
+
+    return {
+        "get_typcodes_by_ancestor_whole_schema": best_of(whole_schema, repeat),
+        "get_typecodes_by_ancestor_single_pass": best_of(single_pass, repeat),
+    }
+
+
+class SlowTSVHandler(BaseHTTPRequestHandler):
+    """Serves a small TSV at any path, after a delay, like a slow raw.githubusercontent.com."""
+
+    protocol_version = "HTTP/1.1"
+    delay = 0.2
+    body = b"Structured comment name\n>slot\n>>\n" + b"".join(
+        f"term_{i}\n".encode() for i in range(1000)
+    )
+
+    def do_GET(self) -> None:
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/tab-separated-values")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def bench_mixed_load(
+    slow_requests: int = 20, fast_requests: int = 50
+) -> Dict[str, float]:
+    """Latency of a cached lookup endpoint while slow MIxS TSV diffs are in flight,
+    with the TSVs fetched in the threadpool like before, vs. with the async endpoint.
+    """
+    import app.main as am
+
+    @am.app.post("/benchmark_blocking_term_diffs/")
+    def blocking_term_diffs(tsv_url_1: str, tsv_url_2: str) -> List[str]:
+        column = ("Structured comment name", 2)
+        terms_1 = am.tsv_column_cache.get_columns(tsv_url_1, [column])[column]
+        terms_2 = am.tsv_column_cache.get_columns(tsv_url_2, [column])[column]
+        return sorted(str(term) for term in terms_1 - terms_2)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowTSVHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    async def run(slow_request: Callable) -> Dict[str, float]:
+        transport = httpx.ASGITransport(app=am.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://app"
+        ) as client:
+            await client.get("/get_typecode_classes/sty")
+            latencies = []
+
+            async def fast() -> None:
+                start = timer()
+                await client.get("/get_typecode_classes/sty")
+                latencies.append(timer() - start)
+
+            start = timer()
+            slow = [
+                asyncio.ensure_future(slow_request(client, i))
+                for i in range(slow_requests)
+            ]
+            for _ in range(fast_requests):
+                await fast()
+            fast_elapsed = timer() - start
+            await asyncio.gather(*slow)
+            await am.close_async_client()
+            return {
+                "fast median latency": statistics.median(latencies),
+                "fast max latency": max(latencies),
+                "fast requests per second": fast_requests / fast_elapsed,
+                "all done": timer() - start,
+            }
+
+    async def blocking(client: httpx.AsyncClient, i: int) -> None:
+        await client.post(
+            "/benchmark_blocking_term_diffs/",
+            params={
+                "tsv_url_1": f"{base_url}/b{i}_1.tsv",
+                "tsv_url_2": f"{base_url}/b{i}_2.tsv",
+            },
+        )
+
+    async def non_blocking(client: httpx.AsyncClient, i: int) -> None:
+        await client.post(
+            "/undefined_mixs_assigned_terms/",
+            data={
+                "def_file_url": f"{base_url}/a{i}_1.tsv",
+                "def_file_term_col": "Structured comment name",
+                "assignment_file_url": f"{base_url}/a{i}_2.tsv",
+                "assignment_file_term_col": "Structured comment name",
+            },
+        )
+
+    try:
+        results = {}
+        for name, slow_request in (("threadpool", blocking), ("async", non_blocking)):
+            for key, value in asyncio.run(run(slow_request)).items():
+                results[f"{name} {key}"] = value
+        return results
+    finally:
+        server.shutdown()
+
+
+def bench_heavy_reports(fast_requests: int = 200) -> Dict[str, float]:
+    """Latency of a cached lookup endpoint while /compare_schemas/ fingerprints two copies of the NMDC schema,
+    in the threadpool vs. in worker processes. Each run compares files no view cache has seen.
+    """
+    import tempfile
+
+    import app.main as am
+    import app.schema_workers as sw
+    from app.schema_source import source_from_package
+
+    schema_text = source_from_package().schema
+    directory = tempfile.mkdtemp()
+
+    def schema_copies(name: str) -> List[str]:
+        paths = []
+        for i in range(2):
+            paths.append(f"{directory}/{name}_{i}.yaml")
+            with open(paths[-1], "w") as schema_file:
+                schema_file.write(schema_text)
+        return paths
+
+    async def run(name: str) -> Dict[str, float]:
+        schema_1, schema_2 = schema_copies(name)
+        transport = httpx.ASGITransport(app=am.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://app", timeout=None
+        ) as client:
+            await client.get("/get_typecode_classes/sty")
+            latencies = []
+            start = timer()
+            heavy = asyncio.ensure_future(
+                client.post(
+                    "/compare_schemas/",
+                    data={"schema_1_url": schema_1, "schema_2_url": schema_2},
+                )
+            )
+            for _ in range(fast_requests):
+                fast_start = timer()
+                await client.get("/get_typecode_classes/sty")
+                latencies.append(timer() - fast_start)
+            fast_elapsed = timer() - start
+            assert (await heavy).status_code == 200
+            return {
+                "fast median latency": statistics.median(latencies),
+                "fast max latency": max(latencies),
+                "fast requests per second": fast_requests / fast_elapsed,
+                "report done": timer() - start,
+            }
+
+    results = {}
+    for key, value in asyncio.run(run("threadpool")).items():
+        results[f"threadpool {key}"] = value
+    am.PROCESS_POOL_SIZE = sw.PROCESS_POOL_SIZE = 2
+    try:
+        # start the workers before timing
+        sw.get_process_pool().submit(sum, []).result()
+        for key, value in asyncio.run(run("processes")).items():
+            results[f"process pool {key}"] = value
+    finally:
+        sw.shutdown_process_pool()
+    return results
+
+
+def bench_reload_latency(fast_requests: int = 300) -> Dict[str, float]:
+    """Latency of a cached lookup endpoint while the NMDC schema is re-indexed and swapped in,
+    with the index built in the threadpool vs. in a schema worker process.
+    """
+    import app.main as am
+    import app.schema_workers as sw
+
+    async def run() -> Dict[str, float]:
+        transport = httpx.ASGITransport(app=am.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://app", timeout=None
+        ) as client:
+            await client.get("/get_typecode_classes/sty")
+            old_state = am.schema_holder.state
+            latencies: List[float] = []
+            start = timer()
+            reload = asyncio.ensure_future(
+                am.run_in_threadpool(am.schema_holder.reload, True)
+            )
+            while not reload.done() or len(latencies) < fast_requests:
+                fast_start = timer()
+                await client.get("/get_typecode_classes/sty")
+                latencies.append(timer() - fast_start)
+            await reload
+            assert am.schema_holder.state is not old_state
+            return {
+                "fast median latency": statistics.median(latencies),
+                "fast max latency": max(latencies),
+                "reload done": timer() - start,
+            }
+
+    results = {}
+    for key, value in asyncio.run(run()).items():
+        results[f"threadpool {key}"] = value
+    am.PROCESS_POOL_SIZE = sw.PROCESS_POOL_SIZE = 1
+    try:
+        sw.get_process_pool().submit(sum, []).result()
+        for key, value in asyncio.run(run()).items():
+            results[f"process pool {key}"] = value
+    finally:
+        am.PROCESS_POOL_SIZE = sw.PROCESS_POOL_SIZE = 0
+        sw.shutdown_process_pool()
+    return results
+
+
+def bench_version_store(versions: int = 10) -> Dict[str, float]:
+    """Approximate memory of several indexed versions of the NMDC schema, each changing one class and adding another,
+    held separately vs. in one InternStore.
+    """
+    from app.schema_source import source_from_package
+    from app.schema_versions import InternStore
+
+    schema_text = source_from_package().schema
+    indexes = []
+    for i in range(versions):
+        version_text = schema_text.replace(
+            "A study summarizes the overall goal",
+            f"Version {i} of a study summarizes the overall goal",
+        ).replace("  Study:\n", f"  NewThing{i}:\n    is_a: NamedThing\n  Study:\n", 1)
+        indexes.append(build_schema_index(SchemaView(version_text)))
+
+    store = InternStore()
+    interned = [store.intern_index(index) for index in indexes]
+    return {
+        "one version MiB": au.approximate_size(indexes[0]) / 2**20,
+        f"{versions} separate versions MiB": au.approximate_size(indexes) / 2**20,
+        f"{versions} interned versions MiB": au.approximate_size([interned, store])
+        / 2**20,
+    }
+
+
+def bench_incremental_index(repeat: int = 3) -> Dict[str, float]:
+    """Indexing a new version of the NMDC schema from scratch vs. from the previous version's index,
+    for a one-class change and for a change to a slot most classes use.
+    """
+    from app.schema_source import source_from_package
+
+    schema_text = source_from_package().schema
+    previous = build_schema_index(SchemaView(schema_text))
+    one_class = schema_text.replace(
+        "A study summarizes the overall goal",
+        "A changed study summarizes the overall goal",
+    )
+    # the id slot's description
+    widely_used = schema_text.replace(
+        "A unique identifier for a thing.",
+        "A changed unique identifier for a thing.",
+        1,
+    )
+    results = {}
+    for label, version_text in [
+        ("one class", one_class),
+        ("a widely used slot", widely_used),
+    ]:
+        for start_label, start in [
+            ("from scratch", None),
+            ("from the previous index", previous),
+        ]:
+            durations = []
+            for _ in range(repeat):
+                # parsed outside the timing, and fresh each time, since SchemaView caches induced slots
+                view = SchemaView(version_text)
+                view.all_classes()
+                begin = timer()
+                build_schema_index(view, previous=start)
+                durations.append(timer() - begin)
+            results[f"{label}, {start_label}"] = min(durations)
+    return results
+
+
+def bench_class_hierarchy(view: SchemaView, repeat: int = 3) -> Dict[str, float]:
+    """Is-a checks for every pair of classes, and every class's descendants,
+    with SchemaView.class_ancestors() vs. a ClassHierarchy, built from a fresh view inside the timing.
+    """
+    from app.class_hierarchy import ClassHierarchy
+
+    class_names = [str(c) for c in view.all_classes()]
+
+    def with_view() -> None:
+        fresh = SchemaView(view.schema)
+        for c in class_names:
+            fresh.class_descendants(c)
+            for a in class_names:
+                a in fresh.class_ancestors(c)
+
+    def with_hierarchy() -> None:
+        fresh = SchemaView(view.schema)
+        hierarchy = ClassHierarchy({c: fresh.class_ancestors(c) for c in class_names})
+        for c in class_names:
+            hierarchy.descendants(c)
+            for a in class_names:
+                hierarchy.is_a(c, a)
+
+    return {
+        "class_ancestors()": best_of(with_view, repeat),
+        "ClassHierarchy": best_of(with_hierarchy, repeat),
+    }
+
+
+def process_tree(pid: int) -> List[int]:
+    """pid and its descendants, from /proc."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat_file:
+                    # the ppid is the second field after the parenthesized command
+                    ppid = int(stat_file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def memory_kib(pid: int) -> Dict[str, int]:
+    """Rss counts shared pages in full in every process. Pss splits them between the processes that share them."""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps_file:
+        for line in smaps_file:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss"):
+                memory[name] = int(value.split()[0])
+    return memory
+
+
+def bench_workers(
+    worker_counts: Sequence[int] = (1, 2, 4), seconds: float = 5, concurrency: int = 16
+) -> Dict[str, float]:
+    """Requests per second, and the memory of all the processes, for uvicorn with 1, 2 and 4 workers,
+    each mapping the same precompiled schema index.
+    """
+    import socket
+    import subprocess
+    import sys
+    import tempfile
+
+    from app.schema_index import write_schema_index
+
+    index = build_schema_index(load_schema_view())
+    index_path = os.path.join(tempfile.mkdtemp(), "nmdc_schema_index.bin")
+    write_schema_index(index, index_path)
+    paths = [
+        f"/get_slot_class_usage/{slot_name}/{class_name}"
+        for class_name in index.class_names()
+        for slot_name in index.class_slots[class_name]
+    ]
+    paths += [f"/get_global_slot/{slot_name}" for slot_name in index.global_slots]
+
+    results = {}
+    for workers in worker_counts:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+                "--log-level",
+                "warning",
+            ],
+            env={**os.environ, "NMDC_SCHEMA_INDEX": index_path},
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            while True:
+                try:
+                    httpx.get(base_url + "/")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.2)
+
+            async def load() -> int:
+                done = 0
+                async with httpx.AsyncClient(
+                    base_url=base_url, limits=httpx.Limits(max_connections=concurrency)
+                ) as client:
+                    deadline = timer() + seconds
+
+                    async def requester(offset: int) -> None:
+                        nonlocal done
+                        i = offset
+                        while timer() < deadline:
+                            await client.get(paths[i % len(paths)])
+                            done += 1
+                            i += concurrency
+
+                    await asyncio.gather(*(requester(i) for i in range(concurrency)))
+                return done
+
+            results[f"{workers} workers requests per second"] = (
+                asyncio.run(load()) / seconds
+            )
+            memory = [memory_kib(pid) for pid in process_tree(server.pid)]
+            results[f"{workers} workers total Rss MiB"] = (
+                sum(m["Rss"] for m in memory) / 1024
+            )
+            results[f"{workers} workers total Pss MiB"] = (
+                sum(m["Pss"] for m in memory) / 1024
+            )
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def report(title: str, results: Dict[str, float]) -> None:
+    print(title)
+    for name, value in results.items():
+        print(
+            f"  {name}: {value:.4f}"
+            if isinstance(value, float)
+            else f"  {name}: {value}"
+        )
+
+
+if __name__ == "__main__":
+    nmdc_view = load_schema_view()
+    report("LinkML object encoding (seconds)", bench_linkml_encoding(nmdc_view))
+    nmdc_index = build_schema_index(nmdc_view)
+    report("global vs. usage slot diffs (seconds)", bench_slot_diff(nmdc_index))
+    report("class typecode rows (seconds)", bench_typecode_resolution())
+    report("lookups during slow TSV fetches (seconds)", bench_mixed_load())
+    report("lookups during a whole-schema report (seconds)", bench_heavy_reports())
+    report("lookups during a schema reload (seconds)", bench_reload_latency())
+    report("uvicorn workers sharing a mapped schema index", bench_workers())
+    report("schema versions held separately vs. interned", bench_version_store())
+    report("indexing a changed schema (seconds)", bench_incremental_index())
+    report("class hierarchy queries (seconds)", bench_class_hierarchy(nmdc_view))
@@ -1,12 +1,43 @@
+import asyncio
+import gc
+import hashlib
+import json
 import logging
+import mmap
+import os
 import pprint
+import threading
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from timeit import default_timer as timer
 
+import httpx
+import pytest
+import requests
+from deepdiff import DeepDiff
 from linkml.utils.schema_builder import SchemaBuilder
 from linkml_runtime import SchemaView
+from linkml_runtime.dumpers import json_dumper
 from starlette.testclient import TestClient
 
+import app.class_hierarchy as ch
+import app.linkml_json as lj
+import app.main as am
+import app.mapped_tables as mt
+import app.schema_compare as scmp
+import app.schema_documents as sdoc
+import app.schema_index as si
+import app.schema_source as ss
+import app.schema_state as sst
+import app.schema_versions as sv
+import app.schema_workers as sw
+import app.slot_diff as sd
+import app.tsv_columns as tc
 import app.utilities as au
+import benchmarks
+from app.http_session import close_async_client, make_session
 from app.main import app
 
 # configure logger
@@ -72,11 +103,9 @@ def test_integration_for_study():
 
     syntax = au.get_syntax_from_structpat(structpat)
 
-    typecode_name = au.extract_typecode_name_from_syntax(syntax)
-
     settings = au.get_schema_settings(nmdc_view)
 
-    typecode_value = au.get_typecode_from_settings_by_name(typecode_name, settings)
+    typecode_value = au.get_typecode_from_syntax(syntax, settings)
 
     assert typecode_value == expected_typecode
 
@@ -157,3 +186,1136 @@ def test_sending_typecodes():
     rows = au.get_typcodes_by_ancestor_whole_schema(view=nmdc_view, slot_name=slot_name)
 
     au.send_class_typecodes_to_tsv(data=rows, output_file_name="nmdc_class_typecodes.tsv")
+
+
+def test_schema_source_prefers_package(monkeypatch):
+    monkeypatch.delenv(ss.SCHEMA_FILE_ENV, raising=False)
+    monkeypatch.delenv(ss.ALLOW_REMOTE_ENV, raising=False)
+
+    source = ss.find_schema_source()
+
+    assert source.origin == "package"
+    assert source.view().schema.name == "NMDC"
+
+
+def test_schema_source_from_file(monkeypatch, tmp_path):
+    schema_file = tmp_path / "nmdc.yaml"
+    schema_file.write_text(ss.source_from_package().schema)
+    monkeypatch.setenv(ss.SCHEMA_FILE_ENV, str(schema_file))
+
+    source = ss.find_schema_source()
+
+    assert source.origin == "file"
+    assert source.location == str(schema_file)
+
+
+def test_schema_source_remote_is_opt_in(monkeypatch):
+    monkeypatch.delenv(ss.SCHEMA_FILE_ENV, raising=False)
+    monkeypatch.setattr(ss, "source_from_package", lambda: None)
+
+    monkeypatch.delenv(ss.ALLOW_REMOTE_ENV, raising=False)
+    try:
+        ss.find_schema_source()
+        assert False, "expected a RuntimeError without the remote opt-in"
+    except RuntimeError:
+        pass
+
+    monkeypatch.setenv(ss.ALLOW_REMOTE_ENV, "true")
+    source = ss.find_schema_source()
+    assert source.origin == "url"
+    assert source.location == ss.DEFAULT_SCHEMA_URL
+
+
+def test_schema_index_round_trip(monkeypatch, tmp_path):
+    index_file = tmp_path / "nmdc_schema_index.bin"
+
+    si.write_schema_index(am.schema_holder.state.index, str(index_file))
+
+    with monkeypatch.context() as m:
+        m.setattr(si, "build_index_from_source", pytest.fail)
+        reloaded = si.load_schema_index(str(index_file), source_loader=lambda: am.schema_holder.state.source)
+
+    assert reloaded == am.schema_holder.state.index
+    assert reloaded.digest == si.compute_digest(reloaded)
+
+    # an index of another schema document is rebuilt from the source instead of being served
+    schema_file = tmp_path / "small.yaml"
+    schema_file.write_text(SMALL_SCHEMA.format(version="1", extra_class="Sample"))
+    monkeypatch.setenv(ss.SCHEMA_FILE_ENV, str(schema_file))
+    monkeypatch.setenv(si.SCHEMA_INDEX_ENV, str(index_file))
+    state = sst.load_schema_state()
+    assert state.index.name == state.view().schema.name
+    assert "Sample" in state.index.class_slots
+    assert state.index_path is None
+
+
+def test_schema_index_file_is_mapped(tmp_path):
+    index_file = tmp_path / "nmdc_schema_index.bin"
+    si.write_schema_index(am.schema_holder.state.index, str(index_file))
+
+    mapped = si.read_schema_index(str(index_file))
+
+    assert isinstance(mapped.induced_slots, mt.MappedNestedTable)
+    assert mapped.get_induced_slot("id", "Study") == am.schema_holder.state.index.get_induced_slot("id", "Study")
+    assert mapped.get_induced_slot("id", "Nope") is None
+    assert list(mapped.induced_slots["Study"]) == sorted(am.schema_holder.state.index.induced_slots["Study"])
+    assert "Study" in mapped.class_slots and "Nope" not in mapped.class_slots
+    assert mapped.resolve_id("nmdc:sty-11-abc123") == ("sty", ["Study"])
+    lookups = []
+    table = mapped.typecode_classes
+
+    class CountedTable:
+        def get(self, typecode, default=None):
+            lookups.append(typecode)
+            return table.get(typecode, default)
+
+    mapped.typecode_classes = CountedTable()
+    resolve = mapped.id_resolver()
+    assert [resolve(f"nmdc:{t}-11-{n}") for t, n in [("sty", 1), ("sty", 2), ("nope", 3), ("nope", 4)]] == [
+        ("sty", ["Study"]), ("sty", ["Study"]), ("nope", []), ("nope", []),
+    ]
+    assert lookups == ["sty", "nope"]
+    mapped.typecode_classes = table
+    assert mapped.typecode_rows() == am.schema_holder.state.index.typecode_rows()
+
+    index_file.write_bytes(b"not an index")
+    with pytest.raises(ValueError):
+        si.read_schema_index(str(index_file))
+
+
+def test_mapped_tables_with_empty_and_non_ascii_keys(tmp_path):
+    writer = mt.TableWriter(0)
+    flat = writer.add_table({"b": 2, "ä": [1], "a": {"x": None}})
+    nested = writer.add_nested_table({"B": {"y": 1, "x": 2}, "A": {}, "Ä": {"é": "e"}})
+    path = tmp_path / "tables.bin"
+    path.write_bytes(writer.blob)
+
+    with open(path, "rb") as table_file:
+        buffer = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    table = mt.MappedTable.from_location(buffer, flat)
+    nested_table = mt.MappedNestedTable(buffer, nested)
+
+    assert dict(table) == {"a": {"x": None}, "b": 2, "ä": [1]}
+    assert table.get("c") is None and table.get(1) is None
+    assert list(nested_table) == ["A", "B", "Ä"]
+    assert nested_table["A"] == {}
+    assert dict(nested_table["B"]) == {"x": 2, "y": 1}
+    assert nested_table["Ä"]["é"] == "e"
+    with pytest.raises(KeyError):
+        nested_table["B"]["z"]
+
+
+SMALL_SCHEMA = """
+id: http://example.org/small
+name: small
+version: "{version}"
+imports:
+  - linkml:types
+default_range: string
+classes:
+  Thing:
+    slots: [id, name]
+  {extra_class}:
+    is_a: Thing
+slots:
+  id:
+    identifier: true
+  name: {{}}
+"""
+
+
+def test_schema_reloads_are_swapped_in_whole(monkeypatch, tmp_path):
+    schema_file = tmp_path / "small.yaml"
+    schema_file.write_text(SMALL_SCHEMA.format(version="1", extra_class="Sample"))
+    monkeypatch.setenv(ss.SCHEMA_FILE_ENV, str(schema_file))
+    monkeypatch.delenv(si.SCHEMA_INDEX_ENV, raising=False)
+    monkeypatch.setenv(am.ADMIN_TOKEN_ENV, "secret")
+    holder = sst.SchemaHolder(sst.load_schema_state(), index_directory=str(tmp_path / "indexes"))
+    monkeypatch.setattr(am, "schema_holder", holder)
+    admin = {"Authorization": "Bearer secret"}
+
+    old_state = holder.state
+    assert client.get("/get_slot_class_usage/name/Sample").status_code == 200
+    resp = client.post("/admin/reload_schema/", headers=admin)
+    assert resp.json()["reloaded"] is False
+
+    schema_file.write_text(SMALL_SCHEMA.format(version="2", extra_class="Study"))
+    assert client.post("/admin/reload_schema/").status_code == 403
+    resp = client.post("/admin/reload_schema/", headers=admin)
+    assert resp.json()["reloaded"] is True
+    assert resp.json()["version"] == "2"
+    assert holder.state is not old_state
+    assert isinstance(holder.state.index.induced_slots, mt.MappedNestedTable)
+    assert client.get("/get_slot_class_usage/name/Study").json()["owner"] == "Study"
+    assert client.get("/get_slot_class_usage/name/Sample").status_code == 404
+    # whoever took the old state still has all of the old version
+    assert old_state.index.version == "1"
+    assert old_state.index.get_induced_slot("name", "Sample")["owner"] == "Sample"
+
+    schema_file.write_text("classes: [")
+    assert client.post("/admin/reload_schema/", headers=admin).status_code == 500
+    status = client.get("/admin/schema_status/", headers=admin).json()
+    assert status["version"] == "2"
+    assert status["reloads"] == 1
+    assert status["last_error"]
+
+
+def test_schema_reloads_reach_every_worker(monkeypatch, tmp_path):
+    schema_file = tmp_path / "small.yaml"
+    schema_file.write_text(SMALL_SCHEMA.format(version="1", extra_class="Sample"))
+    monkeypatch.setenv(ss.SCHEMA_FILE_ENV, str(schema_file))
+    monkeypatch.delenv(si.SCHEMA_INDEX_ENV, raising=False)
+    index_dir = tmp_path / "indexes"
+    builds = []
+
+    def builder(func, *args):
+        path = func(*args)
+        # long enough for a concurrent reload to start building too, if nothing stopped it
+        time.sleep(0.2)
+        builds.append(path)
+        return path
+
+    # two uvicorn workers
+    first = sst.SchemaHolder(sst.load_schema_state(), index_directory=str(index_dir), builder=builder)
+    second = sst.SchemaHolder(sst.load_schema_state(), index_directory=str(index_dir), builder=builder)
+
+    schema_file.write_text(SMALL_SCHEMA.format(version="2", extra_class="Study"))
+    assert first.reload() is True
+    assert second.current().index.version == "2"
+    assert second.current().index_path == first.state.index_path
+    # the other worker finds the change already indexed
+    assert second.reload() is False
+    assert builds == [first.state.index_path, None]
+    version_2_path = first.state.index_path
+
+    schema_file.write_text(SMALL_SCHEMA.format(version="3", extra_class="Sample"))
+    assert first.reload() is True
+    # still mapped by the second worker
+    assert os.path.exists(version_2_path)
+    in_flight = second.state
+    assert second.current().index.version == "3"
+    assert os.path.exists(version_2_path)
+    del in_flight
+    assert sst.remove_unused_index_files(str(index_dir), first.state.index_path) == [version_2_path]
+    assert sorted(os.listdir(index_dir)) == sorted(
+        [sst.BUILD_LOCK_FILE, sst.CURRENT_INDEX_FILE, os.path.basename(first.state.index_path)]
+    )
+
+    # workers whose timers go off together build the new version once
+    builds.clear()
+    schema_file.write_text(SMALL_SCHEMA.format(version="4", extra_class="Study"))
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        reloaded = sorted(pool.map(lambda holder: holder.reload(), [first, second]))
+    assert reloaded == [False, True]
+    assert len([path for path in builds if path is not None]) == 1
+    assert first.current().index.version == second.current().index.version == "4"
+
+    # a worker started later doesn't go back to an index published by an earlier run
+    schema_file.write_text(SMALL_SCHEMA.format(version="5", extra_class="Sample"))
+    restarted = sst.SchemaHolder(sst.load_schema_state(), index_directory=str(index_dir))
+    assert restarted.current().index.version == "5"
+
+    # only an index file in the directory itself is ever served
+    outside = tmp_path / f"{sst.INDEX_FILE_PREFIX}{'0' * 64}.bin"
+    si.write_schema_index(first.state.index, str(outside))
+    (index_dir / sst.CURRENT_INDEX_FILE).write_text(str(outside))
+    assert restarted.current().index.version == "5"
+
+    index_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        sst.SchemaHolder(sst.load_schema_state(), index_directory=str(index_dir)).reload()
+
+
+def test_schema_versions_share_identical_definitions(monkeypatch, tmp_path):
+    locations = {}
+    for version, extra_class in [("1", "Sample"), ("2", "Study")]:
+        schema_file = tmp_path / f"small_{version}.yaml"
+        schema_file.write_text(SMALL_SCHEMA.format(version=version, extra_class=extra_class))
+        locations[version] = str(schema_file)
+    versions = sv.SchemaVersions(locations=sv.parse_versions(",".join(f"{v}={l}" for v, l in locations.items())))
+    monkeypatch.setattr(am, "schema_versions", versions)
+
+    assert client.get("/schema_versions/").json()["available"] == ["1", "2"]
+    assert client.get("/get_global_slot/id", params={"version": "1"}).json()["name"] == "id"
+    assert client.get("/get_slot_class_usage/name/Sample", params={"version": "1"}).json()["owner"] == "Sample"
+    assert client.get("/get_slot_class_usage/name/Study", params={"version": "2"}).json()["owner"] == "Study"
+    assert client.get("/get_slot_class_usage/name/Study", params={"version": "1"}).status_code == 404
+    assert client.get("/get_global_slot/id", params={"version": "3"}).status_code == 404
+    # the current version doesn't need to be listed
+    current = am.schema_holder.state.index.version
+    assert client.get("/get_global_slot/id", params={"version": current}).status_code == 200
+
+    index_1 = versions.states["1"].index
+    index_2 = versions.states["2"].index
+    assert index_1.version == "1" and index_2.version == "2"
+    assert index_1.global_slots["id"] is index_2.global_slots["id"]
+    assert index_1.induced_slots["Thing"]["name"] is index_2.induced_slots["Thing"]["name"]
+    assert index_1.induced_slots["Sample"]["name"] != index_2.induced_slots["Study"]["name"]
+    assert versions.store.shared > 0
+
+    with pytest.raises(ValueError):
+        sv.parse_versions("1.0")
+
+
+EVOLVING_SCHEMA = """
+id: http://example.org/evolving
+name: evolving
+version: "{version}"
+imports:
+  - linkml:types
+default_range: string
+classes:
+  Thing:
+    slots: [id, name]
+  Sample:
+    is_a: Thing
+    slots: [depth]
+  Study:
+    is_a: Thing
+    slot_usage:
+      name:
+        required: {name_required}
+  {extra_class}:
+    slots: [{extra_slot}]
+slots:
+  id:
+    identifier: true
+  name: {{}}
+  depth:
+    description: {depth_description}
+  notes: {{}}
+"""
+
+
+def test_schema_index_reinduces_only_what_changed(monkeypatch, tmp_path):
+    old_settings = dict(version="1", name_required="false", extra_class="Note", extra_slot="notes", depth_description="meters")
+    schema_file = tmp_path / "evolving.yaml"
+    schema_file.write_text(EVOLVING_SCHEMA.format(**old_settings))
+    previous_path = str(tmp_path / "previous.bin")
+    si.write_schema_index(si.build_schema_index(SchemaView(str(schema_file))), previous_path)
+    previous = si.read_schema_index(previous_path)
+
+    induced = []
+    induce = si.induced_slot_to_dict
+    monkeypatch.setattr(si, "induced_slot_to_dict", lambda view, s, c: induced.append((c, s)) or induce(view, s, c))
+
+    unchanged = si.build_schema_index(SchemaView(str(schema_file)), previous=previous)
+    assert induced == []
+    assert unchanged.digest == previous.digest
+
+    # Study's slot_usage, depth's description, and a new class that lists name, which changes name's domain_of
+    schema_file.write_text(
+        EVOLVING_SCHEMA.format(version="2", name_required="true", extra_class="Note", extra_slot="name", depth_description="feet")
+    )
+    incremental = si.build_schema_index(SchemaView(str(schema_file)), previous=previous)
+    assert sorted(induced) == [("Note", "name"), ("Sample", "depth"), ("Sample", "name"), ("Study", "id"), ("Study", "name"), ("Thing", "name")]
+    assert incremental == si.build_schema_index(SchemaView(str(schema_file)))
+    assert incremental.induced_slots["Study"]["name"]["required"] is True
+    assert "Note" in incremental.induced_slots["Thing"]["name"]["domain_of"]
+    assert incremental.induced_slots["Sample"]["depth"]["description"] == "feet"
+
+
+def test_class_hierarchy_matches_schema_view():
+    view = ss.source_from_package().view()
+    hierarchy = ch.hierarchy_of_view(view)
+    assert ch.hierarchy_of_view(view) is hierarchy
+    for class_name in view.all_classes():
+        assert hierarchy.ancestors(class_name) == view.class_ancestors(class_name)
+        assert hierarchy.descendants(class_name) == sorted(view.class_descendants(class_name))
+        assert hierarchy.descendants(class_name, reflexive=False) == sorted(
+            view.class_descendants(class_name, reflexive=False)
+        )
+    assert au.get_ancestors(view, "Biosample") == ["Biosample", "MaterialEntity", "NamedThing"]
+    assert au.get_ancestors(view, "NoSuchClass") is None
+    assert hierarchy.is_a("Biosample", "NamedThing")
+    assert not hierarchy.is_a("NamedThing", "Biosample")
+    with pytest.raises(ValueError):
+        hierarchy.is_a("Biosample", "NoSuchClass")
+
+    # mixins count, and a modified view gets a new hierarchy
+    view.get_class("Study").mixins.append("Biosample")
+    view.set_modified()
+    assert ch.hierarchy_of_view(view) is not hierarchy
+    assert ch.hierarchy_of_view(view).is_a("Study", "MaterialEntity")
+
+    # and the hierarchy doesn't keep the view alive
+    view = SchemaView(SchemaBuilder("a").add_class("A").schema)
+    assert ch.hierarchy_of_view(view).ancestors("A") == ["A"]
+    view_id = id(view)
+    del view
+    # SchemaView's own methods are lru_cached per view
+    for method in vars(SchemaView).values():
+        getattr(method, "cache_clear", lambda: None)()
+    gc.collect()
+    assert view_id not in ch.view_hierarchies
+
+
+def test_class_hierarchy_endpoints():
+    index = am.schema_holder.state.index
+    resp = client.get("/class_ancestors/Biosample")
+    assert resp.json() == index.ancestors["Biosample"]
+    assert client.get("/class_ancestors/Biosample", params={"reflexive": False}).json() == index.ancestors["Biosample"][1:]
+    descendants = client.get("/class_descendants/NamedThing").json()
+    assert "Biosample" in descendants and descendants == sorted(descendants)
+    assert client.get("/class_ancestors/NoSuchClass").status_code == 404
+
+    assert client.get("/is_a/Biosample/NamedThing").json()["is_a"] is True
+    assert client.get("/is_a/NamedThing/Biosample").json()["is_a"] is False
+    assert client.get("/is_a/Biosample/NoSuchClass").status_code == 404
+
+    pairs = [
+        {"class_name": "Biosample", "ancestor": "NamedThing"},
+        {"class_name": "Study", "ancestor": "Biosample"},
+    ]
+    resp = client.post("/is_a/", json={"pairs": pairs})
+    assert [result["is_a"] for result in resp.json()["results"]] == [True, False]
+    resp = client.post("/is_a/", json={"pairs": [{"class_name": "Nope", "ancestor": "NamedThing"}]})
+    assert resp.status_code == 400
+
+
+def test_schema_index_contents():
+    index = am.schema_holder.state.index
+
+    assert index.typecodes["Study"] == "sty"
+    assert index.typecodes["Biosample"] == "bsm"
+    assert "id" in index.class_slots["Study"]
+    assert index.ancestors["Biosample"][0] == "Biosample"
+    assert "NamedThing" in index.ancestors["Biosample"]
+    assert index.global_slots["id"]["name"] == "id"
+
+
+def test_get_class_typecode_endpoint():
+    resp = client.get("/get_class_typecode/Study")
+    assert resp.status_code == 200
+    assert resp.json() == "sty"
+
+
+def test_induced_slot_table_matches_schema_view():
+    # a fresh view, since induced_slot() results depend on what the view has induced before
+    view = ss.source_from_package().view()
+
+    for class_name in ["Study", "Biosample", "Database"]:
+        for slot_name in am.schema_holder.state.index.class_slots[class_name]:
+            expected = si.induced_slot_to_dict(view, slot_name, class_name)
+            assert am.schema_holder.state.index.get_induced_slot(slot_name, class_name) == expected
+
+
+def test_get_slot_class_usage_endpoint():
+    resp = client.get("/get_slot_class_usage/id/Study")
+    assert resp.status_code == 200
+    assert resp.json()["structured_pattern"]["syntax"].startswith("{id_nmdc_prefix}:sty-")
+
+    resp = client.get("/get_slot_class_usage/no_such_slot/Study")
+    assert resp.status_code == 404
+
+
+def test_get_slot_class_usage_unknown_names_skip_the_view(monkeypatch):
+    state = sst.SchemaState(am.schema_holder.state.index, am.schema_holder.state.source)
+    monkeypatch.setattr(am.schema_holder, "state", state)
+
+    assert client.get("/get_slot_class_usage/id/NoSuchClass").status_code == 404
+    assert client.get("/get_slot_class_usage/no_such_slot/Study").status_code == 404
+    assert state._view is None
+    # a real slot the class doesn't use still gets induced
+    assert client.get("/get_slot_class_usage/samp_name/Study").status_code == 200
+    assert state._view is not None
+
+
+def test_response_cache_etags():
+    first = client.get("/get_global_slot/id")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.json()["name"] == "id"
+
+    repeat = client.get("/get_global_slot/id", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.headers["etag"] == etag
+
+    other = client.get("/get_slot_class_usage/id/Study", headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["etag"] != etag
+
+
+def test_response_cache_is_bounded():
+    cache = am.ResponseCache(max_entries=2)
+
+    for key in ["a", "b", "c"]:
+        cache.get_or_build(key, lambda: {"key": key})
+
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.get_or_build("c", lambda: None).body == b'{"key":"c"}'
+    assert cache.hits == 1
+
+
+def test_linkml_json_matches_json_dumper():
+    view = am.get_schema_view()
+    objs = list(view.all_slots().values()) + list(view.all_classes().values()) + list(view.all_enums().values())
+    objs += [view.induced_class("Study"), view.induced_slot("id", "Study").structured_pattern]
+
+    for obj in objs:
+        expected = json.loads(json_dumper.dumps(obj))
+        assert lj.linkml_to_jsonable(obj) == expected
+        assert json.loads(lj.dumps(obj)) == expected
+
+
+def test_linkml_json_skips_the_json_dumper(monkeypatch):
+    view = am.get_schema_view()
+    expected = json.loads(json_dumper.dumps(view.get_class("Study")))
+    # the timing comparison is benchmarks.bench_linkml_encoding()
+    monkeypatch.setattr(json_dumper, "dumps", pytest.fail)
+    monkeypatch.setattr(json, "loads", pytest.fail)
+
+    assert lj.linkml_to_jsonable(view.get_class("Study")) == expected
+    assert lj.dumps(view.get_class("Study"))
+
+
+def test_slot_diff_matches_deepdiff():
+    pairs = benchmarks.global_usage_pairs(am.schema_holder.state.index)
+    pairs += [
+        (None, {"name": "x"}),
+        ({"name": "x", "range": "string"}, {"name": "x", "range": 5}),
+        ({"aliases": ["a", "b"]}, {"aliases": ["b", "c", "c"]}),
+        ({"structured_pattern": {"syntax": "a"}}, {"structured_pattern": {"syntax": "b"}}),
+    ]
+
+    for global_slot, usage_slot in pairs:
+        expected = DeepDiff(global_slot, usage_slot, ignore_order=True)
+        actual = sd.diff_slot_dicts(global_slot, usage_slot)
+        assert json.loads(lj.dumps(actual)) == json.loads(lj.dumps(expected))
+
+
+def test_slot_diff_only_hands_lists_that_gain_and_lose_items_to_deepdiff(monkeypatch):
+    pairs = benchmarks.global_usage_pairs(am.schema_holder.state.index)
+    handed_over = []
+    deep_diff = sd.DeepDiff
+    monkeypatch.setattr(sd, "DeepDiff", lambda old, new, **kwargs: handed_over.append((old, new)) or deep_diff(old, new, **kwargs))
+
+    for global_slot, usage_slot in pairs:
+        sd.diff_slot_dicts(global_slot, usage_slot)
+
+    # the timing comparison is benchmarks.bench_slot_diff()
+    assert len(handed_over) < len(pairs) // 10
+    for old, new in handed_over:
+        assert isinstance(old, list) and isinstance(new, list)
+        assert [item for item in new if item not in old] and [item for item in old if item not in new]
+
+
+def test_get_global_usage_diff_endpoint():
+    resp = client.get("/get_global_usage_diff/part_of/Biosample")
+    assert resp.status_code == 200
+    assert resp.json()["values_changed"]["root['range']"] == {"new_value": "Study", "old_value": "NamedThing"}
+
+
+def test_global_usage_diff_report():
+    resp = client.get("/get_global_usage_diff_report/")
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    keyed = {(line["class"], line["slot"]): line["diff"] for line in lines}
+
+    assert keyed[("Biosample", "part_of")]["values_changed"]["root['range']"]["new_value"] == "Study"
+    assert keyed[("Biosample", "part_of")] == client.get("/get_global_usage_diff/part_of/Biosample").json()
+    assert len(keyed) < len(benchmarks.global_usage_pairs(am.schema_holder.state.index))
+
+    resp = client.get("/get_global_usage_diff_report/", params={"format": "tsv"})
+    assert resp.status_code == 200
+    rows = resp.text.splitlines()
+    assert rows[0] == "class\tslot\tcategory\tpath\told_value\tnew_value"
+    assert "Biosample\tpart_of\tvalues_changed\troot['range']\tNamedThing\tStudy" in rows
+
+
+def test_get_class_typecode_table_endpoint():
+    resp = client.get("/get_class_typecode_table/")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/tab-separated-values")
+    rows = resp.text.splitlines()
+    assert rows[0] == "class\tuses_id\ttypecode"
+    assert "Study\ttrue\tsty" in rows
+
+    resp = client.get("/get_class_typecode_table/", headers={"Accept": "application/json"})
+    assert resp.status_code == 200
+    assert {"class": "Biosample", "uses_id": "true", "typecode": "bsm"} in resp.json()
+
+    repeat = client.get("/get_class_typecode_table/", headers={"If-None-Match": resp.headers["etag"], "Accept": "application/json"})
+    assert repeat.status_code == 304
+
+
+def test_resolve_ids():
+    assert am.schema_holder.state.index.typecode_classes["sty"] == ["Study"]
+    assert si.typecode_from_id("nmdc:sty-11-abc123") == "sty"
+
+    resp = client.post("/resolve_ids/", json=["nmdc:sty-11-abc123", "nmdc:bsm-11-x", "bogus"])
+    assert resp.status_code == 200
+    assert resp.json() == [
+        {"id": "nmdc:sty-11-abc123", "typecode": "sty", "classes": ["Study"]},
+        {"id": "nmdc:bsm-11-x", "typecode": "bsm", "classes": ["Biosample"]},
+        {"id": "bogus", "typecode": "bogus", "classes": []},
+    ]
+
+    resp = client.post("/resolve_ids/", data="nmdc:sty-11-abc123\n\nnmdc:bsm-11-x", headers={"Content-Type": "text/plain"})
+    assert resp.status_code == 200
+    assert resp.text.splitlines() == ["id\ttypecode\tclasses", "nmdc:sty-11-abc123\tsty\tStudy", "nmdc:bsm-11-x\tbsm\tBiosample"]
+    assert resp.headers["content-type"].startswith("text/tab-separated-values")
+
+    resp = client.post("/resolve_ids/", data=b"\xffnmdc:sty-11-abc123\n", headers={"Content-Type": "text/plain"})
+    assert resp.status_code == 400
+    resp = client.post("/resolve_ids/", data=b"[\xff]", headers={"Content-Type": "application/json"})
+    assert resp.status_code == 400
+    assert client.post("/resolve_ids/", data=b"", headers={"Content-Type": "text/plain"}).text == "id\ttypecode\tclasses\n"
+
+    assert client.get("/get_typecode_classes/bsm").json() == ["Biosample"]
+    assert client.get("/get_typecode_classes/nope").status_code == 404
+
+
+def test_single_pass_typecodes_match_whole_schema():
+    # fresh views, so neither function benefits from the other's induction
+    expected = au.get_typcodes_by_ancestor_whole_schema(view=ss.source_from_package().view(), slot_name="id")
+    rows = au.get_typecodes_by_ancestor_single_pass(view=ss.source_from_package().view(), slot_name="id")
+
+    assert rows == expected
+    keyed_rows = {row["class"]: row for row in rows}
+    assert keyed_rows["Biosample"]["typecode"] == "bsm"
+
+
+def test_single_pass_typecodes_induce_each_class_once():
+    view = ss.source_from_package().view()
+    induced = []
+    induce = view.induced_slot
+    view.induced_slot = lambda slot_name, class_name: induced.append(class_name) or induce(slot_name, class_name)
+    view.induced_class = pytest.fail
+
+    rows = au.get_typecodes_by_ancestor_single_pass(view=view, slot_name="id")
+
+    # the timing comparison is benchmarks.bench_typecode_resolution()
+    assert len(induced) == len(set(induced)) <= len(rows)
+
+
+def test_typecodes_by_ancestor_endpoint(schema_server, monkeypatch, tmp_path):
+    schema_server.documents["/schemas/nmdc.yaml"] = ss.source_from_package().schema.encode("utf-8")
+    monkeypatch.setattr(am, "view_cache", au.ViewCache(loader=lambda url: sdoc.load_view(url, sdoc.DocumentCache(str(tmp_path)))))
+    params = {"schema_url": f"http://127.0.0.1:{schema_server.server_port}/schemas/nmdc.yaml"}
+    expected = au.get_typecodes_by_ancestor_single_pass(view=ss.source_from_package().view(), slot_name="id")
+
+    resp = client.get("/get_typecodes_by_ancestor/", params=params, headers={"Accept": "application/json"})
+    assert resp.status_code == 200
+    assert resp.json() == expected
+    resp = client.get("/get_typecodes_by_ancestor/", params=params)
+    assert resp.text.splitlines()[0] == "class\tuses_id\tfrom_ancestor\ttypecode"
+    assert "Biosample\tTrue\tBiosample\tbsm" in resp.text.splitlines()
+    assert am.view_cache.stats()["misses"] == 1
+
+    # classes in a cycle have no typecode rows to leave out
+    schema_server.documents["/schemas/cycle.yaml"] = (
+        b"id: http://example.org/cycle\nname: cycle\nclasses:\n  A:\n    is_a: B\n  B:\n    mixins: [A]\n  C: {}\n"
+    )
+    params = {"schema_url": f"http://127.0.0.1:{schema_server.server_port}/schemas/cycle.yaml"}
+    assert client.get("/get_typecodes_by_ancestor/", params=params).status_code == 422
+
+
+def test_view_cache_evicts_least_recently_used():
+    view_cache = au.ViewCache(max_entries=2)
+    for name in ["a", "b", "c"]:
+        view_cache.update_from_schema(f"http://example.org/{name}", SchemaBuilder(name).schema)
+        if name == "b":
+            view_cache.get_view("http://example.org/a")
+
+    assert list(view_cache.cache) == ["http://example.org/a", "http://example.org/c"]
+    assert view_cache.stats()["evictions"] == 1
+
+    view_cache.max_bytes = 1
+    view_cache.evict()
+    assert list(view_cache.cache) == ["http://example.org/c"]
+    assert view_cache.total_bytes > 1
+
+
+def test_view_cache_expires_entries():
+    now = [0.0]
+    view_cache = au.ViewCache(ttl=10, clock=lambda: now[0])
+    view_cache.update_from_schema("http://example.org/a", SchemaBuilder("a").schema)
+    view_cache.cache["http://example.org/b"] = SchemaView(SchemaBuilder("b").schema)
+
+    now[0] = 5.0
+    assert view_cache.get_view("http://example.org/a") is not None
+    assert view_cache.get_view("http://example.org/b") is not None
+    now[0] = 11.0
+    assert view_cache.get_view("http://example.org/a") is None
+    assert view_cache.get_view("http://example.org/b") is not None
+    assert view_cache.stats()["expirations"] == 1
+
+
+def test_view_cache_measures_views_outside_the_lock(monkeypatch):
+    view_cache = au.ViewCache()
+    lock_free = []
+
+    def take_lock():
+        if not view_cache.lock.acquire(timeout=1):
+            return False
+        view_cache.lock.release()
+        return True
+
+    def measure(view):
+        # a reader on another thread can take the lock while a view is being measured
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            lock_free.append(pool.submit(take_lock).result())
+        return 1
+
+    monkeypatch.setattr(au, "approximate_size", measure)
+    view_cache.update_from_schema("http://example.org/a", SchemaBuilder("a").schema)
+    view_cache.cache["http://example.org/b"] = SchemaView(SchemaBuilder("b").schema)
+    assert view_cache.get_view("http://example.org/b") is not None
+    # found by a caller that missed and went on to claim the load
+    view_cache.cache["http://example.org/c"] = SchemaView(SchemaBuilder("c").schema)
+    assert view_cache.claim("http://example.org/c")[1:] == (None, False)
+
+    assert lock_free == [True, True, True]
+    assert view_cache.sizes == {"http://example.org/a": 1, "http://example.org/b": 1, "http://example.org/c": 1}
+
+
+def test_view_cache_counts_hits_and_misses(tmp_path):
+    schema_file = tmp_path / "a.yaml"
+    schema_file.write_text("id: http://example.org/a\nname: a\n")
+    view_cache = au.ViewCache()
+
+    first = view_cache.trust_cache(str(schema_file))
+    second = view_cache.trust_cache(str(schema_file))
+    assert view_cache.trust_cache(str(tmp_path / "missing.yaml")) is None
+
+    assert first is second
+    assert first.schema.name == "a"
+    stats = view_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+
+def test_view_cache_loads_concurrent_misses_once():
+    loaded = []
+
+    def slow_loader(url):
+        loaded.append(url)
+        time.sleep(0.2)
+        if url.endswith("broken"):
+            raise ValueError(f"can't load {url}")
+        return SchemaView(SchemaBuilder("a").schema)
+
+    view_cache = au.ViewCache(loader=slow_loader)
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        views = list(pool.map(view_cache.trust_cache, ["http://example.org/a"] * 10))
+        failures = list(pool.map(view_cache.trust_cache, ["http://example.org/broken"] * 10))
+
+    assert loaded == ["http://example.org/a", "http://example.org/broken"]
+    assert all(view is views[0] for view in views)
+    assert failures == [None] * 10
+    assert view_cache.stats()["coalesced"] == 18
+    assert not view_cache.in_flight
+
+
+def test_view_cache_loads_concurrent_async_misses_once():
+    loaded = []
+
+    async def slow_loader(url):
+        loaded.append(url)
+        await asyncio.sleep(0.2)
+        return SchemaView(SchemaBuilder("a").schema)
+
+    async def load_concurrently():
+        return await asyncio.gather(
+            *(view_cache.trust_cache_async("http://example.org/a", slow_loader) for _ in range(10))
+        )
+
+    view_cache = au.ViewCache()
+    views = asyncio.run(load_concurrently())
+
+    assert loaded == ["http://example.org/a"]
+    assert all(view is views[0] for view in views)
+    assert view_cache.stats()["coalesced"] == 9
+    assert not view_cache.in_flight
+    assert asyncio.run(view_cache.trust_cache_async("http://example.org/a", slow_loader)) is views[0]
+    assert loaded == ["http://example.org/a"]
+
+
+class SchemaDocumentHandler(BaseHTTPRequestHandler):
+    """Serves the documents in its server's documents dict, with ETags, and records each response's status."""
+
+    # keep-alive
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.client_ports.add(self.client_address[1])
+        if self.path in self.server.redirects:
+            self.server.statuses.append((self.path, 301))
+            self.send_response(301)
+            self.send_header("Location", self.server.redirects[self.path])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.server.forced_statuses.get(self.path):
+            # e.g. a 5xx from the origin, or a proxy's 304 for a copy the client doesn't have
+            status = self.server.forced_statuses[self.path].pop(0)
+            self.server.statuses.append((self.path, status))
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.documents.get(self.path)
+        if body is None:
+            self.server.statuses.append((self.path, 404))
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+        status = 304 if self.headers.get("If-None-Match") == etag else 200
+        self.server.statuses.append((self.path, status))
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0" if status == 304 else str(len(body)))
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def schema_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SchemaDocumentHandler)
+    server.documents = {
+        "/schemas/main.yaml": b"id: http://example.org/main\nname: main\nimports:\n  - linkml:types\n  - sub\n"
+        b"classes:\n  MainClass:\n    is_a: SubClass\n",
+        "/schemas/sub.yaml": b"id: http://example.org/sub\nname: sub\nclasses:\n  SubClass: {}\n",
+    }
+    server.redirects = {}
+    # path -> statuses to answer with, in order, whatever the request
+    server.forced_statuses = {}
+    server.statuses = []
+    server.client_ports = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_document_cache_revalidates_across_restarts(schema_server, tmp_path):
+    url = f"http://127.0.0.1:{schema_server.server_port}/schemas/main.yaml"
+
+    first_cache = sdoc.DocumentCache(directory=str(tmp_path))
+    view = sdoc.load_view(url, first_cache)
+    assert {"MainClass", "SubClass"} <= set(view.all_classes())
+    assert schema_server.statuses == [("/schemas/main.yaml", 200), ("/schemas/sub.yaml", 200)]
+
+    # a new process with the same cache directory
+    restarted_cache = sdoc.DocumentCache(directory=str(tmp_path))
+    schema_server.statuses.clear()
+    view = sdoc.load_view(url, restarted_cache)
+    assert {"MainClass", "SubClass"} <= set(view.all_classes())
+    assert schema_server.statuses == [("/schemas/main.yaml", 304), ("/schemas/sub.yaml", 304)]
+    assert (restarted_cache.downloads, restarted_cache.revalidations) == (0, 2)
+
+    schema_server.documents["/schemas/sub.yaml"] += b"  OtherSubClass: {}\n"
+    schema_server.statuses.clear()
+    view = sdoc.load_view(url, restarted_cache)
+    assert "OtherSubClass" in view.all_classes()
+    assert schema_server.statuses == [("/schemas/main.yaml", 304), ("/schemas/sub.yaml", 200)]
+
+    schema_server.shutdown()
+    schema_server.server_close()
+    # a new session, since kept-alive connections outlive the server's listening socket
+    offline_cache = sdoc.DocumentCache(directory=str(tmp_path), session=make_session())
+    view = sdoc.load_view(url, offline_cache)
+    assert "OtherSubClass" in view.all_classes()
+    assert offline_cache.stale == 2
+
+
+def test_document_cache_handles_server_errors_and_unexpected_304s(schema_server, tmp_path):
+    url = f"http://127.0.0.1:{schema_server.server_port}/schemas/sub.yaml"
+    document = schema_server.documents["/schemas/sub.yaml"]
+
+    async def fetch_async(document_cache):
+        async with httpx.AsyncClient() as async_client:
+            return await document_cache.fetch_async(url, async_client)
+
+    for attempt, fetch in enumerate([lambda c: c.fetch(url), lambda c: asyncio.run(fetch_async(c))]):
+        document_cache = sdoc.DocumentCache(directory=str(tmp_path / f"cache_{attempt}"))
+        schema_server.statuses.clear()
+
+        # nothing is cached yet, so the document is requested again without validators
+        schema_server.forced_statuses["/schemas/sub.yaml"] = [304]
+        digest = fetch(document_cache)
+        assert schema_server.statuses == [("/schemas/sub.yaml", 304), ("/schemas/sub.yaml", 200)]
+        with open(document_cache.document_path(digest), "rb") as document_file:
+            assert document_file.read() == document
+
+        schema_server.forced_statuses["/schemas/sub.yaml"] = [500]
+        assert fetch(document_cache) == digest
+        assert (document_cache.downloads, document_cache.stale) == (1, 1)
+
+        empty_cache = sdoc.DocumentCache(directory=str(tmp_path / "empty"))
+        schema_server.forced_statuses["/schemas/sub.yaml"] = [500]
+        with pytest.raises((requests.HTTPError, httpx.HTTPStatusError)):
+            fetch(empty_cache)
+        schema_server.forced_statuses["/schemas/sub.yaml"] = [304, 304]
+        with pytest.raises((requests.HTTPError, httpx.HTTPStatusError)):
+            fetch(empty_cache)
+        assert empty_cache.downloads == 0
+
+
+def test_url_schema_sources_use_the_document_cache(schema_server, monkeypatch, tmp_path):
+    url = f"http://127.0.0.1:{schema_server.server_port}/schemas/main.yaml"
+    document_cache = sdoc.DocumentCache(directory=str(tmp_path))
+    monkeypatch.setattr(sdoc, "default_document_cache", document_cache)
+    monkeypatch.setattr(ss, "default_document_cache", document_cache)
+
+    index = si.build_index_from_source(sv.source_from_location(url))
+
+    assert "MainClass" in index.class_slots
+    assert index.source_digest == document_cache.fetch(url)
+    # main.yaml is downloaded once, for the view, and only revalidated for the digest
+    assert sorted(schema_server.statuses)[:3] == [("/schemas/main.yaml", 200), ("/schemas/main.yaml", 304), ("/schemas/main.yaml", 304)]
+    assert ("/schemas/sub.yaml", 200) in schema_server.statuses
+    assert document_cache.downloads == 2
+
+
+def test_document_cache_stays_private(schema_server, tmp_path):
+    url = f"http://127.0.0.1:{schema_server.server_port}/schemas/main.yaml"
+    cache_dir = tmp_path / "documents"
+    document_cache = sdoc.DocumentCache(directory=str(cache_dir))
+    view = sdoc.load_view(url, document_cache)
+
+    assert "SubClass" in view.all_classes()
+    assert stat.S_IMODE(cache_dir.stat().st_mode) == 0o700
+    parsed = list((cache_dir / "parsed").iterdir())
+    assert len(parsed) == 2
+    assert all(json.loads(path.read_text())["name"] in {"main", "sub"} for path in parsed)
+
+    cache_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        sdoc.load_view(url, sdoc.DocumentCache(directory=str(cache_dir)))
+
+
+def test_compare_slots_in_two_classes(schema_server, monkeypatch, tmp_path):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}/schemas"
+    schema_server.documents["/schemas/other.yaml"] = (
+        b"id: http://example.org/other\nname: other\nimports:\n  - linkml:types\n"
+        b"classes:\n  OtherClass:\n    slots: [shared, other_only]\nslots:\n  shared: {}\n  other_only: {}\n"
+    )
+    schema_server.documents["/schemas/sub.yaml"] = (
+        b"id: http://example.org/sub\nname: sub\nclasses:\n  SubClass:\n    slots: [shared, sub_only]\n"
+        b"slots:\n  shared: {}\n  sub_only: {}\n"
+    )
+    monkeypatch.setattr(am, "view_cache", au.ViewCache(loader=lambda url: sdoc.load_view(url, sdoc.DocumentCache(str(tmp_path)))))
+    form = {
+        "schema_1_url": f"{base_url}/main.yaml",
+        "class_1_name": "MainClass",
+        "schema_2_url": f"{base_url}/other.yaml",
+        "class_2_name": "OtherClass",
+    }
+
+    resp = client.post("/compare_slots_in_two_classes/", data=form)
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "Slots only found in main's MainClass": ["sub_only"],
+        "Slots only found in other's OtherClass": ["other_only"],
+    }
+
+    fetches = len(schema_server.statuses)
+    repeat = client.post("/compare_slots_in_two_classes/", data=form)
+    assert repeat.json() == resp.json()
+    assert len(schema_server.statuses) == fetches
+    # both views came from the cache, without being loaded again
+    assert (am.view_cache.stats()["hits"], am.view_cache.stats()["misses"]) == (2, 2)
+
+    resp = client.post("/compare_slots_in_two_classes/", data={**form, "class_2_name": "Nope"})
+    assert resp.status_code == 404
+    resp = client.post("/compare_slots_in_two_classes/", data={**form, "schema_2_url": f"{base_url}/missing.yaml"})
+    assert resp.status_code == 502
+
+
+def test_schema_work_runs_in_worker_processes(schema_server, monkeypatch, tmp_path):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}/schemas"
+    schema_server.documents["/schemas/other.yaml"] = (
+        b"id: http://example.org/other\nname: other\nclasses:\n  OtherClass:\n    slots: [shared, other_only]\n"
+        b"slots:\n  shared: {}\n  other_only: {}\n"
+    )
+    schema_server.documents["/schemas/sub.yaml"] = (
+        b"id: http://example.org/sub\nname: sub\nclasses:\n  SubClass:\n    slots: [shared, sub_only]\n"
+        b"slots:\n  shared: {}\n  sub_only: {}\n"
+    )
+    # spawned workers read their settings from the environment
+    monkeypatch.setenv(sdoc.DOCUMENT_CACHE_DIR_ENV, str(tmp_path))
+    monkeypatch.setattr(am, "PROCESS_POOL_SIZE", 1)
+    monkeypatch.setattr(sw, "PROCESS_POOL_SIZE", 1)
+    form = {
+        "schema_1_url": f"{base_url}/main.yaml",
+        "class_1_name": "MainClass",
+        "schema_2_url": f"{base_url}/other.yaml",
+        "class_2_name": "OtherClass",
+    }
+    try:
+        resp = client.post("/compare_slots_in_two_classes/", data=form)
+        assert resp.json() == {
+            "Slots only found in main's MainClass": ["sub_only"],
+            "Slots only found in other's OtherClass": ["other_only"],
+        }
+        assert sw.process_pool is not None
+
+        resp = client.post("/compare_schemas/", data={"schema_1_url": form["schema_1_url"], "schema_2_url": form["schema_2_url"]})
+        assert resp.status_code == 200
+        assert resp.json()["classes"]["added"] == ["OtherClass"]
+
+        resp = client.post("/compare_slots_in_two_classes/", data={**form, "class_2_name": "Nope"})
+        assert resp.status_code == 404
+        resp = client.post("/compare_slots_in_two_classes/", data={**form, "schema_2_url": f"{base_url}/missing.yaml"})
+        assert resp.status_code == 502
+    finally:
+        sw.shutdown_process_pool()
+    assert sw.process_pool is None
+
+
+def test_compare_schemas_only_diffs_changed_elements():
+    old = scmp.fingerprint_schema(ss.source_from_package().view())
+    changed_text = (
+        ss.source_from_package().schema
+        .replace("A study summarizes the overall goal", "A study states the overall goal")
+        .replace("  Study:\n", "  NewThing:\n    is_a: NamedThing\n  Study:\n", 1)
+    )
+    new = scmp.fingerprint_schema(SchemaView(changed_text))
+
+    report = scmp.compare_schemas(old, new)
+
+    assert report["summary"]["classes"] == {"added": 1, "removed": 0, "changed": 1, "unchanged": 69}
+    assert report["summary"]["slots"]["changed"] == 0
+    assert report["classes"]["added"] == ["NewThing"]
+    assert list(report["classes"]["changed"]["Study"]["values_changed"]) == ["root['description']"]
+    assert scmp.compare_schemas(old, old)["summary"]["slots"]["unchanged"] == len(old.hashes["slots"])
+
+
+def test_compare_schemas_endpoint(schema_server, monkeypatch, tmp_path):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}/schemas"
+    schema_server.documents["/schemas/main_v2.yaml"] = (
+        b"id: http://example.org/main\nname: main\nversion: v2\nimports:\n  - linkml:types\n"
+        b"classes:\n  MainClass:\n    description: changed\n"
+    )
+    monkeypatch.setattr(am, "view_cache", au.ViewCache(loader=lambda url: sdoc.load_view(url, sdoc.DocumentCache(str(tmp_path)))))
+
+    resp = client.post("/compare_schemas/", data={"schema_1_url": f"{base_url}/main.yaml", "schema_2_url": f"{base_url}/main_v2.yaml"})
+
+    assert resp.status_code == 200
+    report = resp.json()
+    assert report["schema_2"] == {"name": "main", "version": "v2", "url": f"{base_url}/main_v2.yaml"}
+    assert report["classes"]["removed"] == ["SubClass"]
+    assert report["classes"]["changed"]["MainClass"] == {
+        "dictionary_item_added": ["root['description']"],
+        "dictionary_item_removed": ["root['is_a']"],
+    }
+    assert report["summary"]["types"]["unchanged"] > 0
+
+
+def test_tsv_terms_are_streamed_over_one_connection(schema_server):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}/tsv"
+    schema_server.documents["/tsv/defs.tsv"] = (
+        b"SAFE Structured comment name\tdescription\n>slot\tdirective\n>>\t\n\n"
+        b"depth\tthe depth\ntemp\tthe temperature\ntemp\tduplicate\nph\n"
+    )
+    schema_server.documents["/tsv/assignments.tsv"] = (
+        b"Structured comment name\tclass\n>slot\t>class\n>>\t\ndepth\twater\nsalinity\twater\n"
+    )
+
+    form = {"def_file_url": f"{base_url}/defs.tsv", "assignment_file_url": f"{base_url}/assignments.tsv"}
+    resp = client.post("/undefined_mixs_assigned_terms/", data=form)
+    assert resp.json() == ["salinity"]
+    # the endpoints' connections are kept alive
+    client_ports = set(schema_server.client_ports)
+    assert client.post("/undefined_mixs_assigned_terms/", data=form).json() == ["salinity"]
+    assert schema_server.client_ports == client_ports
+
+    # the ph row is too short to have a description
+    form = {**form, "def_file_term_col": "description", "assignment_file_term_col": "class"}
+    resp = client.post("/unassigned_mixs_defined_terms/", data=form)
+    assert resp.json() == ["duplicate", "the depth", "the temperature"]
+
+    resp = client.post("/unassigned_mixs_defined_terms/", data={"def_file_url": f"{base_url}/missing.tsv"})
+    assert resp.status_code == 502
+    resp = client.post("/unassigned_mixs_defined_terms/", data={"def_file_url": f"{base_url}/defs.tsv", "def_file_term_col": "nope"})
+    assert resp.status_code == 400
+
+
+def test_async_fetches_follow_redirects(schema_server, tmp_path):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}"
+    schema_server.documents["/tsv/defs.tsv"] = b"SAFE Structured comment name\n>slot\n>>\ndepth\n"
+    schema_server.documents["/tsv/assignments.tsv"] = b"Structured comment name\n>slot\n>>\ndepth\nsalinity\n"
+    schema_server.redirects["/moved/defs.tsv"] = "/tsv/defs.tsv"
+    schema_server.redirects["/moved/sub.yaml"] = f"{base_url}/schemas/sub.yaml"
+
+    form = {"def_file_url": f"{base_url}/moved/defs.tsv", "assignment_file_url": f"{base_url}/tsv/assignments.tsv"}
+    assert client.post("/undefined_mixs_assigned_terms/", data=form).json() == ["salinity"]
+    assert ("/moved/defs.tsv", 301) in schema_server.statuses
+
+    async def load():
+        try:
+            return await sdoc.load_view_async(f"{base_url}/moved/sub.yaml", sdoc.DocumentCache(str(tmp_path)))
+        finally:
+            await close_async_client()
+
+    view = asyncio.run(load())
+    assert "SubClass" in view.all_classes()
+    assert ("/moved/sub.yaml", 301) in schema_server.statuses
+
+
+def test_tsv_column_sets_are_revalidated(schema_server):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}/tsv"
+    schema_server.documents["/tsv/defs.tsv"] = b"SAFE Structured comment name\n>slot\n>>\ndepth\ntemp\n"
+    schema_server.documents["/tsv/assignments.tsv"] = b"Structured comment name\n>slot\n>>\ndepth\nsalinity\n"
+    form = {"def_file_url": f"{base_url}/defs.tsv", "assignment_file_url": f"{base_url}/assignments.tsv"}
+
+    assert client.post("/undefined_mixs_assigned_terms/", data=form).json() == ["salinity"]
+    assert client.post("/unassigned_mixs_defined_terms/", data=form).json() == ["temp"]
+    assert [status for _, status in schema_server.statuses] == [200, 200, 304, 304]
+
+    schema_server.documents["/tsv/defs.tsv"] += b"salinity\n"
+    assert client.post("/undefined_mixs_assigned_terms/", data=form).json() == []
+    assert schema_server.statuses[-2:] == [("/tsv/assignments.tsv", 304), ("/tsv/defs.tsv", 200)]
+
+    tsv_cache = tc.TSVColumnCache(max_entries=1)
+    tsv_cache.get(f"{base_url}/defs.tsv", "SAFE Structured comment name")
+    tsv_cache.get(f"{base_url}/assignments.tsv", "Structured comment name")
+    assert list(tsv_cache.entries) == [(f"{base_url}/assignments.tsv", "Structured comment name", 2)]
+
+
+def test_term_set_operations(schema_server):
+    base_url = f"http://127.0.0.1:{schema_server.server_port}/tsv"
+    schema_server.documents["/tsv/slotdefs.tsv"] = b"SAFE Structured comment name\n>slot\n>>\ndepth\ntemp\n"
+    schema_server.documents["/tsv/classdefs.tsv"] = b"SAFE checklist\n>class\n>>\nwater\nsoil\n"
+    schema_server.documents["/tsv/assignments.tsv"] = (
+        b"Structured comment name\tclass\n>slot\t>class\n>>\t\ndepth\twater\nsalinity\twater\nsalinity\tair\nph\n"
+    )
+    body = {
+        "sources": [
+            {"name": "defined_terms", "url": f"{base_url}/slotdefs.tsv", "column": "SAFE Structured comment name"},
+            {"name": "assigned_terms", "url": f"{base_url}/assignments.tsv", "column": "Structured comment name"},
+            {"name": "defined_packages", "url": f"{base_url}/classdefs.tsv", "column": "SAFE checklist"},
+            {"name": "assigned_packages", "url": f"{base_url}/assignments.tsv", "column": "class"},
+        ],
+        "operations": [
+            {"operation": "difference", "sources": ["assigned_terms", "defined_terms"]},
+            {"operation": "difference", "sources": ["defined_packages", "assigned_packages"]},
+            {"operation": "intersection", "sources": ["defined_terms", "assigned_terms"]},
+            {"operation": "union", "sources": ["defined_packages", "assigned_packages"]},
+        ],
+    }
+
+    resp = client.post("/term_set_operations/", json=body)
+
+    assert resp.status_code == 200
+    assert [result["terms"] for result in resp.json()["results"]] == [
+        ["ph", "salinity"],
+        ["soil"],
+        ["depth"],
+        ["air", "soil", "water"],
+    ]
+    assert resp.json()["sources"]["assigned_packages"]["term_count"] == 2
+    assert sorted(path for path, _ in schema_server.statuses) == ["/tsv/assignments.tsv", "/tsv/classdefs.tsv", "/tsv/slotdefs.tsv"]
+
+    resp = client.post("/term_set_operations/", json={"sources": body["sources"][:2]})
+    assert [result["terms"] for result in resp.json()["results"]] == [["temp"], ["ph", "salinity"]]
+    assert [status for _, status in schema_server.statuses[3:]] == [304, 304]
+
+    resp = client.post("/term_set_operations/", json={**body, "operations": [{"operation": "union", "sources": ["nope"]}]})
+    assert resp.status_code == 400